@@ -0,0 +1,111 @@
+"""
+Compares VectorStore index types against the exact Flat baseline.
+
+Uses synthetic clustered unit vectors (no embedding model needed), so it can
+run at million-chunk scale:
+    python analysis/ann_benchmark.py --num-vectors 1000000 --specs HNSW32 IVF4096,PQ48
+
+Compressed specs (SQ8, SQfp16, PQ...) are also measured with exact re-ranking
+from the full-precision file at each --rerank-factors value; index_MB is the
+resident index size (the full-precision file is memory-mapped).
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(current_dir), 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+
+from vector_store import VectorStore, is_lossy_spec
+
+DEFAULT_SPECS = ["IVF1024,Flat", "IVF1024,PQ48", "HNSW32", "SQ8", "SQfp16", "PQ48"]
+
+
+def synthetic_vectors(n, dimension=384, clusters=256, seed=0):
+    """Gaussian clusters on the unit sphere - closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype('float32')
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dimension)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def build_store(spec, vectors, batch_size=100_000):
+    store = VectorStore(dimension=vectors.shape[1], index_path="", index_spec=spec)
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch_size):
+        batch = vectors[i:i + batch_size]
+        store.add(batch, [{"source": "synthetic", "text": ""}] * len(batch))
+    store.train(force=True)
+    return store, time.perf_counter() - start
+
+
+def measure(store, queries, k, **search_kwargs):
+    latencies = []
+    hits = []
+    for q in queries:
+        start = time.perf_counter()
+        _, indices = store.search_ids(q.reshape(1, -1), k, **search_kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits.append(indices[0])
+    return np.array(latencies), np.array(hits)
+
+
+def index_mb(store):
+    return store.memory_stats()["index_bytes"] / 2**20
+
+
+def recall_at_k(ground_truth, found):
+    per_query = [len(set(gt) & set(f)) / len(gt) for gt, f in zip(ground_truth, found)]
+    return float(np.mean(per_query))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num-vectors", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--specs", nargs="+", default=DEFAULT_SPECS)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 4, 10])
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.num_vectors + args.queries)
+    corpus, queries = vectors[:args.num_vectors], vectors[args.num_vectors:]
+
+    flat, build_time = build_store("Flat", corpus)
+    latencies, ground_truth = measure(flat, queries, args.k)
+    print(f"{'spec':<18}{'param':<22}{'build_s':>9}{'index_MB':>10}{'p50_ms':>9}{'p99_ms':>9}{'recall@k':>10}")
+    print(f"{'Flat':<18}{'-':<22}{build_time:>9.2f}{index_mb(flat):>10.1f}{np.percentile(latencies, 50):>9.3f}"
+          f"{np.percentile(latencies, 99):>9.3f}{1.0:>10.3f}")
+
+    for spec in args.specs:
+        store, build_time = build_store(spec, corpus)
+        if "HNSW" in spec:
+            sweep = [("ef_search", v) for v in args.ef_search]
+        elif "IVF" in spec:
+            sweep = [("nprobe", v) for v in args.nprobe]
+        else:
+            sweep = [(None, None)]
+        rerank_factors = args.rerank_factors if is_lossy_spec(spec) else [1]
+
+        for name, value in sweep:
+            for rerank_factor in rerank_factors:
+                kwargs = {name: value} if name else {}
+                latencies, found = measure(store, queries, args.k, rerank_factor=rerank_factor, **kwargs)
+                labels = ([f"{name}={value}"] if name else []) + \
+                         ([f"rerank={rerank_factor}"] if is_lossy_spec(spec) else [])
+                label = ",".join(labels) or "-"
+                print(f"{spec:<18}{label:<22}{build_time:>9.2f}{index_mb(store):>10.1f}"
+                      f"{np.percentile(latencies, 50):>9.3f}{np.percentile(latencies, 99):>9.3f}"
+                      f"{recall_at_k(ground_truth, found):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Retrieval and indexing benchmark suite over synthetic construction corpora.
+
+For each corpus size and VectorStore configuration it measures chunking
+throughput, index build time (add / train / BM25 / save), on-disk size, load
+time, RSS and single and batched query latency percentiles, plus embedding
+chunks/sec for the real model, and writes everything to a JSON report:
+    python analysis/benchmark_suite.py --sizes 1000 10000 100000 --configs Flat SQ8 HNSW32 Flat/4
+    python analysis/benchmark_suite.py --sizes 1000000 --configs IVF4096,PQ48 HNSW32/8 --embed-sample 0
+    python analysis/benchmark_suite.py --baseline reports/previous.json   # exit 1 on regressions
+
+A config is a FAISS spec, optionally with "/N" for N shards. Index vectors are
+synthetic clustered unit vectors (as in ann_benchmark.py), so a 1M-chunk build
+doesn't need hours of encoding; embedding throughput is measured separately on
+--embed-sample chunks. Load time, RSS and query latencies are measured in a
+fresh process per configuration, with the index opened the way the app opens it.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(current_dir), 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+
+from sharded_store import create_store, open_store
+from vector_store import version_dir
+from synthetic_corpus import synthetic_documents, synthetic_chunks
+
+DEFAULT_CONFIGS = ["Flat", "SQ8", "HNSW32", "IVF256,Flat", "Flat/4"]
+ADD_BATCH = 10_000
+
+# Report metrics compared against --baseline: path -> True if higher is better
+TRACKED_METRICS = {
+    ("build", "total_s"): False,
+    ("disk_mb",): False,
+    ("load", "load_s"): False,
+    ("load", "index_rss_after_queries_mb"): False,
+    ("query", "single_p50_ms"): False,
+    ("query", "single_p99_ms"): False,
+    ("query", "batch_per_query_p50_ms"): False,
+}
+# Absolute changes below these are timer / allocator noise, whatever the relative change
+NOISE_FLOOR = {"_s": 0.01, "_ms": 0.05, "_mb": 1.0}
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current RSS where /proc is not available (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def percentiles(latencies_ms, prefix):
+    return {f"{prefix}_p{p}_ms": round(float(np.percentile(latencies_ms, p)), 4) for p in (50, 95, 99)}
+
+
+class ClusteredVectors:
+    """Gaussian clusters on the unit sphere; batch i is the same for a given seed, so builds are repeatable."""
+    def __init__(self, dimension=384, clusters=256, seed=0):
+        self.seed = seed
+        self.centers = np.random.default_rng(seed).standard_normal((clusters, dimension)).astype('float32')
+
+    def batch(self, n, batch_no):
+        rng = np.random.default_rng([self.seed, batch_no])
+        vectors = self.centers[rng.integers(0, len(self.centers), size=n)]
+        vectors = vectors + 0.6 * rng.standard_normal(vectors.shape).astype('float32')
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def queries(self, n):
+        return self.batch(n, 2**31)
+
+
+def measure_chunking(num_chunks, seed):
+    from build_index import advanced_chunking
+    chunks = documents = characters = 0
+    seconds = 0.0
+    for doc in synthetic_documents(seed):
+        start = time.perf_counter()
+        sections = []
+        chunks += len(advanced_chunking(doc["text"], doc["source"], sections))
+        seconds += time.perf_counter() - start
+        documents += 1
+        characters += len(doc["text"])
+        if chunks >= num_chunks:
+            break
+    return {"documents": documents, "chunks": chunks, "mb": round(characters / 2**20, 2),
+            "seconds": round(seconds, 3), "chunks_per_s": round(chunks / seconds, 1)}
+
+
+def measure_embedding(num_texts, seed, batch_size=None):
+    from embedder import Embedder
+    texts = [chunk for _, chunks, _ in synthetic_chunks(num_texts, seed) for chunk in chunks]
+    embedder = Embedder(cache_dir=None, **({"batch_size": batch_size} if batch_size else {}))
+    embedder.embed(texts[:8])
+    start = time.perf_counter()
+    embedder.embed(texts)
+    seconds = time.perf_counter() - start
+    return {"model": embedder.model_name, "precision": embedder.precision, "batch_size": embedder.batch_size,
+            "texts": len(texts), "seconds": round(seconds, 3), "chunks_per_s": round(len(texts) / seconds, 1)}
+
+
+def parse_config(config):
+    spec, _, shards = config.partition("/")
+    return spec, int(shards or 1)
+
+
+def build(index_path, spec, num_shards, num_chunks, seed, vectors, bm25=True):
+    shutil.rmtree(index_path, ignore_errors=True)
+    store = create_store(index_path, spec, num_shards)
+    timings = {"add_s": 0.0}
+    pending = []
+
+    def flush(batch_no):
+        embeddings = vectors.batch(len(pending), batch_no)
+        start = time.perf_counter()
+        store.add(embeddings, pending)
+        timings["add_s"] += time.perf_counter() - start
+        pending.clear()
+
+    batches = 0
+    for doc, chunks, sections in synthetic_chunks(num_chunks, seed):
+        pending.extend({"source": doc["source"], "text": chunk, "section": section, "batch": "benchmark"}
+                       for chunk, section in zip(chunks, sections))
+        if len(pending) >= ADD_BATCH:
+            flush(batches)
+            batches += 1
+    if pending:
+        flush(batches)
+
+    start = time.perf_counter()
+    store.train(force=True)
+    timings["train_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    if bm25:
+        for shard in store.shards:
+            shard.update_sparse_index()
+    timings["bm25_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    store.save()
+    timings["save_s"] = time.perf_counter() - start
+    timings["total_s"] = sum(timings.values())
+    return {name: round(value, 3) for name, value in timings.items()}
+
+
+def disk_mb(index_path):
+    total = 0
+    for root, _, files in os.walk(version_dir(index_path)):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return round(total / 2**20, 2)
+
+
+def probe(index_path, queries_file, k, query_batch):
+    """Runs in a fresh process: load time, RSS and query latencies of the saved index."""
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    store = open_store(index_path)
+    # Sharded stores open shards lazily: time loading all of them, not just the config
+    if store.num_shards > 1:
+        for i in range(store.num_shards):
+            store.shard(i)
+    load = {"load_s": round(time.perf_counter() - start, 4)}
+    load["index_rss_mb"] = round(rss_mb() - baseline_rss, 2)
+
+    queries = np.load(queries_file)
+    single = []
+    for q in queries:
+        start = time.perf_counter()
+        store.search_batch(q.reshape(1, -1), k=k)
+        single.append((time.perf_counter() - start) * 1000)
+    batched = []
+    for i in range(0, len(queries), query_batch):
+        batch = queries[i:i + query_batch]
+        start = time.perf_counter()
+        store.search_batch(batch, k=k)
+        batched.append((time.perf_counter() - start) * 1000 / len(batch))
+    # After the queries, so memory-mapped pages they touched are counted
+    load["rss_mb"] = round(rss_mb(), 2)
+    load["index_rss_after_queries_mb"] = round(load["rss_mb"] - baseline_rss, 2)
+    query = {"k": k, "queries": len(queries), "batch_size": query_batch}
+    query.update(percentiles(single, "single"))
+    query.update(percentiles(batched, "batch_per_query"))
+    return {"load": load, "query": query}
+
+
+def run_probe(index_path, queries_file, k, query_batch):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", index_path, "--queries-file", queries_file,
+         "--k", str(k), "--query-batch", str(query_batch)],
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "probe failed")
+    # The store logs while loading; the result is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=current_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import faiss
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "faiss": faiss.__version__}
+
+
+def _metric(entry, path):
+    for key in path:
+        if not isinstance(entry, dict) or key not in entry:
+            return None
+        entry = entry[key]
+    return entry
+
+
+def compare(report, baseline, tolerance):
+    """Metrics worse than the baseline by more than tolerance (a fraction), as printable lines."""
+    regressions = []
+
+    def check(label, old, new, higher_is_better):
+        if old is None or new is None or not old:
+            return
+        floor = next((value for suffix, value in NOISE_FLOOR.items() if label.endswith(suffix)), 0)
+        if abs(new - old) < floor:
+            return
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{label}: {old} -> {new} ({change:+.0%})")
+
+    for name in ("embedding",):
+        check(f"{name} chunks_per_s", _metric(baseline, (name, "chunks_per_s")),
+              _metric(report, (name, "chunks_per_s")), True)
+    old_runs = {run["chunks"]: run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        old_run = old_runs.get(run["chunks"])
+        if old_run is None:
+            continue
+        check(f"{run['chunks']} chunking chunks_per_s", _metric(old_run, ("chunking", "chunks_per_s")),
+              _metric(run, ("chunking", "chunks_per_s")), True)
+        old_configs = {entry["config"]: entry for entry in old_run["configs"]}
+        for entry in run["configs"]:
+            old_entry = old_configs.get(entry["config"])
+            if old_entry is None:
+                continue
+            for path, higher_is_better in TRACKED_METRICS.items():
+                check(f"{run['chunks']} {entry['config']} {'.'.join(path)}",
+                      _metric(old_entry, path), _metric(entry, path), higher_is_better)
+    return regressions
+
+
+def print_run(run):
+    chunking = run["chunking"]
+    print(f"\n{run['chunks']} chunks ({chunking['documents']} documents, {chunking['mb']} MB): "
+          f"chunking {chunking['chunks_per_s']:.0f} chunks/s")
+    print(f"{'config':<16}{'build_s':>9}{'disk_MB':>9}{'load_ms':>9}{'rss_MB':>8}"
+          f"{'p50_ms':>9}{'p99_ms':>9}{'batch_p50':>10}")
+    for entry in run["configs"]:
+        if "error" in entry:
+            print(f"{entry['config']:<16} failed: {entry['error']}")
+            continue
+        load, query = entry["load"], entry["query"]
+        print(f"{entry['config']:<16}{entry['build']['total_s']:>9.2f}{entry['disk_mb']:>9.1f}"
+              f"{load['load_s'] * 1000:>9.1f}{load['index_rss_after_queries_mb']:>8.1f}"
+              f"{query['single_p50_ms']:>9.3f}{query['single_p99_ms']:>9.3f}{query['batch_per_query_p50_ms']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--query-batch", type=int, default=32)
+    parser.add_argument("--embed-sample", type=int, default=2000,
+                        help="chunks embedded with the real model (0 skips the embedding benchmark)")
+    parser.add_argument("--no-bm25", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="where indexes are built (default: a temp dir)")
+    parser.add_argument("--output", default="analysis/benchmark_report.json")
+    parser.add_argument("--baseline", default=None, help="earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--queries-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.queries_file, args.k, args.query_batch)))
+        return
+
+    report = {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+              "environment": environment(),
+              "settings": {name: value for name, value in vars(args).items()
+                           if name not in ("probe", "queries_file", "baseline", "output", "work_dir")},
+              "embedding": None, "runs": []}
+
+    if args.embed_sample:
+        report["embedding"] = measure_embedding(args.embed_sample, args.seed)
+        print(f"Embedding: {report['embedding']['chunks_per_s']:.1f} chunks/s "
+              f"({report['embedding']['texts']} chunks, {report['embedding']['precision']})")
+
+    vectors = ClusteredVectors(seed=args.seed)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="minirag-bench-")
+    queries_file = os.path.join(work_dir, "queries.npy")
+    os.makedirs(work_dir, exist_ok=True)
+    np.save(queries_file, vectors.queries(args.queries))
+    try:
+        for size in args.sizes:
+            run = {"chunks": size, "chunking": measure_chunking(size, args.seed), "configs": []}
+            for config in args.configs:
+                spec, num_shards = parse_config(config)
+                index_path = os.path.join(work_dir, f"{size}-{config.replace(',', '_').replace('/', '-')}")
+                entry = {"config": config, "spec": spec, "shards": num_shards}
+                print(f"Building {config} over {size} chunks...")
+                try:
+                    entry["build"] = build(index_path, spec, num_shards, size, args.seed, vectors,
+                                           bm25=not args.no_bm25)
+                    entry["disk_mb"] = disk_mb(index_path)
+                    entry.update(run_probe(index_path, queries_file, args.k, args.query_batch))
+                except Exception as e:
+                    entry["error"] = str(e)
+                finally:
+                    shutil.rmtree(index_path, ignore_errors=True)
+                run["configs"].append(entry)
+            report["runs"].append(run)
+            print_run(run)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
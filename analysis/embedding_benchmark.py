@@ -0,0 +1,106 @@
+"""
+Measures the Embedder's CPU backend settings: chunks/sec and embedding drift
+against the fp32 baseline (plain SentenceTransformer.encode with its defaults).
+
+Texts are the chunks of a document folder, repeated with a counter up to
+--num-texts, and nothing is cached:
+    python analysis/embedding_benchmark.py --num-texts 2000 --threads 1 4
+    python analysis/embedding_benchmark.py --batch-sizes 16 64 128 --processes 2 4
+
+Drift columns: mean / min cosine similarity to the baseline vectors, and the
+overlap of each chunk's 10 nearest neighbours with the baseline's (what
+retrieval actually sees).
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(current_dir), 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+
+from build_index import load_documents_from_folder, advanced_chunking
+from embedder import Embedder, POOL_MIN_TEXTS
+
+
+def load_texts(folder, num_texts):
+    """Returns (texts, number of distinct chunks at the start of texts)."""
+    chunks = [chunk for doc in load_documents_from_folder(folder)
+              for chunk in advanced_chunking(doc["text"], doc["source"])]
+    if not chunks:
+        raise SystemExit(f"No .md documents found in {folder}")
+    texts = [chunks[i % len(chunks)] + (f" ({i // len(chunks)})" if i >= len(chunks) else "")
+             for i in range(num_texts)]
+    return texts, min(len(chunks), num_texts)
+
+
+def timed(encode, texts, warmup):
+    encode(texts[:warmup])
+    start = time.perf_counter()
+    vectors = np.asarray(encode(texts), dtype='float32')
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def neighbour_overlap(baseline, vectors, k=10):
+    k = min(k, len(baseline) - 1)
+    if k <= 0:
+        return 1.0
+    expected = np.argsort(-(baseline @ baseline.T), axis=1)[:, 1:k + 1]
+    found = np.argsort(-(vectors @ vectors.T), axis=1)[:, 1:k + 1]
+    return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--folder", default="data")
+    parser.add_argument("--num-texts", type=int, default=1000)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "int8"])
+    parser.add_argument("--processes", type=int, nargs="*", default=[2])
+    args = parser.parse_args()
+
+    texts, distinct = load_texts(args.folder, args.num_texts)
+    print(f"{len(texts)} texts ({distinct} distinct chunks), {os.cpu_count()} CPUs")
+
+    torch.set_num_threads(args.threads[0])
+    reference = Embedder(args.model, cache_dir=None, threads=args.threads[0])
+    baseline, baseline_rate = timed(
+        lambda batch: reference.model.encode(batch, convert_to_numpy=True, normalize_embeddings=True),
+        texts, warmup=8)
+
+    print(f"{'config':<26}{'threads':>8}{'batch':>7}{'chunks/s':>10}{'speedup':>9}"
+          f"{'mean_cos':>10}{'min_cos':>9}{'nn@10':>7}")
+
+    def report(label, threads, batch_size, vectors, rate):
+        cosines = np.einsum("ij,ij->i", vectors, baseline)
+        overlap = neighbour_overlap(baseline[:distinct], vectors[:distinct])
+        print(f"{label:<26}{threads:>8}{batch_size:>7}{rate:>10.1f}{rate / baseline_rate:>9.2f}"
+              f"{cosines.mean():>10.5f}{cosines.min():>9.5f}{overlap:>7.3f}")
+
+    report("st.encode fp32 (baseline)", args.threads[0], 32, baseline, baseline_rate)
+
+    for threads in args.threads:
+        for precision in args.precisions:
+            embedder = Embedder(args.model, cache_dir=None, threads=threads, precision=precision)
+            for batch_size in args.batch_sizes:
+                embedder.batch_size = batch_size
+                vectors, rate = timed(embedder._encode, texts, warmup=8)
+                report(f"bucketed {precision}", threads, batch_size, vectors, rate)
+
+    for processes in args.processes:
+        embedder = Embedder(args.model, cache_dir=None, processes=processes)
+        # Warm-up starts the workers and loads their models
+        vectors, rate = timed(embedder._encode, texts, warmup=max(POOL_MIN_TEXTS, processes * embedder.batch_size))
+        report(f"pool x{processes} {embedder.precision}", max(1, (os.cpu_count() or 1) // processes),
+               embedder.batch_size, vectors, rate)
+        embedder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import time
 import re
 import pandas as pd
-from rag_pipeline import RAGPipeline
+from rag_pipeline import RAGPipeline, RETRIEVE_K
 
 TEST_QUESTIONS = [
     "What is the price of the Premier package?",
@@ -48,25 +48,35 @@ def run_evaluation():
     results = []
     total_start = time.time()
 
-    for question in TEST_QUESTIONS:
+    # Retrieval metrics: one embedding call and one search for the whole question set,
+    # at production's depth and re-ranking cut-off
+    retrieval_start = time.time()
+    all_sources = rag.retrieve_many(TEST_QUESTIONS, RETRIEVE_K, rerank_top_n=rag.rerank_top_n)
+    retrieval_latency = (time.time() - retrieval_start) / len(TEST_QUESTIONS)
+
+    for question, sources in zip(TEST_QUESTIONS, all_sources):
         print(f"Testing: {question}")
-        
+
+        # Answers come from run(), the production entry point (answer cache included)
         start_time = time.time()
         response = rag.run(question)
         latency = time.time() - start_time
-        
-        top_score = response["sources"][0]["score"] if response["sources"] else 0
-        grounded_overlap = _grounded_overlap(response["answer"], response["sources"])
-        fallback_used = "i don't have enough information" in response["answer"].lower()
+        answer = response["answer"]
+
+        top_score = sources[0]["score"] if sources else 0
+        grounded_overlap = _grounded_overlap(answer, response["sources"])
+        fallback_used = "i don't have enough information" in answer.lower()
 
         results.append({
             "Question": question,
-            "Answer_Length": len(response["answer"]),
+            "Answer_Length": len(answer),
             "Latency_Seconds": round(latency, 4),
+            "Retrieval_Seconds": round(retrieval_latency, 4),
             "Top_Confidence": round(top_score, 4),
-            "Sources_Retrieved": len(response["sources"]),
+            "Sources_Retrieved": len(sources),
             "Grounded_Overlap": grounded_overlap,
             "Fallback_Answer": fallback_used,
+            "Cached": response["cached"],
         })
 
     total_time = time.time() - total_start
@@ -0,0 +1,177 @@
+"""
+Measures cold start: where the time goes between launching a process and its
+first answered query.
+
+Every run is a fresh Python process (nothing imported, OS file cache aside),
+repeated --repeats times; the table shows medians in milliseconds:
+    python analysis/startup_benchmark.py --index-path index/assignment --repeats 5
+
+Variants:
+    warm-up      RAGPipeline(...) in the foreground, warm-up on (the default)
+    no-warm-up   the same without warm-up, showing what the first query pays instead
+    background   RAGPipeline(background=True): time until the constructor returns
+                 (what a UI waits for before its first paint) and until ready
+
+Rows: importing the app (rag_pipeline, with the heavy libraries deferred), then
+each heavy library, the model / index loads and warm-up (the "startup.*" spans),
+and the first and second query (retrieval, prompt assembly and LLM client setup;
+no LLM request is sent). The import chain is also profiled with -X importtime
+and summed per top-level package.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(current_dir), 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+
+# Measured one by one after the app import, in dependency order
+HEAVY_LIBRARIES = ["numpy", "faiss", "torch", "sentence_transformers", "openai", "tiktoken"]
+VARIANTS = {
+    "warm-up": {"background": False, "warm_up": True},
+    "no-warm-up": {"background": False, "warm_up": False},
+    "background": {"background": True, "warm_up": True},
+}
+QUERIES = ["What is the price per sqft of the Premier package?", "How are stage payments released from escrow?"]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def probe(index_path, background, warm_up):
+    """Runs in a fresh process. Returns phase -> milliseconds."""
+    phases = {}
+    started = time.perf_counter()
+    import metrics
+    from rag_pipeline import RAGPipeline
+    import llm_clients
+    phases["import_app"] = _ms(time.perf_counter() - started)
+
+    if not background:
+        for name in HEAVY_LIBRARIES:
+            start = time.perf_counter()
+            try:
+                __import__(name)
+            except ImportError:
+                continue
+            phases[f"import_{name}"] = _ms(time.perf_counter() - start)
+
+    with metrics.trace("startup") as trace:
+        start = time.perf_counter()
+        rag = RAGPipeline(index_path=index_path, use_answer_cache=False, background=background, warm_up=warm_up)
+        if background:
+            phases["constructor_returned"] = _ms(time.perf_counter() - started)
+            rag.wait_until_ready()
+        phases["load_total"] = _ms(time.perf_counter() - start)
+    if not background:
+        # The background thread has its own context, so its spans are not in this trace
+        phases.update((stage, ms) for stage, ms in trace.timings().items() if stage.startswith("startup."))
+    phases["ready"] = _ms(time.perf_counter() - started)
+
+    # Unique per run, so the persistent embedding cache never answers for the model
+    nonce = time.time_ns()
+    for label, query in zip(("first_query", "second_query"), QUERIES):
+        start = time.perf_counter()
+        hits = rag.retrieve(f"{query} ({nonce})")
+        rag.build_prompt(hits)
+        llm_clients.get_backend("Groq", rag.groq_base_url).client("startup-benchmark")
+        phases[label] = _ms(time.perf_counter() - start)
+    phases["ready_plus_first_query"] = round(phases["ready"] + phases["first_query"], 1)
+    return phases
+
+
+def run_probe(index_path, background, warm_up):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe", index_path,
+         "--probe-options", json.dumps({"background": background, "warm_up": warm_up})],
+        capture_output=True, text=True, check=True)
+    # The probe's own prints come first; its result is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(top):
+    """Cumulative import time (ms) per top-level package for the app and its heavy libraries."""
+    code = "import rag_pipeline\n" + "".join(
+        f"try:\n    import {name}\nexcept ImportError:\n    pass\n" for name in HEAVY_LIBRARIES)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=src_dir,
+                            capture_output=True, text=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us = int(line.split("|")[0].split(":")[1])
+        except ValueError:
+            continue   # the header line
+        package = line.split("|")[2].strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {package: round(us / 1000, 1) for package, us in ranked}
+
+
+def print_table(results):
+    variants = list(results)
+    rows = []
+    for variant in variants:
+        # Rows only some variants have go right after the row they follow there
+        previous = None
+        for row in results[variant]:
+            if row not in rows:
+                rows.insert(rows.index(previous) + 1 if previous else 0, row)
+            previous = row
+    width = max(len(row) for row in rows)
+    print(f"\n{'phase (median ms)':<{width}}" + "".join(f"{variant:>14}" for variant in variants))
+    for row in rows:
+        cells = "".join(f"{results[v][row]:>14.1f}" if row in results[v] else f"{'-':>14}" for v in variants)
+        print(f"{row:<{width}}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--index-path", default="index/assignment")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--top-imports", type=int, default=12,
+                        help="packages to list in the import profile (0 skips it)")
+    parser.add_argument("--output", help="also write the results as JSON")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--probe-options", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        options = json.loads(args.probe_options)
+        print(json.dumps(probe(args.probe, options["background"], options["warm_up"])))
+        return
+
+    results = {}
+    for variant in args.variants:
+        runs = []
+        for repeat in range(args.repeats):
+            print(f"{variant}: run {repeat + 1}/{args.repeats}")
+            runs.append(run_probe(os.path.abspath(args.index_path), **VARIANTS[variant]))
+        results[variant] = {phase: statistics.median(run[phase] for run in runs if phase in run)
+                            for phase in dict.fromkeys(phase for run in runs for phase in run)}
+    print_table(results)
+
+    report = {"index_path": args.index_path, "repeats": args.repeats, "phases_ms": results}
+    if args.top_imports:
+        report["import_ms_by_package"] = import_profile(args.top_imports)
+        print("\nImport time by package (ms, -X importtime):")
+        for package, ms in report["import_ms_by_package"].items():
+            print(f"  {package:<24}{ms:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Generates synthetic construction-style Markdown documents (package specs,
+pricing, materials, payment stages, warranties) for benchmarks.
+
+Documents are deterministic for a seed and generated lazily, so corpora of any
+size can be streamed without holding them in memory. Writing one to disk:
+    python analysis/synthetic_corpus.py corpus/10k --chunks 10000
+"""
+import os
+import sys
+import random
+import argparse
+import itertools
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(current_dir), 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+
+PACKAGES = ["Essential", "Premier", "Infinia", "Pinnacle", "Signature"]
+CITIES = ["Bengaluru", "Chennai", "Hyderabad", "Pune", "Mysuru", "Coimbatore"]
+SECTIONS = ["Package Pricing", "Structure", "Flooring", "Kitchen", "Bathroom", "Doors & Windows",
+            "Painting", "Electrical", "Plumbing", "Allowances", "Payment Schedule", "Warranty",
+            "Project Monitoring", "Design & Finalisation"]
+MATERIALS = {
+    "steel": ["JSW Neosteel", "Tata Tiscon", "Jindal Panther", "SAIL TMT"],
+    "cement": ["UltraTech", "ACC", "Birla A1", "Dalmia"],
+    "tiles": ["Kajaria", "Somany", "Johnson", "Nitco"],
+    "sanitaryware": ["Jaquar", "Hindware", "Cera", "Kohler"],
+    "paint": ["Asian Paints Royale", "Berger Silk", "Nerolac Impressions", "Dulux Velvet Touch"],
+    "wiring": ["Havells", "Finolex", "Polycab", "Anchor"],
+}
+STAGES = ["booking", "soil test and foundation", "plinth beam", "ground floor roof slab",
+          "brickwork and plastering", "flooring and tiling", "painting and fixtures", "handover"]
+SENTENCES = [
+    "The {package} package is priced at Rs. {rate} per sqft for {city} projects, excluding GST.",
+    "{category} for the {package} package is {brand}, with an allowance of Rs. {allowance} per sqft.",
+    "Upgrades beyond the {category} allowance of Rs. {allowance} are billed at actuals with a {margin}% margin.",
+    "Payment of {percent}% is due on completion of the {stage} stage and is released from escrow.",
+    "Structural warranty is {years} years; waterproofing is covered for {wp_years} years after handover.",
+    "A site engineer visits at least {visits} times a week and uploads progress photos to the app.",
+    "Quality checks cover {checks} points, including {category} brand verification against the BOQ.",
+    "Delays attributable to the contractor are compensated at Rs. {penalty} per day after {grace} days of grace.",
+    "Ceiling height is {height} ft and slabs use M{grade} concrete with {brand} reinforcement.",
+    "Design finalisation includes {revisions} revisions of the floor plan and 3D elevations before work starts.",
+]
+# Spec-sheet style bullets, which keep the average line about as long as in real documents
+FACTS = [
+    "{category}: {brand}",
+    "Rate: Rs. {rate}/sqft",
+    "Allowance: Rs. {allowance}/sqft",
+    "Warranty: {years} years",
+    "Stage payment ({stage}): {percent}%",
+    "Site visits: {visits} per week",
+    "Concrete grade: M{grade}",
+]
+
+
+def _line(rng, package):
+    category = rng.choice(list(MATERIALS))
+    template = rng.choice(SENTENCES) if rng.random() < 0.4 else "- " + rng.choice(FACTS)
+    return template.format(
+        package=package, city=rng.choice(CITIES), rate=rng.randrange(1600, 3200, 25),
+        category=category.capitalize(), brand=rng.choice(MATERIALS[category]),
+        allowance=rng.randrange(40, 400, 5), margin=rng.choice([10, 12, 15, 18]),
+        percent=rng.choice([5, 10, 15, 20]), stage=rng.choice(STAGES), years=rng.choice([5, 10, 15]),
+        wp_years=rng.choice([2, 5, 7]), visits=rng.randint(2, 6), checks=rng.choice([250, 350, 450]),
+        penalty=rng.randrange(500, 5000, 250), grace=rng.choice([15, 30, 45]),
+        height=rng.choice([10, 10.5, 11]), grade=rng.choice([20, 25, 30]), revisions=rng.randint(2, 6))
+
+
+def synthetic_document(index, seed=0, sections=6, lines_per_section=(6, 20)):
+    rng = random.Random(seed * 1_000_003 + index)
+    package = rng.choice(PACKAGES)
+    city = rng.choice(CITIES)
+    lines = [f"# {package} Package - {city} Project {index}", ""]
+    for section in rng.sample(SECTIONS, sections):
+        lines.append(f"## {section}")
+        for _ in range(rng.randint(*lines_per_section)):
+            lines.append(_line(rng, package))
+        lines.append("")
+    return {"source": f"synthetic_{index:07d}.md", "text": "\n".join(lines)}
+
+
+def synthetic_documents(seed=0, start=0):
+    """Endless stream of documents (source, text); the same seed yields the same corpus."""
+    for index in itertools.count(start):
+        yield synthetic_document(index, seed)
+
+
+def synthetic_chunks(num_chunks, seed=0):
+    """Yields (document, chunks, sections) until num_chunks chunks, truncating the last document."""
+    from build_index import advanced_chunking
+    remaining = num_chunks
+    for doc in synthetic_documents(seed):
+        sections = []
+        chunks = advanced_chunking(doc["text"], doc["source"], sections)
+        yield doc, chunks[:remaining], sections[:remaining]
+        remaining -= len(chunks)
+        if remaining <= 0:
+            return
+
+
+def write_corpus(folder, num_chunks, seed=0):
+    """Writes whole documents until they hold at least num_chunks chunks. Returns the file count."""
+    os.makedirs(folder, exist_ok=True)
+    files = 0
+    for doc, _, _ in synthetic_chunks(num_chunks, seed):
+        with open(os.path.join(folder, doc["source"]), "w", encoding="utf-8") as f:
+            f.write(doc["text"])
+        files += 1
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    files = write_corpus(args.folder, args.chunks, args.seed)
+    print(f"Wrote {files} documents (~{args.chunks} chunks) to {args.folder}")
@@ -20,19 +20,13 @@ if src_dir not in sys.path:
 # Import Backend
 try:
     from rag_pipeline import RAGPipeline
-    from build_index import run_indexing_pipeline
+    from jobs import get_job_queue
+    from vector_store import index_exists
+    import resources
 except ImportError:
     st.error("Critical Error: System modules not found. Check 'src' folder.")
     st.stop()
 
-# Import File Parsers
-try:
-    import pypdf
-    from docx import Document
-except ImportError:
-    st.error("Missing libraries! Please run: pip install pypdf python-docx")
-    st.stop()
-
 st.set_page_config(
     page_title="Indecimal AI",
     layout="wide",
@@ -118,26 +112,6 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
-def extract_text_from_file(uploaded_file):
-    file_type = uploaded_file.name.split('.')[-1].lower()
-    text = ""
-    try:
-        if file_type == 'pdf':
-            pdf_reader = pypdf.PdfReader(uploaded_file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        elif file_type == 'docx':
-            doc = Document(uploaded_file)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        else:
-            text = uploaded_file.read().decode("utf-8")
-        return text.strip()
-    except Exception as e:
-        st.error(f"Error parsing {uploaded_file.name}: {e}")
-        return None
-
-
 def read_core_file(filename):
     try:
         with open(os.path.join("data", filename), "r", encoding="utf-8") as f:
@@ -145,8 +119,10 @@ def read_core_file(filename):
     except:
         return "Error reading file."
 
-if "rag" not in st.session_state or "api_key" not in dir(st.session_state.rag.run.__code__.co_varnames):
-    st.session_state.rag = RAGPipeline(index_path="index/assignment")
+# Sessions share one embedder and one vector store per index (see src/resources.py).
+# They load in the background, so the page renders before the models are ready
+if "rag" not in st.session_state:
+    st.session_state.rag = RAGPipeline(index_path="index/assignment", shared=True, background=True)
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -160,6 +136,9 @@ if "api_key" not in st.session_state:
 if "model_provider" not in st.session_state:
     st.session_state.model_provider = "Groq"
 
+if "index_job_id" not in st.session_state:
+    st.session_state.index_job_id = None
+
 
 #sidebar
 with st.sidebar:
@@ -189,7 +168,7 @@ with st.sidebar:
             st.session_state.rag.load_index("index/assignment")
             st.toast("Loaded Core Documents")
         else:
-            if os.path.exists("index/custom/vector_store.index"):
+            if index_exists("index/custom"):
                 st.session_state.rag.load_index("index/custom")
                 st.toast("Loaded Custom Documents")
             else:
@@ -209,23 +188,43 @@ with st.sidebar:
             label_visibility="collapsed"
         )
 
-        if uploaded_files and st.button("Index Files", type="primary"):
-            with st.spinner("Processing files..."):
-                docs = []
-                for f in uploaded_files:
-                    txt = extract_text_from_file(f)
-                    if txt:
-                        docs.append({"source": f.name, "text": txt})
-
-                if docs:
-                    if not os.path.exists("index/custom"):
-                        os.makedirs("index/custom")
-
-                    run_indexing_pipeline(docs, "index/custom")
+        job_queue = get_job_queue()
+        job = job_queue.get(st.session_state.index_job_id) if st.session_state.index_job_id else None
+        keep_existing = index_exists("index/custom") and st.checkbox(
+            "Keep previously indexed files", help="Only add or replace the uploaded files")
+
+        if uploaded_files and st.button("Index Files", type="primary", disabled=bool(job and not job.finished)):
+            # Indexing runs on a background worker; this session (and everyone else's)
+            # keeps answering from the current index until the new one is swapped in
+            items = [(f.name, f.getvalue()) for f in uploaded_files]
+            if keep_existing:
+                job = job_queue.submit(items, "index/custom", partial=True)
+            else:
+                job = job_queue.submit(items, "index/custom")
+            st.session_state.index_job_id = job.id
+
+        if job is not None:
+            progress = job.progress
+            if not job.finished:
+                total = max(progress["files_total"], 1)
+                st.progress(min(progress["files_parsed"] / total, 1.0),
+                            text=f"{job.stage.capitalize()}: {progress['files_parsed']}/{progress['files_total']} files")
+                st.caption(f"{progress['chunks_embedded']} chunks embedded · "
+                           f"{progress['vectors_written']} vectors written")
+                if st.button("Cancel indexing"):
+                    job.cancel()
+            else:
+                st.session_state.index_job_id = None
+                for error in (job.summary or {}).get("errors", []):
+                    st.error(error)
+                if job.status == "done" and job.summary["chunks"]:
                     st.session_state.rag.load_index("index/custom")
                     st.session_state.messages = []
-                    st.success(f"Indexed {len(docs)} files successfully.")
-                    st.rerun()
+                    st.success(f"Indexed {job.summary['documents']} files successfully.")
+                elif job.status == "failed":
+                    st.error(f"Indexing failed: {job.error}")
+                elif job.status == "cancelled":
+                    st.warning("Indexing cancelled. The previous index is still in use.")
 
     else:
 
@@ -241,6 +240,21 @@ with st.sidebar:
         with st.expander("📄 doc3.md (Policies)"):
             st.text(read_core_file("doc3.md"))
 
+    # Search scope: filtered before ranking, so a narrow filter still returns full results
+    search_filters = {}
+    if st.session_state.rag.load_error is not None:
+        st.error(f"Could not load the index: {st.session_state.rag.load_error}")
+    elif st.session_state.rag.ready:
+        metadata = st.session_state.rag.vector_store.metadata
+        source_filter = st.multiselect("Search only in", metadata.values("source"), placeholder="All documents")
+        section_filter = st.multiselect("Sections", metadata.values("section"), placeholder="All sections")
+        if source_filter:
+            search_filters["source"] = source_filter
+        if section_filter:
+            search_filters["section"] = section_filter
+    else:
+        st.caption("⏳ Loading models and index...")
+
     st.divider()
 
     # Model Settings
@@ -315,41 +329,68 @@ if prompt := st.chat_input("Ask about packages, pricing, or policies..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Analyzing documents..."):
-
-            try:
-                response = st.session_state.rag.run(
-                    prompt,
-                    chat_history=st.session_state.messages,
-                    model_type=st.session_state.model_provider,
-                    api_key=st.session_state.api_key if st.session_state.model_provider == "Groq" else None
-                )
-
-                answer = response["answer"]
-                sources = response["sources"]
-
-                st.markdown(answer)
-
-                if sources:
-                    with st.expander("🔍 Verified Sources"):
-                        for src in sources:
-                            st.markdown(f"""
-                            <div class="source-box">
-                                <div class="source-header">
-                                    <span>{src['source']}</span>
-                                    <span>Score: {src['score']:.2f}</span>
-                                </div>
-                                <div class="source-text">
-                                   "{sanitize_text(src['text'])}"
-                                </div>
+        try:
+            if not st.session_state.rag.ready:
+                with st.spinner("Loading models..."):
+                    st.session_state.rag.wait_until_ready()
+
+            stream = st.session_state.rag.run_stream(
+                prompt,
+                chat_history=st.session_state.messages,
+                model_type=st.session_state.model_provider,
+                api_key=st.session_state.api_key if st.session_state.model_provider == "Groq" else None,
+                filters=search_filters or None
+            )
+
+            # Retrieval finishes before the first event; tokens then render as they arrive
+            with st.spinner("Analyzing documents..."):
+                event = next(stream)
+            sources = event["sources"]
+
+            answer = ""
+            cached = False
+            answer_placeholder = st.empty()
+            for event in stream:
+                if event["type"] == "token":
+                    answer += event["content"]
+                    answer_placeholder.markdown(answer + "▌")
+                elif event["type"] == "done":
+                    answer = event["answer"]
+                    cached = event.get("cached", False)
+            answer_placeholder.markdown(answer)
+            if cached:
+                st.caption("⚡ Answered from cache")
+
+            if sources:
+                with st.expander("🔍 Verified Sources"):
+                    for src in sources:
+                        st.markdown(f"""
+                        <div class="source-box">
+                            <div class="source-header">
+                                <span>{src['source']}</span>
+                                <span>Score: {src['score']:.2f}</span>
                             </div>
-                            """, unsafe_allow_html=True)
-
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": answer,
-                    "sources": sources
-                })
-
-            except Exception as e:
-                st.error(f"Error: {e}")
+                            <div class="source-text">
+                               "{sanitize_text(src['text'])}"
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": answer,
+                "sources": sources
+            })
+
+        except Exception as e:
+            st.error(f"Error: {e}")
+
+# Poll a running indexing job so its progress bar keeps moving
+if st.session_state.index_job_id and st.session_state.current_mode == "Custom File Mode":
+    time.sleep(1)
+    st.rerun()
+
+# Likewise until the models are loaded, so the search filters appear
+if not st.session_state.rag.ready:
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,107 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class AnswerCache:
+    """
+    Semantic cache of final answers, looked up by query embedding.
+
+    A query hits when a previous query in the same partition - (index path,
+    index version, back-end, model) - has cosine similarity >= threshold.
+    Entries expire after ttl_seconds and the least recently used are evicted
+    beyond max_entries. Partitions of an older index version are dropped as
+    soon as a newer version of the same index is seen, so a rebuild
+    invalidates its answers automatically.
+    """
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # entry id -> entry dict, least recently used first
+        self._partitions = {}           # partition key -> {"ids": [...], "matrix": array or None}
+        self._versions = {}             # index path -> latest index version seen
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _invalidate_old_versions(self, index_path, index_version):
+        if self._versions.get(index_path) == index_version:
+            return
+        self._versions[index_path] = index_version
+        stale = [key for key in self._partitions if key[0] == index_path and key[1] != index_version]
+        for key in stale:
+            for entry_id in self._partitions.pop(key)["ids"]:
+                self._entries.pop(entry_id, None)
+
+    def _drop(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        partition = self._partitions.get(entry["partition"])
+        if partition is not None:
+            partition["ids"].remove(entry_id)
+            partition["matrix"] = None
+
+    def lookup(self, partition_key, query_embedding):
+        """partition_key is (index_path, index_version, ...) - e.g. back-end, model and filters."""
+        query_embedding = np.asarray(query_embedding, dtype="float32").reshape(-1)
+        now = time.time()
+        with self._lock:
+            self._invalidate_old_versions(partition_key[0], partition_key[1])
+            partition = self._partitions.get(partition_key)
+            if not partition or not partition["ids"]:
+                self.misses += 1
+                return None
+
+            expired = [i for i in partition["ids"] if now - self._entries[i]["created_at"] > self.ttl_seconds]
+            for entry_id in expired:
+                self._drop(entry_id)
+            if not partition["ids"]:
+                self.misses += 1
+                return None
+
+            if partition["matrix"] is None:
+                partition["matrix"] = np.stack([self._entries[i]["embedding"] for i in partition["ids"]])
+            similarities = partition["matrix"] @ query_embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = partition["ids"][best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            value = self._entries[entry_id]["value"]
+        # Copies, so callers can't change the entry other sessions get (e.g. its sources)
+        return dict(copy.deepcopy(value), similarity=float(similarities[best]))
+
+    def store(self, partition_key, query_embedding, value):
+        query_embedding = np.asarray(query_embedding, dtype="float32").reshape(-1)
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._invalidate_old_versions(partition_key[0], partition_key[1])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "partition": partition_key,
+                "embedding": query_embedding,
+                "value": value,
+                "created_at": time.time()
+            }
+            partition = self._partitions.setdefault(partition_key, {"ids": [], "matrix": None})
+            partition["ids"].append(entry_id)
+            partition["matrix"] = None
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._partitions.clear()
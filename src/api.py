@@ -0,0 +1,304 @@
+"""
+HTTP serving layer around one shared RAGPipeline.
+
+Run a single worker process; concurrency comes from asyncio plus a bounded
+thread pool, so every request shares the same loaded model and index:
+    uvicorn api:app --app-dir src --host 0.0.0.0 --port 8000
+
+The model and index load in the background, so the server accepts connections
+at once: GET /health answers 503 until they are ready, and queries wait for them.
+
+Endpoints:
+    GET /health          -> index status (503 while loading)
+    POST /query          -> {"answer", "sources", "context_stats", "cached"}, as RAGPipeline.run
+    POST /query/stream   -> NDJSON events (sources, token..., done), as RAGPipeline.run_stream
+    POST /index          -> multipart upload; (re)indexes and hot-swaps the served index
+                            (mode=upsert adds/replaces just the uploaded files)
+    DELETE /documents    -> removes documents by source name from the served index
+    GET /metrics         -> Prometheus text metrics (MINIRAG_METRICS, default "memory")
+
+/index and /documents write to the served index unless index_path names another
+index under MINIRAG_INDEX_ROOT (default "index"); other paths are rejected.
+"""
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+import metrics
+from rag_pipeline import RAGPipeline, RETRIEVE_K
+from ingest import DEFAULT_WORKERS
+from jobs import get_job_queue, DONE
+from document_parser import SUPPORTED_EXTENSIONS
+from metadata_store import FIELD_FILES
+
+INDEX_PATH = os.environ.get("MINIRAG_INDEX_PATH", "index/assignment")
+# Clients may only build indexes under this directory (besides the served one)
+INDEX_ROOT = os.environ.get("MINIRAG_INDEX_ROOT", "index")
+WORKER_THREADS = int(os.environ.get("MINIRAG_WORKER_THREADS", "4"))
+MAX_BATCH_SIZE = int(os.environ.get("MINIRAG_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MINIRAG_MAX_BATCH_WAIT_MS", "5"))
+PARSER_PROCESSES = int(os.environ.get("MINIRAG_PARSER_PROCESSES", str(DEFAULT_WORKERS)))
+MAX_K = int(os.environ.get("MINIRAG_MAX_K", "50"))
+JOB_POLL_SECONDS = 0.2
+
+# The server aggregates metrics in memory for /metrics unless configured otherwise (see metrics.py)
+metrics.configure(os.environ.get("MINIRAG_METRICS", "memory"))
+
+
+class QueryRequest(BaseModel):
+    query: str
+    chat_history: Optional[List[dict]] = None
+    model_type: str = "Groq"
+    api_key: Optional[str] = None
+    k: int = Field(RETRIEVE_K, ge=1, le=MAX_K)
+    # e.g. {"source": ["doc2.md"], "section": "Pricing", "batch": "job-..."}
+    filters: Optional[Dict[str, Any]] = None
+
+
+def _check_filters(filters):
+    """400 for filters the store can't apply: unknown fields, values other than strings or lists of them."""
+    for field, value in (filters or {}).items():
+        if field not in FIELD_FILES:
+            raise HTTPException(status_code=400,
+                                detail=f"Unknown filter field: {field} (use one of {', '.join(FIELD_FILES)}).")
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise HTTPException(status_code=400, detail=f"Filter {field} must be a string or a list of strings.")
+
+
+class QueryBatcher:
+    """
+    Micro-batches concurrent retrievals: queries that arrive within max_wait_ms of
+    each other are embedded in one encode call and searched in one FAISS call.
+    Results are cut to the pipeline's rerank_top_n, as in RAGPipeline.run.
+    """
+    def __init__(self, rag, executor, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+        self.rag = rag
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def retrieve(self, query, k=5, filters=None):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, k, filters or None, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Don't wait for this batch: the next one can start collecting meanwhile
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        # Queries with the same filters share one retrieve_many call
+        groups = {}
+        for item in batch:
+            groups.setdefault(json.dumps(item[2], sort_keys=True), []).append(item)
+        await asyncio.gather(*(self._dispatch_group(group) for group in groups.values()))
+
+    async def _dispatch_group(self, batch):
+        loop = asyncio.get_running_loop()
+        queries = [query for query, _, _, _ in batch]
+        k = max(k for _, k, _, _ in batch)
+        filters = batch[0][2]
+        try:
+            results = await loop.run_in_executor(
+                self.executor,
+                lambda: self.rag.retrieve_many(queries, k, filters=filters, rerank_top_n=self.rag.rerank_top_n))
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, query_k, _, future), chunks in zip(batch, results):
+            if not future.done():
+                future.set_result(chunks[:query_k])
+
+
+@asynccontextmanager
+async def lifespan(app):
+    executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="minirag")
+    rag = RAGPipeline(index_path=INDEX_PATH, shared=True, background=True)
+
+    app.state.executor = executor
+    app.state.rag = rag
+    app.state.index_path = INDEX_PATH
+    app.state.jobs = get_job_queue(workers=PARSER_PROCESSES)
+    app.state.batcher = QueryBatcher(rag, executor)
+    app.state.batcher.start()
+    try:
+        yield
+    finally:
+        await app.state.batcher.stop()
+        rag.close()
+        executor.shutdown(wait=False)
+
+
+app = FastAPI(title="MiniRAG API", lifespan=lifespan)
+
+
+async def _ready_rag():
+    """The pipeline, once its model and index are loaded (waits on a thread, not the event loop)."""
+    rag = app.state.rag
+    if not rag.ready:
+        await asyncio.to_thread(rag.wait_until_ready)
+    return rag
+
+
+@app.get("/health")
+async def health():
+    rag = app.state.rag
+    if not rag.ready:
+        raise HTTPException(status_code=503, detail="Loading model and index.")
+    if rag.load_error is not None:
+        raise HTTPException(status_code=503, detail=f"Loading model and index failed: {rag.load_error}")
+    store = rag.vector_store
+    return {"status": "ok", "index_path": app.state.index_path,
+            "version": store.version, "chunks": len(store.metadata)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    sink = metrics.memory_sink()
+    if sink is None:
+        raise HTTPException(status_code=404, detail="In-memory metrics are disabled (MINIRAG_METRICS).")
+    return PlainTextResponse(sink.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+def _run_options(request):
+    return dict(chat_history=request.chat_history, model_type=request.model_type, api_key=request.api_key,
+                filters=request.filters, k=request.k, retrieve=app.state.batcher.retrieve,
+                executor=app.state.executor)
+
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    _check_filters(request.filters)
+    rag = await _ready_rag()
+    return await rag.arun(request.query, **_run_options(request))
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    _check_filters(request.filters)
+    rag = await _ready_rag()
+
+    async def events():
+        async for event in rag.arun_stream(request.query, **_run_options(request)):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+def _index_path(index_path):
+    """The index a build or removal targets: the served one unless another one under INDEX_ROOT is named."""
+    served = app.state.index_path
+    if index_path is None or os.path.realpath(index_path) == os.path.realpath(served):
+        # The served path as configured, so the finished job hot-swaps it (resources are keyed by it)
+        return served
+    root, path = os.path.realpath(INDEX_ROOT), os.path.realpath(index_path)
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=400,
+                            detail=f"index_path must be the served index or a directory under {INDEX_ROOT}.")
+    return index_path
+
+
+async def _wait_for(job):
+    while not job.finished:
+        await asyncio.sleep(JOB_POLL_SECONDS)
+    if job.status != DONE:
+        raise HTTPException(status_code=500, detail=job.error or f"Indexing {job.status}.")
+    return job.summary
+
+
+@app.post("/index")
+async def index(files: List[UploadFile] = File(...), index_path: Optional[str] = Form(None),
+                wait: bool = Form(True), mode: str = Form("replace")):
+    """mode=replace: the upload is the full corpus; mode=upsert: other indexed files are kept."""
+    if mode not in ("replace", "upsert"):
+        raise HTTPException(status_code=400, detail="mode must be 'replace' or 'upsert'.")
+    index_path = _index_path(index_path)
+    items = []
+    for upload in files:
+        if upload.filename.rsplit('.', 1)[-1].lower() not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {upload.filename}")
+        items.append((upload.filename, await upload.read()))
+
+    # Builds run one at a time on the background job queue; queries keep being
+    # served from the current index until the finished build is swapped in
+    if mode == "upsert":
+        job = app.state.jobs.submit(items, index_path, partial=True)
+    else:
+        job = app.state.jobs.submit(items, index_path)
+    if not wait:
+        return job.to_dict()
+
+    summary = await _wait_for(job)
+    if summary["errors"] and not summary["documents"]:
+        raise HTTPException(status_code=400, detail="; ".join(summary["errors"]))
+
+    return {"indexed_documents": summary["documents"], "chunks": summary["chunks"],
+            "errors": summary["errors"], "index_path": index_path, "job_id": job.id,
+            "seconds": round(job.finished_at - job.created_at, 3)}
+
+
+@app.delete("/documents")
+async def delete_documents(sources: List[str] = Query(...), index_path: Optional[str] = Query(None),
+                           wait: bool = Query(True)):
+    index_path = _index_path(index_path)
+    job = app.state.jobs.submit_removal(sources, index_path)
+    if not wait:
+        return job.to_dict()
+    summary = await _wait_for(job)
+    return {"removed_chunks": summary["removed"], "chunks": summary["chunks"],
+            "index_path": index_path, "job_id": job.id}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in app.state.jobs.jobs()]
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if not app.state.jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return app.state.jobs.get(job_id).to_dict()
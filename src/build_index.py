@@ -1,11 +1,20 @@
 import os
 import glob
-from embedder import Embedder
-from vector_store import VectorStore
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from embedder import Embedder, BULK_PROCESSES
+from vector_store import current_version, version_dir, index_exists
+from sharded_store import create_store, open_store, shard_of
+from metadata_store import chunk_header, CHUNK_STORAGE
+import metrics
 
 # Configuration
 CHUNK_SIZE = 600       # Approx 100-150 words, good for MiniLM context limit
 CHUNK_OVERLAP = 150    # ~25% overlap to maintain context across boundaries
+MANIFEST_FILE = "index_manifest.json"
+EMBED_BATCH_SIZE = 256  # New chunks are embedded in batches of this size while parsing continues
 
 def load_documents_from_folder(folder_path):
     # Sort files for deterministic indexing order
@@ -29,10 +38,23 @@ def load_documents_from_folder(folder_path):
             
     return documents
 
-def advanced_chunking(text, source_name):
+def normalize_document(text):
+    """The document as advanced_chunking sees it: non-empty stripped lines joined by spaces."""
+    return " ".join(line for line in (line.strip() for line in text.split('\n')) if line)
+
+def _span(line_starts, chunk_lines, offset):
+    # Offsets of " ".join(chunk_lines) in normalize_document(text)
+    if not chunk_lines:
+        return (offset, offset)
+    return (line_starts[0], line_starts[-1] + len(chunk_lines[-1]))
+
+def advanced_chunking(text, source_name, sections=None, spans=None):
     """
     Splits text while tracking Markdown Headers (#, ##).
     Prepends context (e.g., "Section: Pricing > Premier") to every chunk.
+    If a list is passed as sections, the section path of every chunk is appended to it.
+    If a list is passed as spans, the (start, end) of every chunk's text after the
+    header within normalize_document(text) is appended to it.
     """
     if not text:
         return []
@@ -43,6 +65,8 @@ def advanced_chunking(text, source_name):
     current_context = source_name.split('.')[0]
     current_chunk = []
     current_length = 0
+    line_starts = []   # offset of each line of current_chunk in the normalized document
+    offset = 0
     
     for line in lines:
         line = line.strip()
@@ -58,59 +82,409 @@ def advanced_chunking(text, source_name):
         # Check size limit
         if current_length + len(line) > CHUNK_SIZE:
             chunk_text = " ".join(current_chunk)
-            enriched_text = f"[{source_name} | Section: {current_context}]\n{chunk_text}"
+            enriched_text = chunk_header(source_name, current_context) + chunk_text
             chunks.append(enriched_text)
+            if sections is not None:
+                sections.append(current_context)
+            if spans is not None:
+                spans.append(_span(line_starts, current_chunk, offset))
             
             # Create Overlap
             current_chunk = current_chunk[-3:] 
+            line_starts = line_starts[-3:]
             current_length = sum(len(l) for l in current_chunk)
             
         current_chunk.append(line)
+        line_starts.append(offset)
         current_length += len(line)
+        offset += len(line) + 1
 
     # Add final chunk
     if current_chunk:
         chunk_text = " ".join(current_chunk)
-        enriched_text = f"[{source_name} | Section: {current_context}]\n{chunk_text}"
+        enriched_text = chunk_header(source_name, current_context) + chunk_text
         chunks.append(enriched_text)
+        if sections is not None:
+            sections.append(current_context)
+        if spans is not None:
+            spans.append(_span(line_starts, current_chunk, offset))
         
     return chunks
 
-def run_indexing_pipeline(input_docs, output_path):
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(directory):
+    """
+    Reads the content-hash manifest stored next to vector_store.index (in the same snapshot).
+    Returns None when there is no usable manifest (forces a full rebuild).
+    """
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f" Could not read manifest {manifest_file}: {e}")
+        return None
+
+    # Chunk boundaries depend on the chunking config, so old hashes are useless if it changed
+    if manifest.get("chunk_size") != CHUNK_SIZE or manifest.get("chunk_overlap") != CHUNK_OVERLAP:
+        print(" Chunking config changed since last build.")
+        return None
+    return manifest
+
+def save_manifest(directory, documents):
+    manifest = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "documents": documents
+    }
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+def _stored_chunk_hashes(vector_store, manifest):
+    """
+    Maps every position in the loaded index to its chunk hash using the manifest
+    (None for removed chunks), as one list per shard. Returns None if the manifest
+    and the index disagree.
+    """
+    documents = manifest.get("documents", {})
+    remaining = {source: iter(entry["chunks"]) for source, entry in documents.items()}
+    shard_hashes = []
+    for shard in vector_store.shards:
+        removed = set(shard.tombstones.tolist())
+        hashes = []
+        for pos in range(len(shard.metadata)):
+            if pos in removed:
+                hashes.append(None)
+                continue
+            chunk_iter = remaining.get(shard.metadata.source(pos))
+            chunk_hash = next(chunk_iter, None) if chunk_iter else None
+            if chunk_hash is None:
+                return None
+            hashes.append(chunk_hash)
+        if len(hashes) != shard.index.ntotal:
+            return None
+        shard_hashes.append(hashes)
+
+    if any(next(it, None) for it in remaining.values()):
+        return None
+    return shard_hashes
+
+def chunk_document(source, text, known_hash=None, keep_document=False):
+    """
+    Hashes and chunks one document. Chunking is skipped (chunks=None) when the
+    hash matches known_hash, i.e. the document is unchanged since the last build.
+    keep_document adds "document" and "spans", which locate the chunks in the
+    normalized text, for span storage.
+    """
+    doc_hash = content_hash(text)
+    if doc_hash == known_hash:
+        return {"source": source, "hash": doc_hash, "chunks": None, "sections": None}
+    sections = []
+    spans = []
+    chunks = advanced_chunking(text, source, sections, spans)
+    result = {"source": source, "hash": doc_hash, "chunks": chunks, "sections": sections}
+    if keep_document:
+        result.update(document=normalize_document(text), spans=spans)
+    return result
+
+def run_indexing_pipeline(input_docs, output_path, incremental=True, index_spec=None, build_sparse=True,
+                          partial=False, num_shards=None, chunk_storage=None):
     """
     Reusable function to index ANY list of documents.
+    input_docs is the full corpus for output_path: with incremental=True only new or
+    edited chunks are embedded, and chunks of edited or missing documents are dropped.
+    With partial=True input_docs are added or replaced and every other indexed
+    document is kept (see upsert_documents).
+    index_spec selects the FAISS index type (see VectorStore); build_sparse also writes
+    the BM25 index used by hybrid retrieval; num_shards > 1 partitions the index by
+    source (see ShardedVectorStore); chunk_storage ("text" or "spans") selects how
+    chunk text is stored (see MetadataStore). Left as None, these three keep what the
+    stored index uses (Flat, 1 shard and MINIRAG_CHUNK_STORAGE for a new one).
     """
     print(f"Indexing {len(input_docs)} documents to {output_path}...")
-    
-    embedder = Embedder()
-    vector_store = VectorStore(index_path=output_path)
-    
-    all_chunks = []
-    all_metadata = []
-
-    for doc in input_docs:
-        chunks = advanced_chunking(doc['text'], doc['source'])
-        print(f"Created {len(chunks)} chunks from {doc['source']}")
-        for chunk in chunks:
-            all_chunks.append(chunk)
-            all_metadata.append({
-                "source": doc['source'],
-                "text": chunk
-            })
-
-    if not all_chunks:
+
+    def parse_documents(known_hashes, keep_document):
+        for doc in input_docs:
+            yield chunk_document(doc['source'], doc['text'], known_hashes.get(doc['source']), keep_document)
+
+    return index_documents(parse_documents, output_path, incremental=incremental, index_spec=index_spec,
+                           build_sparse=build_sparse, partial=partial, num_shards=num_shards,
+                           chunk_storage=chunk_storage)
+
+def upsert_documents(input_docs, output_path, build_sparse=True):
+    """Adds or replaces input_docs in output_path, keeping its other documents, index type and shards."""
+    return run_indexing_pipeline(input_docs, output_path, build_sparse=build_sparse, partial=True)
+
+def remove_documents(sources, output_path, build_sparse=True):
+    """Deletes the chunks of the given sources from output_path."""
+    print(f"Removing {len(sources)} documents from {output_path}...")
+    return index_documents(lambda known_hashes, keep_document: [], output_path, build_sparse=build_sparse,
+                           partial=True, remove_sources=sources)
+
+def index_documents(parse_documents, output_path, incremental=True, index_spec=None,
+                    build_sparse=True, embed_batch_size=EMBED_BATCH_SIZE, progress=None, batch_label=None,
+                    partial=False, remove_sources=(), num_shards=None, embed_processes=BULK_PROCESSES,
+                    chunk_storage=None):
+    """
+    Streaming core of the indexing pipeline.
+
+    parse_documents(known_hashes, keep_document) returns an iterable of chunk_document()
+    results (documents that failed to parse carry an "error" instead of chunks, empty
+    ones may be None); known_hashes maps source -> hash from the last build so unchanged
+    documents need not be chunked, and keep_document is passed on to chunk_document()
+    (True only for span storage, so the full text isn't carried around otherwise).
+    New chunks are embedded in batches of embed_batch_size while the iterable is still
+    being consumed, so only one batch of chunk text is held at a time.
+
+    progress, if given, is called as progress(stage=...) and with counter increments
+    (files_parsed, chunks_embedded, vectors_written); an exception raised from it
+    aborts the build before anything is saved. batch_label tags the chunks embedded
+    by this run (default: a timestamp) for filtered search. embed_processes > 0
+    encodes the batches in a pool of embedding processes. Returns a summary dict.
+
+    With partial=True the parsed documents are only the ones to add or replace:
+    stored documents that are not among them are kept, except remove_sources.
+    Replaced and removed chunks are tombstoned (see VectorStore.remove) and the
+    index is compacted once they pass COMPACTION_THRESHOLD. index_spec=None,
+    num_shards=None and chunk_storage=None (the defaults) keep the stored index type,
+    shard count and chunk storage mode; a new index gets Flat, one shard and
+    MINIRAG_CHUNK_STORAGE.
+
+    With num_shards > 1 every shard is finished (stale chunks, compaction, BM25)
+    and written in parallel, and unchanged shards are reused as they are.
+
+    The summary includes "timings": milliseconds per stage (index.load, index.parse,
+    index.embed, index.add, index.finish, index.save) and total.
+    """
+    with metrics.trace("index") as trace:
+        summary = _index_documents(parse_documents, output_path, incremental, index_spec, build_sparse,
+                                   embed_batch_size, progress, batch_label, partial, remove_sources,
+                                   num_shards, embed_processes, chunk_storage)
+    metrics.incr("chunks_embedded", summary["embedded"])
+    metrics.incr("chunks_removed", summary["removed"])
+    metrics.incr("index_builds")
+    summary["timings"] = trace.timings()
+    return summary
+
+def _index_documents(parse_documents, output_path, incremental, index_spec, build_sparse, embed_batch_size,
+                     progress, batch_label, partial, remove_sources, num_shards, embed_processes, chunk_storage):
+    report = progress or (lambda **updates: None)
+    batch_label = batch_label or time.strftime("%Y%m%d-%H%M%S")
+    remove_sources = set(remove_sources)
+    vector_store = None
+    stored_hashes = None
+    old_documents = {}
+
+    # Pin one snapshot so the manifest and the index always match, even if
+    # another writer publishes a new version meanwhile
+    version = current_version(output_path)
+    manifest = load_manifest(version_dir(output_path, version)) if incremental else None
+    if manifest is None and partial and index_exists(output_path):
+        # Without a manifest (e.g. the pre-manifest layout) the stored chunks can't be
+        # matched to documents, and a fresh store would replace the whole corpus
+        raise ValueError(f"Cannot update {output_path} in place; re-index the full corpus.")
+    if manifest is not None:
+        with metrics.span("index.load"):
+            vector_store = open_store(output_path, version, mmap_index=False)
+            stored_hashes = _stored_chunk_hashes(vector_store, manifest)
+        index_spec = index_spec or vector_store.index_spec
+        num_shards = num_shards or vector_store.num_shards
+        chunk_storage = chunk_storage or vector_store.chunk_storage
+        if vector_store.index_spec != index_spec:
+            print(f" Index type changed ({vector_store.index_spec} -> {index_spec}). Rebuilding from scratch.")
+            stored_hashes = None
+        elif vector_store.num_shards != num_shards:
+            print(f" Shard count changed ({vector_store.num_shards} -> {num_shards}). Rebuilding from scratch.")
+            stored_hashes = None
+        elif vector_store.chunk_storage != chunk_storage:
+            print(f" Chunk storage changed ({vector_store.chunk_storage} -> {chunk_storage}). Rebuilding from scratch.")
+            stored_hashes = None
+        elif stored_hashes is None:
+            print(" Manifest does not match the stored index. Rebuilding from scratch.")
+        elif len(vector_store.metadata) and not vector_store.metadata.values("section"):
+            print(" Index predates section metadata. Rebuilding from scratch.")
+            stored_hashes = None
+        if stored_hashes is None:
+            if partial:
+                raise ValueError(f"Cannot update {output_path} in place; re-index the full corpus.")
+            vector_store = None
+        else:
+            old_documents = manifest["documents"]
+    if vector_store is None:
+        vector_store = create_store(output_path, index_spec or "Flat", num_shards or 1,
+                                    chunk_storage or CHUNK_STORAGE)
+        stored_hashes = [[] for _ in range(vector_store.num_shards)]
+    shards = vector_store.shards
+    shard_for = lambda source: shard_of(source, vector_store.num_shards)
+
+    # Positions of the stored chunks within their shard, grouped by source and chunk hash
+    stored_positions = {}
+    for shard, hashes in zip(shards, stored_hashes):
+        for pos, chunk_hash in enumerate(hashes):
+            if chunk_hash is None:
+                continue
+            stored_positions.setdefault(shard.metadata.source(pos), {}).setdefault(chunk_hash, []).append(pos)
+
+    keep = [set() for _ in shards]
+    doc_hashes = {}
+    errors = []
+    # Chunk hash of every position in each shard, including the ones appended below
+    chunk_hashes = [list(hashes) for hashes in stored_hashes]
+    batch = []          # (metadata, chunk_hash) waiting to be embedded
+    embedder = None
+    embedded = 0
+
+    def embed_batch():
+        nonlocal embedder, embedded
+        if not batch:
+            return
+        if embedder is None:
+            embedder = Embedder(processes=embed_processes)
+        print(f"Embedding {len(batch)} chunks...")
+        with metrics.span("index.embed"):
+            embeddings = embedder.embed([meta["text"] for meta, _ in batch])
+        report(chunks_embedded=len(batch))
+        # Routed to shards by source, preserving order within each shard
+        with metrics.span("index.add"):
+            vector_store.add(embeddings, [meta for meta, _ in batch])
+        report(vectors_written=len(batch))
+        for meta, chunk_hash in batch:
+            chunk_hashes[shard_for(meta["source"])].append(chunk_hash)
+        embedded += len(batch)
+        batch.clear()
+
+    try:
+        known_hashes = {source: entry["hash"] for source, entry in old_documents.items()}
+        # Time spent waiting for parsed documents (the parsing itself may run in other processes)
+        keep_document = vector_store.chunk_storage == "spans"
+        for doc in metrics.timed_iter(parse_documents(known_hashes, keep_document), "index.parse"):
+            report(files_parsed=1)
+            if doc is None:
+                continue
+            source = doc['source']
+            if source in doc_hashes:
+                print(f" Skipping duplicate source: {source}")
+                continue
+            positions_by_hash = stored_positions.get(source, {})
+            old_entry = old_documents.get(source)
+            shard_keep = keep[shard_for(source)]
+
+            if doc.get("error"):
+                errors.append(doc["error"])
+                print(f" {doc['error']}")
+                if old_entry:
+                    # Keep serving the last good version rather than dropping the document
+                    doc_hashes[source] = old_entry["hash"]
+                    for positions in positions_by_hash.values():
+                        shard_keep.update(positions)
+                continue
+
+            doc_hashes[source] = doc['hash']
+            if old_entry and old_entry["hash"] == doc['hash']:
+                for positions in positions_by_hash.values():
+                    shard_keep.update(positions)
+                print(f"Unchanged: {source}")
+                continue
+
+            chunks = doc['chunks']
+            # Span storage keeps one copy of the document, shared by its chunks' metadata
+            spans = doc.get('spans') if vector_store.chunk_storage == "spans" else None
+            reused = 0
+            for i, (chunk, section) in enumerate(zip(chunks, doc['sections'])):
+                chunk_hash = content_hash(chunk)
+                positions = positions_by_hash.get(chunk_hash)
+                if positions:
+                    shard_keep.add(positions.pop(0))
+                    reused += 1
+                    continue
+                meta = {"source": source, "text": chunk, "section": section, "batch": batch_label}
+                if spans:
+                    meta.update(document=doc['document'], span=spans[i])
+                batch.append((meta, chunk_hash))
+                if len(batch) >= embed_batch_size:
+                    embed_batch()
+            print(f"Created {len(chunks)} chunks from {source} ({len(chunks) - reused} new)")
+        embed_batch()
+    finally:
+        if embedder is not None:
+            # Stops the embedding processes, also when the build is cancelled
+            embedder.close()
+
+    if partial:
+        for source, positions_by_hash in stored_positions.items():
+            if source in doc_hashes or source in remove_sources:
+                continue
+            doc_hashes[source] = old_documents[source]["hash"]
+            for positions in positions_by_hash.values():
+                keep[shard_for(source)].update(positions)
+
+    stale = [[pos for pos, chunk_hash in enumerate(hashes) if chunk_hash is not None and pos not in shard_keep]
+             for hashes, shard_keep in zip(stored_hashes, keep)]
+    removed = sum(len(positions) for positions in stale)
+    summary = {"documents": len(doc_hashes), "embedded": embedded, "removed": removed, "errors": errors}
+    sparse_ready = vector_store.has_sparse_index or not build_sparse
+    if manifest is not None and not removed and not embedded and sparse_ready:
+        print(f"Index at {output_path} is up to date.")
+        return dict(summary, chunks=vector_store.live_count)
+
+    def finish_shard(i):
+        shard, hashes = shards[i], chunk_hashes[i]
+        if stale[i]:
+            shard.remove(shard.chunk_ids(stale[i]))
+            for pos in stale[i]:
+                hashes[pos] = None
+        if shard.needs_compaction():
+            hashes = [hashes[pos] for pos in shard.live_positions()]
+            shard.compact()
+        # Tombstones don't invalidate BM25; only the added chunks are tokenized into it
+        if build_sparse and shard.live_count:
+            shard.update_sparse_index()
+        return hashes
+
+    if removed:
+        report(stage="removing stale chunks")
+        print(f"Dropping {removed} stale chunks.")
+    if build_sparse:
+        report(stage="building BM25 index")
+        print("Updating BM25 index...")
+    with metrics.span("index.finish"):
+        if len(shards) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1)) as pool:
+                chunk_hashes = list(pool.map(finish_shard, range(len(shards))))
+        else:
+            chunk_hashes = [finish_shard(0)]
+
+    if not vector_store.live_count:
         print("No valid chunks to index.")
-        return
+        if version is None:
+            return dict(summary, chunks=0)
+        # The last chunks are gone: publish an empty snapshot, or readers keep the old one
 
-    print(f"Embedding {len(all_chunks)} chunks...")
-    embeddings = embedder.embed(all_chunks)
+    documents = {source: {"hash": doc_hash, "chunks": []} for source, doc_hash in doc_hashes.items()}
+    for shard, hashes in zip(shards, chunk_hashes):
+        for pos, chunk_hash in enumerate(hashes):
+            if chunk_hash is not None:
+                documents[shard.metadata.source(pos)]["chunks"].append(chunk_hash)
 
-    vector_store.add(embeddings, all_metadata)
-    vector_store.save()
-    print(f"Indexing Complete - {len(all_chunks)} chunks saved to {output_path}")
+    report(stage="saving")
+    # The manifest is written into the new snapshot, so it is published atomically with it
+    with metrics.span("index.save"):
+        vector_store.save(extra_writers=[lambda directory: save_manifest(directory, documents)])
+    legacy_manifest = os.path.join(output_path, MANIFEST_FILE)
+    if os.path.exists(legacy_manifest):
+        os.remove(legacy_manifest)
+    print(f"Indexing Complete - {vector_store.live_count} chunks saved to {output_path} "
+          f"({embedded} embedded, {removed} removed)")
+    return dict(summary, chunks=vector_store.live_count)
 
 if __name__ == "__main__":
-    # Default Assignment Mode
-    docs = load_documents_from_folder("data")
-    if docs:
-        run_indexing_pipeline(docs, "index/assignment")
\ No newline at end of file
+    # Default Assignment Mode: parse the folder in worker processes and stream it in
+    from ingest import index_folder
+    index_folder("data", "index/assignment")
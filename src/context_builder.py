@@ -0,0 +1,163 @@
+import re
+from functools import lru_cache
+
+HEADER_RE = re.compile(r"^\[(?P<source>.+?) \| Section: (?P<section>.*)\]\n", re.DOTALL)
+# Overlaps shorter than this are more likely coincidence than advanced_chunking's carried lines
+MIN_OVERLAP_CHARS = 20
+DEFAULT_TOKEN_BUDGET = 1500
+MIN_TRUNCATED_TOKENS = 40
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(encoding_name):
+    # Loaded once per process: the first call may download the BPE file
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        print(f" tiktoken unavailable ({type(e).__name__}); estimating token counts.")
+        return None
+
+
+class TokenCounter:
+    """tiktoken when available (cl100k_base), otherwise a ~4 chars/token estimate."""
+    def __init__(self, encoding_name="cl100k_base"):
+        self.encoding = _load_encoding(encoding_name)
+
+    def count(self, text):
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text, max_tokens):
+        if self.encoding is None:
+            return text[:max_tokens * 4]
+        return self.encoding.decode(self.encoding.encode(text)[:max_tokens])
+
+
+def split_header(chunk):
+    """Splits the "[source | Section: ...]" line that advanced_chunking prepends."""
+    match = HEADER_RE.match(chunk["text"])
+    if not match:
+        return chunk["source"], None, chunk["text"]
+    return chunk["source"], match.group("section"), chunk["text"][match.end():]
+
+
+def overlap_length(previous, following):
+    """Length of the longest word-aligned suffix of `previous` that starts `following`."""
+    start = 0
+    while True:
+        space = previous.find(" ", start)
+        if space == -1:
+            return 0
+        suffix = previous[space + 1:]
+        if len(suffix) < MIN_OVERLAP_CHARS:
+            return 0
+        if following.startswith(suffix):
+            return len(suffix)
+        start = space + 1
+
+
+class ContextBuilder:
+    """
+    Turns retrieved chunks into a compact prompt context:
+      1. chunks that continue each other (advanced_chunking carries the last lines of a
+         chunk into the next one) are chained and the repeated overlap is dropped,
+      2. consecutive pieces of the same section share a single header,
+      3. blocks are added in retrieval rank order until the token budget is used up.
+    """
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, counter=None):
+        self.token_budget = token_budget
+        self.counter = counter or TokenCounter()
+
+    @staticmethod
+    def naive_context(chunks):
+        # The prompt format used before the builder existed, kept as the savings baseline
+        return "\n\n".join([f"[Source: {c['source']}]\n{c['text']}" for c in chunks])
+
+    def _chains(self, pieces):
+        """Orders pieces into chains of directly overlapping chunks; returns lists of (index, overlap)."""
+        successor = {}
+        has_predecessor = set()
+        for i, (source, _, body) in enumerate(pieces):
+            for j, (other_source, _, other_body) in enumerate(pieces):
+                if i == j or j in has_predecessor or source != other_source:
+                    continue
+                overlap = overlap_length(body, other_body)
+                if overlap:
+                    successor[i] = (j, overlap)
+                    has_predecessor.add(j)
+                    break
+
+        chains = []
+        for i in range(len(pieces)):
+            if i in has_predecessor:
+                continue
+            chain = [(i, 0)]
+            seen = {i}
+            while chain[-1][0] in successor:
+                j, overlap = successor[chain[-1][0]]
+                if j in seen:
+                    break
+                chain.append((j, overlap))
+                seen.add(j)
+            chains.append(chain)
+        # A cycle leaves pieces that never start a chain; keep them as their own blocks
+        covered = {i for chain in chains for i, _ in chain}
+        chains.extend([[(i, 0)] for i in range(len(pieces)) if i not in covered])
+        return chains
+
+    def _render(self, chain, pieces):
+        lines = []
+        current_header = None
+        for i, overlap in chain:
+            source, section, body = pieces[i]
+            text = body[overlap:].lstrip()
+            if not text:
+                continue
+            header = f"[Source: {source} | Section: {section}]" if section else f"[Source: {source}]"
+            if header != current_header:
+                lines.append(f"{header}\n{text}")
+                current_header = header
+            else:
+                lines[-1] += " " + text
+        return "\n".join(lines)
+
+    def build(self, chunks):
+        """Returns (context_text, stats) for chunks given in retrieval rank order."""
+        pieces = [split_header(c) for c in chunks]
+        chains = self._chains(pieces)
+        # Most relevant block first: a chain ranks by its best-ranked chunk
+        chains.sort(key=lambda chain: min(i for i, _ in chain))
+
+        blocks = []
+        used_tokens = 0
+        truncated = False
+        for chain in chains:
+            block = self._render(chain, pieces)
+            if not block:
+                continue
+            separator_tokens = 1 if blocks else 0
+            block_tokens = self.counter.count(block)
+            remaining = self.token_budget - used_tokens - separator_tokens
+            if block_tokens > remaining:
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    blocks.append(self.counter.truncate(block, remaining))
+                    used_tokens += remaining + separator_tokens
+                truncated = True
+                break
+            blocks.append(block)
+            used_tokens += block_tokens + separator_tokens
+
+        context_text = "\n\n".join(blocks)
+        naive_tokens = self.counter.count(self.naive_context(chunks))
+        context_tokens = self.counter.count(context_text)
+        stats = {
+            "chunks": len(chunks),
+            "blocks": len(blocks),
+            "naive_tokens": naive_tokens,
+            "context_tokens": context_tokens,
+            "tokens_saved": naive_tokens - context_tokens,
+            "truncated": truncated,
+        }
+        return context_text, stats
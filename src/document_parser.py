@@ -0,0 +1,26 @@
+import io
+
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "md", "txt")
+
+def extract_text(filename, data):
+    """
+    Extracts plain text from an uploaded PDF, DOCX, Markdown or text file.
+    data is the raw file content (bytes). Raises ValueError for unreadable files.
+    """
+    file_type = filename.rsplit('.', 1)[-1].lower()
+    try:
+        if file_type == 'pdf':
+            import pypdf
+            reader = pypdf.PdfReader(io.BytesIO(data))
+            parts = [page.extract_text() or "" for page in reader.pages]
+        elif file_type == 'docx':
+            from docx import Document
+            doc = Document(io.BytesIO(data))
+            parts = [para.text for para in doc.paragraphs]
+        else:
+            parts = [data.decode("utf-8")]
+    except Exception as e:
+        raise ValueError(f"Error parsing {filename}: {e}") from e
+
+    # Join once instead of growing a string per page/paragraph
+    return "\n".join(parts).strip()
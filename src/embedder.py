@@ -1,23 +1,184 @@
-import torch
-from sentence_transformers import SentenceTransformer
-from typing import Union, List
+import os
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, List, Optional
 import numpy as np
+from embedding_cache import open_cache
+from lazy_imports import lazy_module
+import metrics
+
+torch = lazy_module("torch")
+sentence_transformers = lazy_module("sentence_transformers")
+
+# Shared by the indexer and the query path, so unchanged chunks and repeated
+# questions are never encoded twice.
+DEFAULT_CACHE_DIR = "index/embedding_cache"
+
+# CPU backend settings (see README "Embedding backend"), overridable per process
+BATCH_SIZE = int(os.environ.get("MINIRAG_EMBED_BATCH_SIZE", "64"))
+# Padded tokens per batch: short texts are batched more widely than long ones
+MAX_BATCH_TOKENS = int(os.environ.get("MINIRAG_EMBED_MAX_BATCH_TOKENS", "8192"))
+THREADS = int(os.environ.get("MINIRAG_EMBED_THREADS", "0"))    # torch intra-op threads, 0 = torch default
+PRECISION = os.environ.get("MINIRAG_EMBED_PRECISION", "fp32")   # "fp32" or "int8" (dynamic quantization)
+# Encoding processes for bulk indexing (0 = encode in this process)
+BULK_PROCESSES = int(os.environ.get("MINIRAG_EMBED_PROCESSES", "0"))
+POOL_MIN_TEXTS = 128   # Smaller requests (queries, small uploads) never go through the pool
+PRECISIONS = ("fp32", "int8")
+
+_worker_embedder = None
+
+
+def _init_pool_worker(model_name, batch_size, max_batch_tokens, threads, precision):
+    global _worker_embedder
+    _worker_embedder = Embedder(model_name, cache_dir=None, batch_size=batch_size,
+                                max_batch_tokens=max_batch_tokens, threads=threads, precision=precision)
+
+
+def _encode_in_worker(texts):
+    return _worker_embedder._encode_local(texts)
+
 
 class Embedder:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
+    """
+    Sentence embeddings with a CPU-oriented backend: inputs are sorted by token
+    length and cut into batches of at most batch_size texts and max_batch_tokens
+    padded tokens, so little compute is spent on padding; `threads` sets torch's
+    intra-op threads; precision="int8" quantizes the Linear layers dynamically
+    (CPU only, embeddings drift slightly - see analysis/embedding_benchmark.py);
+    processes > 0 encodes large requests in a pool of worker processes, each
+    with its own model copy and cpu_count / processes threads.
+    """
+    def __init__(self, model_name='all-MiniLM-L6-v2', cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS, threads=THREADS,
+                 precision=PRECISION, processes=0):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        if threads:
+            torch.set_num_threads(threads)
         # Check for GPU/MPS (Mac) or default to CPU
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"Loading embedding model: {model_name} on {self.device}...")
-        self.model = SentenceTransformer(model_name, device=self.device)
+        self.model_name = model_name
+        self.model = sentence_transformers.SentenceTransformer(model_name, device=self.device)
+        self.model.eval()
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+        if precision == "int8" and self.device != "cpu":
+            print(" int8 quantization is CPU-only; using fp32.")
+            precision = "fp32"
+        if precision == "int8":
+            # Weights stored as int8, activations quantized on the fly per batch
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.precision = precision
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.processes = processes
+        self._pool = None
+
+        self.cache = None
+        if cache_dir:
+            try:
+                # Quantized vectors differ from fp32 ones, so they get their own cache
+                self.cache = open_cache(cache_dir, self.cache_name, dimension=self.dimension)
+            except OSError as e:
+                print(f" Embedding cache disabled: {e}")
+
+    @property
+    def cache_name(self):
+        return self.model_name if self.precision == "fp32" else f"{self.model_name}@{self.precision}"
+
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        encoded = self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length,
+                                       return_attention_mask=False, return_token_type_ids=False)
+        return np.array([len(ids) for ids in encoded["input_ids"]])
+
+    def _batches(self, lengths):
+        """Length-sorted batches of indices, capped by batch_size and max_batch_tokens (padded)."""
+        batch = []
+        # Longest first, so the peak memory batch runs (and fails, if it must) early
+        for i in np.argsort(-lengths, kind="stable"):
+            padded = int(lengths[batch[0]] if batch else lengths[i]) * (len(batch) + 1)
+            if batch and (len(batch) >= self.batch_size or padded > self.max_batch_tokens):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
+    def _encode_local(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        with torch.inference_mode():
+            for batch in self._batches(self._token_lengths(texts)):
+                # Each batch is padded only to its own longest text
+                features = self.model.tokenize([texts[i] for i in batch])
+                features = {name: tensor.to(self.device) for name, tensor in features.items()}
+                output = self.model(features)["sentence_embedding"]
+                # Normalized, so cosine similarity is a dot product
+                output = torch.nn.functional.normalize(output, p=2, dim=1)
+                embeddings[batch] = output.float().cpu().numpy()
+        return embeddings
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.processes)
+            # spawn: forking a process that already runs torch threads can deadlock
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pool_worker,
+                initargs=(self.model_name, self.batch_size, self.max_batch_tokens, threads, self.precision))
+            atexit.register(self.close)
+        return self._pool
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
+        if self.processes <= 0 or len(texts) < POOL_MIN_TEXTS:
+            return self._encode_local(texts)
+        # Hand out length-sorted slices, a few per worker, so every worker still
+        # gets evenly padded batches and a slow slice doesn't stall the others
+        order = np.argsort(-self._token_lengths(texts), kind="stable")
+        step = max(self.batch_size, -(-len(texts) // (self.processes * 4)))
+        slices = [order[start:start + step] for start in range(0, len(order), step)]
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        results = self._get_pool().map(_encode_in_worker, [[texts[i] for i in s] for s in slices])
+        for s, encoded in zip(slices, results):
+            embeddings[s] = encoded
+        return embeddings
+
+    def warm_up(self, text="warm up"):
+        """Encodes text once, bypassing the cache (first-call setup of torch and the tokenizer)."""
+        return self._encode_local([text])
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
 
     def embed(self, texts: Union[str, List[str]]) -> np.ndarray:
         """
         Embeds a list of strings or a single string.
         Returns a numpy array of float32 embeddings.
+        Cached texts are served from the embedding cache; only misses reach the model.
         """
         # If a single string is passed, wrap it in a list
         if isinstance(texts, str):
             texts = [texts]
-        
-        # normalize_embeddings=True ensures cosine similarity via dot product
-        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
\ No newline at end of file
+
+        if self.cache is None:
+            metrics.incr("texts_encoded", len(texts))
+            return self._encode(texts)
+
+        embeddings, missing = self.cache.lookup(texts)
+        metrics.incr("embedding_cache_hits", len(texts) - len(missing))
+        metrics.incr("embedding_cache_misses", len(missing))
+        if missing:
+            # Encode each distinct missing text once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            metrics.incr("texts_encoded", len(unique_texts))
+            encoded = np.asarray(self._encode(unique_texts), dtype='float32')
+            self.cache.store(unique_texts, encoded)
+            rows = {text: row for row, text in enumerate(unique_texts)}
+            for i in missing:
+                embeddings[i] = encoded[rows[texts[i]]]
+        return embeddings
@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:   # Windows: no cross-process lock, row keys still catch reused rows
+    fcntl = None
+
+VECTORS_FILE = "vectors.f32"
+ROW_KEYS_FILE = "row_keys.bin"
+KEYS_FILE = "keys.npy"
+META_FILE = "cache_meta.json"
+LOCK_FILE = "cache.lock"
+KEY_BYTES = 20
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(cache_dir, model_name, dimension=384, **options):
+    """The process-wide EmbeddingCache for (cache_dir, model_name), opened on first use."""
+    path = os.path.abspath(os.path.join(cache_dir, EmbeddingCache.safe_name(model_name)))
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None or cache.dimension != dimension:
+            cache = _caches[path] = EmbeddingCache(cache_dir, model_name, dimension=dimension, **options)
+        return cache
+
+
+def _pad(key):
+    # numpy "S" arrays drop trailing NUL bytes, which digests can end with
+    return bytes(key).ljust(KEY_BYTES, b"\0")
+
+
+class _FileLock:
+    """Exclusive flock on a file, so processes sharing a cache directory take turns."""
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        # Closing the file releases the lock
+        self._file.close()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model name, text hash).
+
+    Vectors live in a memory-mapped float32 matrix (one row per cached text), and a
+    parallel memory-mapped array records the SHA-1 digest each row holds. An in-memory
+    index maps digests to rows, ordered from least to most recently used, and a small
+    in-memory LRU sits in front for hot entries such as repeated FAQ queries.
+    When max_entries is reached the least recently used rows are evicted and reused.
+
+    Several instances (threads via open_cache(), or other processes) can share a
+    directory: rows are allocated under a file lock against the row count on disk, and
+    a lookup only trusts a row whose recorded digest still matches, so a row another
+    instance reused is a miss rather than a wrong vector. keys.npy only keeps the LRU
+    order between runs; the row keys are the source of truth.
+    """
+    def __init__(self, cache_dir, model_name, dimension=384, max_entries=200_000,
+                 memory_entries=2048, flush_every=256):
+        self.cache_dir = os.path.join(cache_dir, self.safe_name(model_name))
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.flush_every = flush_every
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._rows = OrderedDict()    # digest -> row, least recently used first
+        self._memory = OrderedDict()  # digest -> vector, in-memory LRU
+        self._free_rows = []
+        self._next_row = 0
+        self._capacity = 0
+        self._vectors = None
+        self._row_keys = None
+        self._dirty = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._file_lock():
+            self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def safe_name(model_name):
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _file_lock(self):
+        return _FileLock(self._path(LOCK_FILE))
+
+    def _read_meta(self):
+        try:
+            with open(self._path(META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load(self):
+        meta = self._read_meta()
+        if meta is None or not os.path.exists(self._path(VECTORS_FILE)):
+            return
+        if meta.get("model_name") != self.model_name or meta.get("dimension") != self.dimension:
+            print(f" Embedding cache at {self.cache_dir} belongs to another model. Starting empty.")
+            return
+
+        try:
+            # Caches written before row keys existed have no row key file yet
+            self._ensure_size(ROW_KEYS_FILE, KEY_BYTES, int(meta["capacity"]))
+            self._map(int(meta["capacity"]))
+        except (OSError, ValueError) as e:
+            print(f" Could not read embedding cache {self.cache_dir}: {e}")
+            self._vectors = self._row_keys = None
+            self._capacity = 0
+            return
+        self._next_row = min(int(meta["next_row"]), self._capacity)
+
+        try:
+            entries = np.load(self._path(KEYS_FILE))
+        except (OSError, ValueError):
+            entries = np.empty(0, dtype=[("key", "S20"), ("row", "<i4")])
+        if "row_keys" not in meta:
+            # Written before row keys existed: record them from the key index once
+            for key, row in zip(entries["key"], entries["row"]):
+                if row < self._next_row:
+                    self._set_key(row, _pad(key))
+            self._row_keys.flush()
+            self._write_meta()
+
+        # LRU order from keys.npy where it still agrees with the rows, then whatever
+        # other instances added since it was written
+        keys = np.ascontiguousarray(entries["key"], dtype=f"S{KEY_BYTES}").view("uint8").reshape(-1, KEY_BYTES)
+        rows = entries["row"].astype(np.int64)
+        agree = rows < self._next_row
+        agree[agree] = (self._row_keys[rows[agree]] == keys[agree]).all(axis=1)
+        for key, row in zip(keys[agree], rows[agree]):
+            self._rows[key.tobytes()] = int(row)
+        known = set(rows[agree].tolist())
+        used = self._row_keys[:self._next_row].any(axis=1)
+        for row in np.flatnonzero(used):
+            if int(row) not in known:
+                self._rows[self._row_keys[row].tobytes()] = int(row)
+        self._free_rows = [int(row) for row in np.flatnonzero(~used)]
+
+    def _map(self, capacity):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._row_keys.flush()
+        self._vectors = np.memmap(self._path(VECTORS_FILE), dtype="float32", mode="r+",
+                                  shape=(capacity, self.dimension))
+        self._row_keys = np.memmap(self._path(ROW_KEYS_FILE), dtype="uint8", mode="r+",
+                                   shape=(capacity, KEY_BYTES))
+        self._capacity = capacity
+
+    def _ensure_size(self, name, row_bytes, capacity):
+        with open(self._path(name), "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+
+    def _grow(self, min_capacity):
+        new_capacity = max(min_capacity, min(self.max_entries, max(1024, self._capacity * 2)))
+        self._ensure_size(VECTORS_FILE, self.dimension * 4, new_capacity)
+        self._ensure_size(ROW_KEYS_FILE, KEY_BYTES, new_capacity)
+        self._map(new_capacity)
+
+    def _holds(self, row, key):
+        return row < self._capacity and self._row_keys[row].tobytes() == key
+
+    def _set_key(self, row, key):
+        self._row_keys[row] = np.frombuffer(key, dtype="uint8")
+
+    def _sync_locked(self):
+        """Catches up with rows allocated by other instances. Needs the file lock."""
+        meta = self._read_meta()
+        if meta is None or meta.get("model_name") != self.model_name or meta.get("dimension") != self.dimension:
+            return
+        if int(meta["capacity"]) > self._capacity:
+            self._map(int(meta["capacity"]))
+        self._next_row = max(self._next_row, int(meta["next_row"]))
+
+    def _allocate_row(self):
+        # Free rows may have been taken by another instance since they were found
+        while self._free_rows:
+            row = self._free_rows.pop()
+            if not self._row_keys[row].any():
+                return row
+        if self._next_row < self.max_entries:
+            if self._next_row >= self._capacity:
+                self._grow(self._next_row + 1)
+            row = self._next_row
+            self._next_row += 1
+            return row
+
+        if not self._rows:
+            # Other instances filled the file since this one loaded: take over their rows
+            self._adopt_rows()
+            if self._free_rows:
+                return self._free_rows.pop()
+
+        # Full: reuse the least recently used entry's row
+        key, row = self._rows.popitem(last=False)
+        self._memory.pop(key, None)
+        return row
+
+    def _adopt_rows(self):
+        """Indexes every row on disk that this instance doesn't know yet. Needs the file lock."""
+        used = self._row_keys[:self._next_row].any(axis=1)
+        for row in np.flatnonzero(used):
+            self._rows.setdefault(self._row_keys[row].tobytes(), int(row))
+        self._free_rows = [int(row) for row in np.flatnonzero(~used)]
+
+    def _read_row(self, key, row):
+        """The row's vector if it still holds key, else None (another instance reused it)."""
+        if not self._holds(row, key):
+            return None
+        vector = np.array(self._vectors[row])
+        # A writer clears the key before it touches the vector, so checking again after
+        # the copy catches a row rewritten under us
+        if not self._holds(row, key):
+            return None
+        return vector
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, texts):
+        """
+        Returns (vectors, missing) where vectors is an (n, dimension) float32 array
+        filled for cached texts and missing lists the indices that still need encoding.
+        """
+        vectors = np.zeros((len(texts), self.dimension), dtype="float32")
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self._digest(text)
+                cached = self._memory.get(key)
+                if cached is not None:
+                    self._memory.move_to_end(key)
+                    self._rows.move_to_end(key)
+                    vectors[i] = cached
+                    continue
+
+                row = self._rows.get(key)
+                vector = None if row is None else self._read_row(key, row)
+                if vector is None:
+                    if row is not None:
+                        del self._rows[key]
+                    missing.append(i)
+                    continue
+                self._rows.move_to_end(key)
+                vectors[i] = vector
+                self._remember(key, vector)
+
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return vectors, missing
+
+    def store(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype="float32").reshape(len(texts), self.dimension)
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            for text, vector in zip(texts, vectors):
+                key = self._digest(text)
+                row = self._rows.get(key)
+                if row is not None and self._holds(row, key):
+                    continue
+                self._rows.pop(key, None)
+                row = self._allocate_row()
+                self._row_keys[row] = 0
+                self._vectors[row] = vector
+                self._set_key(row, key)
+                self._rows[key] = row
+                self._remember(key, vector.copy())
+                self._dirty += 1
+            # Claim the new rows on disk before releasing the lock
+            self._write_meta()
+
+            if self._dirty >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock, self._file_lock():
+            # Never write back a row count older than what other instances claimed
+            self._sync_locked()
+            self._flush_locked()
+
+    def _write_meta(self):
+        meta_file = self._path(META_FILE)
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "model_name": self.model_name,
+                "dimension": self.dimension,
+                "capacity": self._capacity,
+                "next_row": self._next_row,
+                "row_keys": True
+            }, f)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    def _flush_locked(self):
+        if not self._dirty:
+            return
+        if self._vectors is not None:
+            # Vectors must hit the disk before the keys that vouch for them
+            self._vectors.flush()
+            self._row_keys.flush()
+
+        entries = np.empty(len(self._rows), dtype=[("key", "S20"), ("row", "<i4")])
+        entries["key"] = list(self._rows.keys())
+        entries["row"] = list(self._rows.values())
+
+        keys_file = self._path(KEYS_FILE)
+        with open(keys_file + ".tmp", "wb") as f:
+            np.save(f, entries)
+        os.replace(keys_file + ".tmp", keys_file)
+        self._write_meta()
+        self._dirty = 0
@@ -0,0 +1,116 @@
+"""
+Streaming ingestion: parse and chunk files in a process pool and feed the
+chunks to build_index.index_documents() as they arrive.
+
+Workers return chunks only (plus the normalized document text for span
+storage), results are yielded in submission order, and at most max_in_flight
+files are parsed ahead of the embedder - so peak memory is bounded by a few
+documents plus one embedding batch, however many files the folder holds.
+"""
+import os
+import glob
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from document_parser import extract_text, SUPPORTED_EXTENSIONS
+from build_index import chunk_document, index_documents
+
+DEFAULT_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+def parse_file(source, payload, known_hash=None, keep_document=False):
+    """
+    Worker: payload is a file path or the raw bytes of an upload.
+    Returns a chunk_document() result, {"source", "error"} on failure, or None
+    for an empty file.
+    """
+    try:
+        if isinstance(payload, str):
+            with open(payload, "rb") as f:
+                payload = f.read()
+        text = extract_text(source, payload)
+    except OSError as e:
+        return {"source": source, "error": f"Error reading {source}: {e}"}
+    except ValueError as e:
+        return {"source": source, "error": str(e)}
+    if not text:
+        print(f" Skipping empty file: {source}")
+        return None
+    return chunk_document(source, text, known_hash, keep_document)
+
+
+def iter_parsed_files(items, known_hashes=None, workers=DEFAULT_WORKERS, max_in_flight=None, keep_document=False):
+    """
+    Yields parse_file() results for items, an iterable of (source, path_or_bytes),
+    in order. Files are parsed by `workers` processes with at most max_in_flight
+    submitted ahead of the consumer (workers=0 parses in this process).
+    keep_document also returns the normalized text (see chunk_document()).
+    """
+    known_hashes = known_hashes or {}
+    if workers <= 0:
+        for source, payload in items:
+            yield parse_file(source, payload, known_hashes.get(source), keep_document)
+        return
+
+    max_in_flight = max_in_flight or workers * 4
+    pending = deque()
+    # spawn: forking the threaded UI / API server process can deadlock the child
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for source, payload in items:
+            pending.append(pool.submit(parse_file, source, payload, known_hashes.get(source), keep_document))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # The consumer may stop early (cancelled job, error): don't parse the rest
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def index_files(items, output_path, workers=DEFAULT_WORKERS, **kwargs):
+    """
+    Indexes (source, path_or_bytes) items into output_path; kwargs go to index_documents().
+    items is the full corpus, as with run_indexing_pipeline(), unless partial=True.
+    """
+    items = list(items)
+    print(f"Indexing {len(items)} files to {output_path} with {workers} parser processes...")
+    return index_documents(lambda known, keep_document: iter_parsed_files(items, known, workers,
+                                                                          keep_document=keep_document),
+                           output_path, **kwargs)
+
+
+def index_folder(folder_path, output_path, extensions=("md",), workers=DEFAULT_WORKERS, **kwargs):
+    """Indexes every file of the given extensions in folder_path (sorted, for a deterministic order)."""
+    unsupported = set(extensions) - set(SUPPORTED_EXTENSIONS)
+    if unsupported:
+        raise ValueError(f"Unsupported extensions: {sorted(unsupported)}")
+    paths = sorted(p for ext in extensions for p in glob.glob(os.path.join(folder_path, f"*.{ext}")))
+    if not paths:
+        print(f" No {'/'.join(extensions)} files found in {folder_path}!")
+        return None
+    return index_files([(os.path.basename(p), p) for p in paths], output_path, workers=workers, **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+    from embedder import BULK_PROCESSES
+    from metadata_store import STORAGE_MODES
+    parser = argparse.ArgumentParser(description="Parse, chunk and index a folder of documents.")
+    parser.add_argument("folder")
+    parser.add_argument("output_path")
+    parser.add_argument("--extensions", default="md", help="Comma-separated, e.g. pdf,docx,md")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--index-spec", default=None,
+                        help="FAISS index type, e.g. Flat, SQ8, HNSW32 (default: keep the index's type, Flat if new)")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Partition the index into this many shards (default: keep the index's count, 1 if new)")
+    parser.add_argument("--embed-processes", type=int, default=BULK_PROCESSES,
+                        help="Embedding worker processes (0 = embed in this process)")
+    parser.add_argument("--chunk-storage", choices=STORAGE_MODES, default=None,
+                        help="'spans' stores each document once instead of every chunk's text "
+                             "(default: keep the index's mode)")
+    args = parser.parse_args()
+    index_folder(args.folder, args.output_path, extensions=tuple(args.extensions.split(",")),
+                 workers=args.workers, index_spec=args.index_spec, num_shards=args.shards,
+                 embed_processes=args.embed_processes, chunk_storage=args.chunk_storage)
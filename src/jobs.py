@@ -0,0 +1,171 @@
+"""
+Background indexing jobs.
+
+A single worker thread takes jobs off a local queue and runs ingest.index_files(),
+reporting progress as it goes. The build publishes a new index snapshot only when
+it finishes (see VectorStore.save), after which every session holding the index
+is hot-swapped (resources.reload_store); queries keep being served from the old
+snapshot for the whole build. Cancelled or failed jobs leave the index untouched.
+"""
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+import resources
+from ingest import index_files, DEFAULT_WORKERS
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+MAX_FINISHED_JOBS = 50
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IndexingJob:
+    def __init__(self, items, output_path, index_kwargs):
+        self.id = uuid.uuid4().hex[:12]
+        self.items = items
+        self.output_path = output_path
+        self.index_kwargs = dict(index_kwargs)
+        # Chunks embedded by this job can be filtered on as one upload set
+        self.index_kwargs.setdefault("batch_label", f"job-{self.id}")
+        self.status = QUEUED
+        self.stage = "queued"
+        self.progress = {"files_total": len(items), "files_parsed": 0,
+                         "chunks_embedded": 0, "vectors_written": 0}
+        self.summary = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def cancel(self):
+        """Requests cancellation; a running job stops at its next progress update."""
+        self._cancel.set()
+
+    def report(self, stage=None, **increments):
+        """Progress callback handed to the indexing pipeline; raises JobCancelled when cancelled."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        if stage:
+            self.stage = stage
+        for key, amount in increments.items():
+            self.progress[key] = self.progress.get(key, 0) + amount
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "output_path": self.output_path,
+            "progress": dict(self.progress),
+            "summary": self.summary,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobQueue:
+    """Runs indexing jobs one at a time on a daemon worker thread."""
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, items, output_path, **index_kwargs):
+        """
+        Queues a build of output_path from (source, path_or_bytes) items - the full
+        corpus, as with ingest.index_files(), or only the files to add or replace
+        with partial=True. Returns the IndexingJob.
+        """
+        job = IndexingJob(list(items), output_path, index_kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="minirag-indexer", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def submit_removal(self, sources, output_path):
+        """Queues the removal of the given sources' chunks from output_path."""
+        return self.submit([], output_path, partial=True, remove_sources=list(sources))
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        if job._cancel.is_set():
+            job.finished_at = time.time()
+            job.stage = job.status = CANCELLED
+            return
+
+        job.status, job.stage, job.started_at = RUNNING, "preparing", time.time()
+        status = FAILED
+        try:
+            job.report(stage="parsing")
+            workers = min(self.workers, len(job.items))
+            job.summary = index_files(job.items, job.output_path, workers=workers,
+                                      progress=job.report, **job.index_kwargs)
+            resources.reload_store(job.output_path)
+            status = DONE
+        except JobCancelled:
+            status = CANCELLED
+            print(f" Indexing job {job.id} cancelled.")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            print(f" Indexing job {job.id} failed: {job.error}")
+        finally:
+            job.items = None  # Release the uploaded bytes
+            # finished_at before status: pollers treat a final status as complete
+            job.finished_at = time.time()
+            job.stage = status
+            job.status = status
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue(workers=DEFAULT_WORKERS):
+    """The process-wide job queue, shared by every Streamlit session and the API."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(workers)
+        return _job_queue
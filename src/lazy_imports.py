@@ -0,0 +1,45 @@
+"""
+Deferred imports for the heavy libraries (torch, sentence_transformers, faiss, openai).
+
+    faiss = lazy_module("faiss")
+
+binds a placeholder that imports the real module on first attribute access, so
+importing rag_pipeline (and with it the Streamlit app or the API server) no
+longer pays several seconds before anything is loaded. The import happens
+wherever the module is first used, normally while the models load in the
+background (see RAGPipeline(background=True)).
+"""
+import sys
+import importlib
+import threading
+
+_lock = threading.Lock()
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def _load(self):
+        module = self.__module
+        if module is None:
+            with _lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+                module = self.__module
+        return module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        # Later lookups of the same attribute skip __getattr__
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return f"<lazy module {self.__name!r}{'' if self.__module is None else ' (loaded)'}>"
+
+
+def lazy_module(name):
+    """The module itself if it was already imported, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,380 @@
+"""
+Managed LLM clients, shared by every RAGPipeline in the process.
+
+Both back-ends speak the OpenAI chat completions API (Ollama through its
+OpenAI-compatible /v1 endpoint), so a stand-in HTTP server can replace either.
+There is one LLMBackend per base URL. It:
+- keeps keep-alive clients per API key (one connection pool and TLS session
+  each, instead of one per question);
+- applies connect and read timeouts;
+- retries connection errors, timeouts, 429s and 5xx responses with jittered
+  exponential backoff;
+- caps concurrent requests per back-end.
+
+complete() / stream() and their async versions add an optional second back-end.
+"failover" tries it when the primary fails. "hedge" also sends the request to
+it when the primary has not answered within its recent p95 latency, and the
+first answer wins. Streams fail over only before their first token.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from lazy_imports import lazy_module
+import metrics
+
+openai = lazy_module("openai")
+httpx = lazy_module("httpx")
+
+CONNECT_TIMEOUT = float(os.environ.get("MINIRAG_LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("MINIRAG_LLM_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.environ.get("MINIRAG_LLM_MAX_RETRIES", "2"))
+CONCURRENCY = int(os.environ.get("MINIRAG_LLM_CONCURRENCY", "8"))          # in-flight requests per back-end
+QUEUE_TIMEOUT = float(os.environ.get("MINIRAG_LLM_QUEUE_TIMEOUT", "30"))   # max wait for a free slot
+FALLBACK = os.environ.get("MINIRAG_LLM_FALLBACK", "none")                  # "none", "failover" or "hedge"
+FALLBACK_MODES = ("none", "failover", "hedge")
+DEFAULT_OLLAMA_HOST = "http://localhost:11434"
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+HEDGE_MIN_SAMPLES = 20   # completions needed before p95 is trusted for hedging
+LATENCY_WINDOW = 200
+MAX_CLIENTS = 32         # API keys with a live client per back-end
+
+_backends = {}
+_lock = threading.Lock()
+_hedge_pool = None
+
+
+class LLMError(Exception):
+    """A request failed for good: retries exhausted, a non-retryable error, or no free slot."""
+
+
+def _retryable():
+    # APITimeoutError is an APIConnectionError; raw httpx errors can surface while a stream is read
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError, httpx.TransportError)
+
+
+def _errors():
+    return (openai.APIError, httpx.HTTPError)
+
+
+def preload():
+    """
+    Imports the client libraries and builds (and discards) one client now, e.g.
+    during warm-up, instead of on the first question. Sends no request.
+    """
+    openai.OpenAI(base_url=ollama_base_url(), api_key="preload", max_retries=0).close()
+    return openai.AsyncOpenAI, httpx.Timeout
+
+
+def ollama_base_url(host=None):
+    host = (host or os.environ.get("OLLAMA_HOST") or DEFAULT_OLLAMA_HOST).rstrip("/")
+    if "://" not in host:
+        host = "http://" + host
+    return host if host.endswith("/v1") else host + "/v1"
+
+
+def get_backend(name, base_url):
+    """The process-wide LLMBackend for base_url (name labels its errors and metrics)."""
+    with _lock:
+        backend = _backends.get(base_url)
+        if backend is None:
+            backend = LLMBackend(name, base_url)
+            _backends[base_url] = backend
+        return backend
+
+
+class LLMBackend:
+    def __init__(self, name, base_url, concurrency=CONCURRENCY, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES):
+        self.name = name
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._clients = OrderedDict()                # api key -> OpenAI, least recently used first
+        self._loops = weakref.WeakKeyDictionary()    # event loop -> {"slots", "clients"}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _cached_client(self, clients, api_key, factory, close):
+        client = clients.get(api_key)
+        if client is None:
+            client = factory(base_url=self.base_url, api_key=api_key, timeout=self.timeout, max_retries=0)
+            clients[api_key] = client
+            if len(clients) > MAX_CLIENTS:
+                # Release the evicted client's connection pool
+                close(clients.popitem(last=False)[1])
+        clients.move_to_end(api_key)
+        return client
+
+    def client(self, api_key):
+        with self._lock:
+            return self._cached_client(self._clients, api_key, openai.OpenAI, lambda client: client.close())
+
+    def _loop_state(self):
+        # Async clients and semaphores belong to the event loop they were created on
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.get(loop)
+            if state is None:
+                state = {"slots": asyncio.Semaphore(self.concurrency), "clients": OrderedDict(), "closing": set()}
+                self._loops[loop] = state
+            return state
+
+    def async_client(self, api_key):
+        state = self._loop_state()
+        with self._lock:
+            return self._cached_client(state["clients"], api_key, openai.AsyncOpenAI,
+                                       lambda client: self._close_later(state, client))
+
+    @staticmethod
+    def _close_later(state, client):
+        # Async clients close on their own loop; the task is referenced until it is done
+        task = asyncio.get_running_loop().create_task(client.close())
+        state["closing"].add(task)
+        task.add_done_callback(state["closing"].discard)
+
+    def p95(self):
+        """p95 of recent completion latencies in seconds, or None until there are enough samples."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    @staticmethod
+    def _backoff(attempt):
+        # Full jitter, so clients retrying after the same outage don't stampede together
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def _retry_or_raise(self, error, attempt):
+        if not isinstance(error, _retryable()) or attempt >= self.max_retries:
+            metrics.incr("llm_failures", backend=self.name)
+            raise LLMError(str(error)) from error
+        metrics.incr("llm_retries", backend=self.name)
+        return self._backoff(attempt)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=QUEUE_TIMEOUT):
+            raise LLMError(f"{self.name} is busy ({self.concurrency} requests in flight)")
+
+    def complete(self, model, messages, api_key):
+        self._acquire()
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    response = self.client(api_key).chat.completions.create(model=model, messages=messages)
+                except _errors() as e:
+                    time.sleep(self._retry_or_raise(e, attempt))
+                    continue
+                self._record(time.perf_counter() - started)
+                return response.choices[0].message.content or ""
+        finally:
+            self._slots.release()
+
+    def stream(self, model, messages, api_key):
+        """Yields answer deltas; a failure before the first one is retried, later ones raise LLMError."""
+        self._acquire()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    deltas = _deltas(self.client(api_key).chat.completions.create(
+                        model=model, messages=messages, stream=True))
+                    first = next(deltas, None)
+                    break
+                except _errors() as e:
+                    time.sleep(self._retry_or_raise(e, attempt))
+            if first is None:
+                return
+            yield first
+            try:
+                yield from deltas
+            except _errors() as e:
+                metrics.incr("llm_failures", backend=self.name)
+                raise LLMError(str(e)) from e
+        finally:
+            self._slots.release()
+
+    async def _aacquire(self, slots):
+        try:
+            await asyncio.wait_for(slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise LLMError(f"{self.name} is busy ({self.concurrency} requests in flight)") from None
+
+    async def acomplete(self, model, messages, api_key):
+        slots = self._loop_state()["slots"]
+        await self._aacquire(slots)
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    response = await self.async_client(api_key).chat.completions.create(
+                        model=model, messages=messages)
+                except _errors() as e:
+                    await asyncio.sleep(self._retry_or_raise(e, attempt))
+                    continue
+                self._record(time.perf_counter() - started)
+                return response.choices[0].message.content or ""
+        finally:
+            slots.release()
+
+    async def astream(self, model, messages, api_key):
+        slots = self._loop_state()["slots"]
+        await self._aacquire(slots)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    deltas = _adeltas(await self.async_client(api_key).chat.completions.create(
+                        model=model, messages=messages, stream=True))
+                    first = await anext(deltas, None)
+                    break
+                except _errors() as e:
+                    await asyncio.sleep(self._retry_or_raise(e, attempt))
+            if first is None:
+                return
+            yield first
+            try:
+                async for delta in deltas:
+                    yield delta
+            except _errors() as e:
+                metrics.incr("llm_failures", backend=self.name)
+                raise LLMError(str(e)) from e
+        finally:
+            slots.release()
+
+
+def _deltas(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def _adeltas(stream):
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _pool():
+    global _hedge_pool
+    with _lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=2 * CONCURRENCY, thread_name_prefix="minirag-llm")
+        return _hedge_pool
+
+
+# A route is (backend, model, api_key); fallback may be None
+
+def complete(messages, primary, fallback=None, mode=FALLBACK):
+    backend, model, api_key = primary
+    if fallback is None or mode == "none":
+        return backend.complete(model, messages, api_key)
+    if mode == "hedge" and backend.p95() is not None:
+        return _hedged(messages, primary, fallback)
+    try:
+        return backend.complete(model, messages, api_key)
+    except LLMError:
+        metrics.incr("llm_failovers", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        return fallback_backend.complete(fallback_model, messages, fallback_key)
+
+
+def _hedged(messages, primary, fallback):
+    pool = _pool()
+    backend, model, api_key = primary
+    futures = [pool.submit(backend.complete, model, messages, api_key)]
+    done, _ = wait(futures, timeout=backend.p95())
+    if not done or futures[0].exception() is not None:
+        metrics.incr("llm_hedges", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        futures.append(pool.submit(fallback_backend.complete, fallback_model, messages, fallback_key))
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # The slower request finishes in the background and is discarded
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def acomplete(messages, primary, fallback=None, mode=FALLBACK):
+    backend, model, api_key = primary
+    if fallback is None or mode == "none":
+        return await backend.acomplete(model, messages, api_key)
+    if mode == "hedge" and backend.p95() is not None:
+        return await _ahedged(messages, primary, fallback)
+    try:
+        return await backend.acomplete(model, messages, api_key)
+    except LLMError:
+        metrics.incr("llm_failovers", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        return await fallback_backend.acomplete(fallback_model, messages, fallback_key)
+
+
+async def _ahedged(messages, primary, fallback):
+    backend, model, api_key = primary
+    tasks = [asyncio.create_task(backend.acomplete(model, messages, api_key))]
+    done, _ = await asyncio.wait(tasks, timeout=backend.p95())
+    if not done or tasks[0].exception() is not None:
+        metrics.incr("llm_hedges", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        tasks.append(asyncio.create_task(fallback_backend.acomplete(fallback_model, messages, fallback_key)))
+    pending = set(tasks)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def stream(messages, primary, fallback=None, mode=FALLBACK):
+    backend, model, api_key = primary
+    started = False
+    try:
+        for delta in backend.stream(model, messages, api_key):
+            started = True
+            yield delta
+    except LLMError:
+        if started or fallback is None or mode == "none":
+            raise
+        metrics.incr("llm_failovers", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        yield from fallback_backend.stream(fallback_model, messages, fallback_key)
+
+
+async def astream(messages, primary, fallback=None, mode=FALLBACK):
+    backend, model, api_key = primary
+    started = False
+    try:
+        async for delta in backend.astream(model, messages, api_key):
+            started = True
+            yield delta
+    except LLMError:
+        if started or fallback is None or mode == "none":
+            raise
+        metrics.incr("llm_failovers", backend=backend.name)
+        fallback_backend, fallback_model, fallback_key = fallback
+        async for delta in fallback_backend.astream(fallback_model, messages, fallback_key):
+            yield delta
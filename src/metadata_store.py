@@ -0,0 +1,400 @@
+import os
+import json
+import zlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+HEADER_FILE = "metadata.json"
+OFFSETS_FILE = "metadata_offsets.npy"
+TEXT_FILE = "metadata_text.bin"
+SOURCE_IDS_FILE = "metadata_source_ids.npy"
+# Interned columns: field -> id array file. -1 marks an unknown value.
+FIELD_FILES = {
+    "source": SOURCE_IDS_FILE,
+    "section": "metadata_section_ids.npy",
+    "batch": "metadata_batch_ids.npy"
+}
+FORMAT_VERSION = 2
+
+# "text" stores every chunk's text; "spans" stores each document once (see MetadataStore)
+CHUNK_STORAGE = os.environ.get("MINIRAG_CHUNK_STORAGE", "text")
+STORAGE_MODES = ("text", "spans")
+SPANS_FILE = "metadata_spans.npy"
+DOCUMENTS_FILE = "metadata_documents.bin"
+FRAME_OFFSETS_FILE = "metadata_frame_offsets.npy"
+DOCUMENT_FRAMES_FILE = "metadata_document_frames.npy"
+FRAME_CHARS = 65536      # Characters of normalized document text per compressed frame
+FRAME_CACHE_SIZE = 64    # Decompressed frames kept per store
+
+def chunk_header(source, section):
+    """The context line advanced_chunking prefixes to every chunk."""
+    return f"[{source} | Section: {section}]\n"
+
+def _replace_file(path, write):
+    # Write to a temp file and rename, so readers that memory-mapped the old file keep a valid inode
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _matches(field, name, wanted):
+    # A section filter matches any level of the path: "Pricing" matches
+    # "Pricing > Premier" as well as "Overview > Pricing"
+    if field == "section":
+        parts = name.split(" > ")
+        return any(name == w or name.startswith(w + " > ") or w in parts for w in wanted)
+    return name in wanted
+
+class MetadataStore:
+    """
+    Compact chunk metadata: one contiguous UTF-8 text blob, an int64 offsets array
+    and one int32 id column per structured field (source, section path, ingestion
+    batch), with the distinct values interned in a small header.
+
+    With storage="spans" the chunk texts are not stored at all. Chunks overlap
+    and repeat their "[source | Section]" header, so instead each document is
+    kept once as normalized text (advanced_chunking's lines joined by spaces),
+    zlib-compressed in frames of FRAME_CHARS characters, and every chunk is a
+    (document, start, end, header) row. A chunk's text is rebuilt from its span
+    and its source / section columns only when it is looked up, e.g. for a hit;
+    recently decompressed frames are cached. Records that carry no span
+    ("document" + "span" keys, see build_index) are stored as their own document.
+
+    Loaded stores are memory-mapped, so opening an index costs O(1) memory and a
+    lookup decodes just the requested record; filters scan the id columns only.
+    Appended records are kept in memory until the next save; removals materialize
+    the store once (build path only). Behaves like the list of
+    {"source", "text", "section", "batch"} dicts it replaces.
+    """
+    def __init__(self, records=None, storage="text"):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"storage must be one of {STORAGE_MODES}, got {storage!r}")
+        self.storage = storage
+        self._count = 0
+        self._offsets = None
+        self._blob = None
+        self._names = {field: [] for field in FIELD_FILES}
+        self._ids = {field: None for field in FIELD_FILES}
+        self._pending = list(records or [])
+        # "spans" storage
+        self._spans = None             # (count, 4) int64: document, start, end, has header
+        self._frame_offsets = None     # byte offsets of the compressed frames in _blob
+        self._document_frames = None   # first frame of each document (plus an end marker)
+        self._frame_chars = FRAME_CHARS
+        self._frames = OrderedDict()   # frame -> decompressed text, least recently used first
+        self._frames_lock = threading.Lock()
+
+    @property
+    def _base_count(self):
+        return self._count
+
+    def __len__(self):
+        return self._base_count + len(self._pending)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("metadata index out of range")
+        if i >= self._base_count:
+            return self._pending[i - self._base_count]
+        record = {"source": self.source(i), "text": self.text(i)}
+        for field in ("section", "batch"):
+            record[field] = self.field(field, i)
+        return record
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def text(self, i):
+        if i >= self._base_count:
+            return self._pending[i - self._base_count]["text"]
+        if self.storage == "spans":
+            return self._span_text(i)
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def _frame(self, frame):
+        with self._frames_lock:
+            text = self._frames.get(frame)
+            if text is not None:
+                self._frames.move_to_end(frame)
+                return text
+        start, end = self._frame_offsets[frame], self._frame_offsets[frame + 1]
+        text = zlib.decompress(bytes(self._blob[start:end])).decode("utf-8")
+        with self._frames_lock:
+            self._frames[frame] = text
+            while len(self._frames) > FRAME_CACHE_SIZE:
+                self._frames.popitem(last=False)
+        return text
+
+    def _document_text(self, document, start=0, end=None):
+        """Normalized text of a stored document, or just [start:end] of it (decompresses only those frames)."""
+        first, last = int(self._document_frames[document]), int(self._document_frames[document + 1])
+        if end is None:
+            return "".join(self._frame(frame) for frame in range(first, last))
+        lo, hi = start // self._frame_chars, max(start, end - 1) // self._frame_chars
+        text = "".join(self._frame(first + frame) for frame in range(lo, min(hi + 1, last - first)))
+        offset = lo * self._frame_chars
+        return text[start - offset:end - offset]
+
+    def _span_text(self, i):
+        document, start, end, header = (int(value) for value in self._spans[i])
+        body = self._document_text(document, start, end)
+        return chunk_header(self.source(i), self.field("section", i)) + body if header else body
+
+    def source(self, i):
+        return self.field("source", i)
+
+    def field(self, field, i):
+        if i >= self._base_count:
+            return self._pending[i - self._base_count].get(field)
+        value_id = int(self._ids[field][i])
+        return self._names[field][value_id] if value_id >= 0 else None
+
+    def values(self, field):
+        """Distinct known values of a structured field, e.g. for a filter picker."""
+        seen = dict.fromkeys(self._names[field])
+        seen.update(dict.fromkeys(r.get(field) for r in self._pending if r.get(field) is not None))
+        return list(seen)
+
+    def select(self, filters):
+        """
+        Positions matching every field filter, as a sorted int64 array.
+        filters maps field -> value or list of values, e.g. {"source": "doc2.md"}.
+        Only the int32 id columns are scanned, never the text.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for field, wanted in filters.items():
+            if field not in FIELD_FILES:
+                raise ValueError(f"Unknown metadata field: {field}")
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            if self._base_count:
+                ids = [i for i, name in enumerate(self._names[field]) if _matches(field, name, wanted)]
+                mask[:self._base_count] &= np.isin(self._ids[field], ids)
+            for j, record in enumerate(self._pending):
+                name = record.get(field)
+                if name is None or not _matches(field, name, wanted):
+                    mask[self._base_count + j] = False
+        return np.flatnonzero(mask).astype(np.int64)
+
+    def lookup(self, positions):
+        """Decodes (source, text) pairs for a batch of positions, e.g. search hits."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.storage == "spans":
+            return [(self.source(pos), self.text(pos)) for pos in positions.tolist()]
+        base = positions < self._base_count
+        base_positions = positions[base]
+        starts = self._offsets[base_positions] if len(base_positions) else []
+        ends = self._offsets[base_positions + 1] if len(base_positions) else []
+        source_ids = self._ids["source"][base_positions] if len(base_positions) else []
+        sources = self._names["source"]
+
+        base_records = iter(
+            (sources[sid], bytes(self._blob[start:end]).decode("utf-8"))
+            for sid, start, end in zip(source_ids, starts, ends)
+        )
+        records = []
+        for pos, in_base in zip(positions.tolist(), base.tolist()):
+            if in_base:
+                records.append(next(base_records))
+            else:
+                pending = self._pending[pos - self._base_count]
+                records.append((pending["source"], pending["text"]))
+        return records
+
+    def append(self, record):
+        self._pending.append(record)
+
+    def extend(self, records):
+        self._pending.extend(records)
+
+    def delete(self, positions):
+        """Drops the given positions, keeping the remaining records in order."""
+        dropped = set(positions)
+        if self.storage != "spans":
+            records = [m for i, m in enumerate(self) if i not in dropped]
+        else:
+            # Keep the spans: each surviving document is decompressed once and shared by its chunks
+            documents = {}
+            records = []
+            for i in range(len(self)):
+                if i in dropped:
+                    continue
+                record = self[i]
+                if i < self._base_count:
+                    document, start, end, header = (int(value) for value in self._spans[i])
+                    if header:
+                        if document not in documents:
+                            documents[document] = self._document_text(document)
+                        record = dict(record, document=documents[document], span=(start, end))
+                records.append(record)
+        self.__init__(records, self.storage)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, HEADER_FILE))
+
+    @staticmethod
+    def remove_files(directory):
+        for name in (HEADER_FILE, OFFSETS_FILE, TEXT_FILE, SPANS_FILE, DOCUMENTS_FILE, FRAME_OFFSETS_FILE,
+                     DOCUMENT_FRAMES_FILE, *FIELD_FILES.values()):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save(self, directory):
+        names = {field: list(self._names[field]) for field in FIELD_FILES}
+        lookups = {field: {name: i for i, name in enumerate(names[field])} for field in FIELD_FILES}
+        new_ids = {field: [] for field in FIELD_FILES}
+        for record in self._pending:
+            for field in FIELD_FILES:
+                name = record.get(field)
+                if name is None:
+                    new_ids[field].append(-1)
+                    continue
+                if name not in lookups[field]:
+                    lookups[field][name] = len(names[field])
+                    names[field].append(name)
+                new_ids[field].append(lookups[field][name])
+        columns = {
+            field: np.concatenate([
+                np.asarray(self._ids[field] if self._ids[field] is not None else [], dtype=np.int32),
+                np.array(new_ids[field], dtype=np.int32)
+            ])
+            for field in FIELD_FILES
+        }
+
+        if self.storage == "spans":
+            self._save_spans(directory)
+        else:
+            self._save_text(directory)
+        for field, name in FIELD_FILES.items():
+            _replace_file(os.path.join(directory, name), lambda f, column=columns[field]: np.save(f, column))
+        # The header goes last: it is what marks the binary format as present
+        header = {
+            "format_version": FORMAT_VERSION,
+            "count": len(self),
+            "storage": self.storage,
+            "sources": names["source"],
+            "sections": names["section"],
+            "batches": names["batch"]
+        }
+        if self.storage == "spans":
+            header["frame_chars"] = self._frame_chars
+        _replace_file(os.path.join(directory, HEADER_FILE),
+                      lambda f: f.write(json.dumps(header, ensure_ascii=False).encode("utf-8")))
+
+    def _save_text(self, directory):
+        encoded = [record["text"].encode("utf-8") for record in self._pending]
+        base_end = 0 if self._offsets is None else int(self._offsets[-1])
+        lengths = np.array([len(b) for b in encoded], dtype=np.int64)
+        offsets = np.concatenate([
+            np.asarray(self._offsets if self._offsets is not None else [0], dtype=np.int64),
+            base_end + np.cumsum(lengths)
+        ])
+
+        def write_text(f):
+            if self._blob is not None:
+                f.write(self._blob[:base_end].tobytes())
+            for b in encoded:
+                f.write(b)
+
+        _replace_file(os.path.join(directory, TEXT_FILE), write_text)
+        _replace_file(os.path.join(directory, OFFSETS_FILE), lambda f: np.save(f, offsets))
+
+    def _save_spans(self, directory):
+        document_frames = [int(v) for v in self._document_frames] if self._document_frames is not None else [0]
+        frame_sizes = []
+        new_frames = []
+        documents = {}   # id(normalized text) -> document, so a document's chunks share one copy
+        rows = []
+
+        def add_document(text):
+            for start in range(0, max(len(text), 1), self._frame_chars):
+                new_frames.append(zlib.compress(text[start:start + self._frame_chars].encode("utf-8")))
+                frame_sizes.append(len(new_frames[-1]))
+            document_frames.append(document_frames[-1] + -(-max(len(text), 1) // self._frame_chars))
+            return len(document_frames) - 2
+
+        for record in self._pending:
+            text, document, span = record["text"], record.get("document"), record.get("span")
+            if document is not None and span is not None and \
+                    chunk_header(record["source"], record.get("section")) + document[span[0]:span[1]] == text:
+                if id(document) not in documents:
+                    documents[id(document)] = add_document(document)
+                rows.append((documents[id(document)], span[0], span[1], 1))
+            else:
+                rows.append((add_document(text), 0, len(text), 0))
+
+        base_end = 0 if self._frame_offsets is None else int(self._frame_offsets[-1])
+        frame_offsets = np.concatenate([
+            np.asarray(self._frame_offsets if self._frame_offsets is not None else [0], dtype=np.int64),
+            base_end + np.cumsum(np.array(frame_sizes, dtype=np.int64))
+        ])
+        spans = np.concatenate([
+            np.asarray(self._spans if self._spans is not None else np.empty((0, 4)), dtype=np.int64),
+            np.array(rows, dtype=np.int64).reshape(-1, 4)
+        ])
+
+        def write_documents(f):
+            if self._blob is not None:
+                f.write(self._blob[:base_end].tobytes())
+            for frame in new_frames:
+                f.write(frame)
+
+        _replace_file(os.path.join(directory, DOCUMENTS_FILE), write_documents)
+        _replace_file(os.path.join(directory, FRAME_OFFSETS_FILE), lambda f: np.save(f, frame_offsets))
+        _replace_file(os.path.join(directory, DOCUMENT_FRAMES_FILE),
+                      lambda f: np.save(f, np.array(document_frames, dtype=np.int64)))
+        _replace_file(os.path.join(directory, SPANS_FILE), lambda f: np.save(f, spans))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, HEADER_FILE), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        count = header["count"]
+
+        store = cls(storage=header.get("storage", "text"))
+        store._count = count
+        for field, header_key in (("source", "sources"), ("section", "sections"), ("batch", "batches")):
+            path = os.path.join(directory, FIELD_FILES[field])
+            store._names[field] = header.get(header_key, [])
+            if os.path.exists(path):
+                store._ids[field] = np.load(path, mmap_mode="r")
+            else:
+                # Format 1 only had the source column
+                store._ids[field] = np.full(count, -1, dtype=np.int32)
+            if len(store._ids[field]) != count:
+                raise ValueError(f"Metadata files in {directory} are inconsistent.")
+
+        if store.storage == "spans":
+            store._frame_chars = header.get("frame_chars", FRAME_CHARS)
+            store._spans = np.load(os.path.join(directory, SPANS_FILE), mmap_mode="r")
+            store._frame_offsets = np.load(os.path.join(directory, FRAME_OFFSETS_FILE), mmap_mode="r")
+            store._document_frames = np.load(os.path.join(directory, DOCUMENT_FRAMES_FILE), mmap_mode="r")
+            if len(store._spans) != count:
+                raise ValueError(f"Metadata files in {directory} are inconsistent.")
+            blob_file = os.path.join(directory, DOCUMENTS_FILE)
+        else:
+            store._offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+            if len(store._offsets) != count + 1:
+                raise ValueError(f"Metadata files in {directory} are inconsistent.")
+            blob_file = os.path.join(directory, TEXT_FILE)
+
+        if os.path.getsize(blob_file) > 0:
+            store._blob = np.memmap(blob_file, dtype=np.uint8, mode="r")
+        else:
+            store._blob = np.zeros(0, dtype=np.uint8)
+        return store
+
+    @classmethod
+    def load_json(cls, path):
+        """Reads the legacy pretty-printed vector_store.json sidecar."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
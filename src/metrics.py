@@ -0,0 +1,273 @@
+"""
+Lightweight instrumentation: span timers, counters and histograms.
+
+Nothing is recorded until a sink is installed (configure(), add_sink() or the
+MINIRAG_METRICS environment variable, e.g. "memory" or "memory,jsonl:metrics.jsonl");
+until then span() returns a shared no-op object and incr()/observe() return at
+once. Independently of sinks, `with trace() as t:` collects the duration of
+every span opened in that context into t, which is how RAGPipeline.run(timings=True)
+and the indexer report their per-stage breakdowns.
+
+Sinks:
+    MemorySink  - in-process aggregation; prometheus_text() renders it (GET /metrics)
+    JsonlSink   - appends every event (and every finished trace) to a JSONL file
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = tuple(2 ** i for i in range(17))
+PROMETHEUS_PREFIX = "minirag_"
+
+_sinks = []
+_current_trace = contextvars.ContextVar("minirag_trace", default=None)
+
+
+def buckets_for(name):
+    return SECONDS_BUCKETS if name.endswith("_seconds") else COUNT_BUCKETS
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class MemorySink:
+    """Aggregates counters and histograms in memory."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> total
+        self.histograms = {}  # (name, labels) -> {"buckets": per-bucket counts, "sum", "count"}
+
+    def record(self, event):
+        kind = event["kind"]
+        if kind == "trace":
+            return
+        key = (event["name"], tuple(sorted(event["labels"].items())))
+        value = event["value"]
+        with self._lock:
+            if kind == "counter":
+                self.counters[key] = self.counters.get(key, 0) + value
+                return
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": [0] * (len(buckets_for(event["name"])) + 1), "sum": 0.0, "count": 0}
+                self.histograms[key] = histogram
+            histogram["buckets"][bisect_left(buckets_for(event["name"]), value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self):
+        """Plain dict of the current values, e.g. for a JSON status endpoint."""
+        with self._lock:
+            return {
+                "counters": {name + _label_text(labels): value for (name, labels), value in self.counters.items()},
+                "histograms": {name + _label_text(labels): {"count": h["count"], "sum": round(h["sum"], 6)}
+                               for (name, labels), h in self.histograms.items()}
+            }
+
+    def prometheus_text(self):
+        """Prometheus text exposition format (counters get a _total suffix)."""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_total"
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{_label_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                bounds = [str(bound) for bound in buckets_for(name)] + ["+Inf"]
+                for bound, count in zip(bounds, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{_label_text(labels)} {histogram['sum']}")
+                lines.append(f"{metric}_count{_label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonlSink:
+    """Appends one JSON object per event to path."""
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def record(self, event):
+        line = json.dumps(dict(event, ts=round(time.time(), 6)), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def configure(spec):
+    """Replaces the installed sinks from a spec such as "memory,jsonl:logs/metrics.jsonl" ("" disables)."""
+    for sink in list(_sinks):
+        remove_sink(sink)
+        if isinstance(sink, JsonlSink):
+            sink.close()
+    for part in filter(None, (part.strip() for part in (spec or "").split(","))):
+        if part == "memory":
+            add_sink(MemorySink())
+        elif part.startswith("jsonl:"):
+            add_sink(JsonlSink(part[len("jsonl:"):]))
+        else:
+            raise ValueError(f"Unknown metrics sink: {part!r}")
+    return list(_sinks)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def memory_sink():
+    return next((sink for sink in _sinks if isinstance(sink, MemorySink)), None)
+
+
+def _emit(event):
+    for sink in _sinks:
+        sink.record(event)
+
+
+def incr(name, value=1, **labels):
+    if _sinks:
+        _emit({"kind": "counter", "name": name, "value": value, "labels": labels})
+
+
+def observe(name, value, **labels):
+    if _sinks:
+        _emit({"kind": "histogram", "name": name, "value": value, "labels": labels})
+
+
+def _record_span(name, seconds, labels, trace):
+    if trace is not None:
+        trace.add(name, seconds)
+    if _sinks:
+        _emit({"kind": "histogram", "name": "stage_seconds", "value": seconds, "labels": dict(labels, stage=name)})
+
+
+class _Span:
+    __slots__ = ("name", "labels", "trace", "start")
+
+    def __init__(self, name, labels, trace):
+        self.name = name
+        self.labels = labels
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record_span(self.name, time.perf_counter() - self.start, self.labels, self.trace)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **labels):
+    """Times a stage: `with span("search"):` -> stage_seconds{stage="search"} and the current trace."""
+    trace_ = _current_trace.get()
+    if trace_ is None and not _sinks:
+        return _NO_SPAN
+    return _Span(name, labels, trace_)
+
+
+def timed_iter(iterable, name, **labels):
+    """Yields from iterable, recording the total time spent producing items as one span."""
+    trace_ = _current_trace.get()
+    if trace_ is None and not _sinks:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    seconds = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            seconds += time.perf_counter() - start
+        yield item
+    _record_span(name, seconds, labels, trace_)
+
+
+class Trace:
+    """Per-request stage durations (seconds; a stage entered twice accumulates)."""
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.total = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def timings(self):
+        """Milliseconds per stage plus "total"."""
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        timings["total"] = round(total * 1000, 3)
+        return timings
+
+
+@contextmanager
+def trace(name="request", enabled=True):
+    """Collects the spans of this context (thread / task) into a Trace; yields None when not enabled."""
+    if not enabled:
+        yield None
+        return
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.total = time.perf_counter() - current.started
+        if _sinks:
+            _emit({"kind": "trace", "name": name, "value": current.total, "labels": {},
+                   "stages": current.timings()})
+
+
+configure(os.environ.get("MINIRAG_METRICS", ""))
@@ -1,39 +1,294 @@
 import os
-from openai import OpenAI
+import time
+import asyncio
+import weakref
+import threading
 from embedder import Embedder
-from vector_store import VectorStore
+from sharded_store import open_store
+import resources
+from context_builder import ContextBuilder, DEFAULT_TOKEN_BUDGET
+from answer_cache import AnswerCache
+from reranker import Reranker
+import metrics
+import llm_clients
+from llm_clients import LLMError
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+NO_CONTEXT_ANSWER = "I don't have enough information to answer that."
+# Back-end -> the one it fails over to
+LLM_BACKENDS = {"Groq": "Ollama", "Ollama": "Groq"}
+
+# Reciprocal rank fusion constant and per-side over-fetch for hybrid retrieval
+RRF_K = 60
+HYBRID_CANDIDATES = 20
+# Chunks retrieved per question by run(), and passed to the LLM after cross-encoder re-ranking
+RETRIEVE_K = 5
+RERANK_TOP_N = 3
+WARM_UP_QUERY = "What is the package price per sqft?"
+
+def _mark_failed(outcome):
+    if outcome is not None:
+        outcome["failed"] = True
+
+def _release_stores(held_paths):
+    for path in held_paths:
+        resources.release_store(path)
+    held_paths.clear()
 
 class RAGPipeline:
-    def __init__(self, index_path="index/assignment", model_name="llama3.2:3b"):
+    def __init__(self, index_path="index/assignment", model_name="llama3.2:3b",
+                 groq_base_url=GROQ_BASE_URL, ollama_host=None, shared=False, retrieval_mode="hybrid",
+                 context_token_budget=DEFAULT_TOKEN_BUDGET, use_answer_cache=True, rerank=True,
+                 rerank_top_n=RERANK_TOP_N, llm_fallback=None, background=False, warm_up=True):
+        """
+        shared=True borrows the process-wide embedder and vector store from `resources`
+        instead of loading private copies (one per Streamlit session / API worker).
+        retrieval_mode "hybrid" fuses BM25 and dense results when the index has a BM25
+        side index, and falls back to "dense" otherwise.
+        context_token_budget caps the retrieved context sent to the LLM (see ContextBuilder).
+        use_answer_cache serves near-duplicate questions from a semantic AnswerCache
+        (process-wide when shared).
+        rerank=True over-fetches candidates and re-scores them with a cross-encoder
+        (see Reranker); run() then passes only the rerank_top_n best chunks to the LLM.
+        llm_fallback ("none", "failover" or "hedge"; default MINIRAG_LLM_FALLBACK) lets
+        Groq and Ollama stand in for each other (see llm_clients).
+        background=True returns at once and loads the models and index on a thread;
+        `ready` / wait_until_ready() report when it is done, and queries block until then.
+        warm_up sends a dummy query through the local stages after loading (see warm_up()).
+        """
         print(f"Loading RAG Pipeline using model: {model_name}...")
-        self.vector_store = VectorStore(index_path=index_path)
-        self.vector_store.load()
-        self.embedder = Embedder()
+        self.shared = shared
+        self.index_path = index_path
         self.model_name = model_name
-        
+        # Overridable so both back-ends can be pointed at a local stand-in server
+        self.groq_base_url = groq_base_url
+        self.ollama_host = ollama_host
+        self.llm_fallback = llm_fallback or llm_clients.FALLBACK
+        if self.llm_fallback not in llm_clients.FALLBACK_MODES:
+            raise ValueError(f"llm_fallback must be one of {llm_clients.FALLBACK_MODES}")
+        self.retrieval_mode = retrieval_mode
+        self.context_builder = ContextBuilder(token_budget=context_token_budget)
+        self.rerank_top_n = rerank_top_n
+
+        self.answer_cache = None
+        if use_answer_cache:
+            self.answer_cache = resources.get_answer_cache() if shared else AnswerCache()
+
+        self._embedder = None
+        self._reranker = None
+        self._vector_store = None
+        self._ready = threading.Event()
+        self._load_error = None
+        if shared:
+            # Released when the pipeline (e.g. its Streamlit session) is garbage collected
+            self._held_paths = []
+            self._finalizer = weakref.finalize(self, _release_stores, self._held_paths)
+        if background:
+            threading.Thread(target=self._load_in_background, args=(rerank, warm_up),
+                             name="rag-pipeline-load", daemon=True).start()
+        else:
+            self._load(rerank, warm_up)
+            self._ready.set()
+
+    def _load(self, rerank, warm_up):
+        started = time.perf_counter()
+        with metrics.span("startup.embedder"):
+            self._embedder = resources.get_embedder() if self.shared else Embedder()
+        with metrics.span("startup.index"):
+            if self.shared:
+                resources.acquire_store(self.index_path)
+                self._held_paths.append(self.index_path)
+            else:
+                self._vector_store = open_store(self.index_path)
+        if rerank:
+            with metrics.span("startup.reranker"):
+                self._reranker = resources.get_reranker() if self.shared else Reranker()
+        if warm_up:
+            with metrics.span("startup.warm_up"):
+                self.warm_up()
+        print(f" RAG Pipeline ready in {time.perf_counter() - started:.1f}s")
+
+    def _load_in_background(self, rerank, warm_up):
+        try:
+            self._load(rerank, warm_up)
+        except Exception as e:
+            print(f" Loading the RAG Pipeline failed: {e}")
+            self._load_error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        """True once loading has finished (immediately, unless background=True)."""
+        return self._ready.is_set()
+
+    @property
+    def load_error(self):
+        """The exception background loading failed with, else None."""
+        return self._load_error
+
+    def wait_until_ready(self, timeout=None):
+        """Blocks until loading has finished; False on timeout. Raises if background loading failed."""
+        if not self._ready.wait(timeout):
+            return False
+        if self._load_error is not None:
+            raise RuntimeError(f"RAG Pipeline failed to load: {self._load_error}") from self._load_error
+        return True
+
+    @property
+    def embedder(self):
+        self.wait_until_ready()
+        return self._embedder
+
+    @property
+    def reranker(self):
+        self.wait_until_ready()
+        return self._reranker
+
+    @property
+    def vector_store(self):
+        self.wait_until_ready()
+        return self._current_store()
+
+    def _current_store(self):
+        if self.shared:
+            # Always the latest generation, so a hot-swapped index is picked up immediately
+            return resources.current_store(self.index_path)
+        return self._vector_store
+
+    def warm_up(self, query=WARM_UP_QUERY):
+        """
+        Sends a dummy query through encoding, search, re-ranking and token counting,
+        and imports the LLM client, so the first real question does not pay for
+        lazy imports, first-call model setup or cold index pages. Nothing is cached.
+        """
+        started = time.perf_counter()
+        try:
+            query_embedding = self._embedder.warm_up(query)
+            vector_store = self._current_store()
+            hits = self._first_stage(vector_store, [query], query_embedding, 5, None)[0]
+            if self._reranker is not None:
+                self._reranker.warm_up(query, [hit["text"] for hit in hits])
+            self.context_builder.build(hits)
+            llm_clients.preload()
+        except Exception as e:
+            # A cold first query is better than no pipeline
+            print(f" Warm-up failed: {e}")
+            return
+        print(f" Warm-up done in {time.perf_counter() - started:.2f}s")
+
     def load_index(self, index_path):
         print(f"🔄 Loading Index from: {index_path}")
-        self.vector_store = VectorStore(index_path=index_path)
-        self.vector_store.load()
+        self.wait_until_ready()
+        if self.shared:
+            resources.acquire_store(index_path)
+            _release_stores(self._held_paths)
+            self._held_paths.append(index_path)
+            self.index_path = index_path
+            return
+
+        # Load fully before swapping, so concurrent queries never see a half-loaded store
+        self._vector_store = open_store(index_path)
+        self.index_path = index_path
 
-    def retrieve(self, query, k=5):
+    def close(self):
+        self._ready.wait()
+        if self.shared:
+            self._finalizer()
+
+    def retrieve(self, query, k=5, mode=None, filters=None):
         """
-        Retrieves top-k chunks. 
-        k=5 is maintained to ensure high recall for "Package Pricing" vs "Allowances".
+        Retrieves top-k chunks. With a reranker, the k best of a larger candidate
+        set by cross-encoder score, which separates e.g. "Package Pricing" from
+        "Allowances" better than bi-encoder scores alone.
+        filters (e.g. {"source": "doc2.md"} or {"section": "Pricing"}) limits the search
+        to matching chunks.
         """
         print(f"🔍 Query: {query}")
-        query_embedding = self.embedder.embed(query)
-        results = self.vector_store.search(query_embedding, k=k)
+        with metrics.span("embed"):
+            query_embedding = self.embedder.embed(query)
+        return self._search(self.vector_store, [query], query_embedding, k, mode, filters)[0]
+
+    def retrieve_many(self, queries, k=5, mode=None, filters=None, rerank_top_n=None):
+        """
+        Batched retrieve(): one encode call and one FAISS search for all queries.
+        Returns one list of chunks per query, in input order; with a reranker,
+        rerank_top_n caps the chunks kept per query as in run().
+        """
+        if not queries:
+            return []
+        print(f"🔍 Batch of {len(queries)} queries")
+        with metrics.span("embed"):
+            query_embeddings = self.embedder.embed(list(queries))
+        return self._search(self.vector_store, list(queries), query_embeddings, k, mode, filters, rerank_top_n)
+
+    def _search(self, vector_store, queries, query_embeddings, k, mode, filters=None, rerank_top_n=None):
+        """
+        With a reranker, over-fetches its candidate count and keeps the rerank_top_n
+        (default k) best per query, or the first-stage top k if re-ranking is skipped.
+        """
+        if self.reranker is None:
+            with metrics.span("search"):
+                return self._first_stage(vector_store, queries, query_embeddings, k, mode, filters)
+        candidates = max(k, self.reranker.candidates)
+        with metrics.span("search"):
+            results = self._first_stage(vector_store, queries, query_embeddings, candidates, mode, filters)
+        top_n = min(k, rerank_top_n or k)
+        with metrics.span("rerank"):
+            return [self.reranker.rerank(query, hits, top_n, fallback_n=k) for query, hits in zip(queries, results)]
+
+    def _first_stage(self, vector_store, queries, query_embeddings, k, mode, filters=None):
+        mode = mode or self.retrieval_mode
+        if mode != "hybrid" or not vector_store.has_sparse_index:
+            return vector_store.search_batch(query_embeddings, k=k, filters=filters)
+
+        candidates = max(k, HYBRID_CANDIDATES)
+        dense_results = vector_store.search_batch(query_embeddings, k=candidates, filters=filters)
+        return [
+            self._fuse(vector_store, dense_hits,
+                       vector_store.sparse_search(query, k=candidates, filters=filters), k)
+            for query, dense_hits in zip(queries, dense_results)
+        ]
+
+    def _fuse(self, vector_store, dense_hits, sparse_hits, k):
+        """
+        Reciprocal rank fusion of dense and BM25 rankings. "score" is the fused score
+        scaled to (0, 1] (1 = ranked first by both); the per-side scores are kept too.
+        """
+        fused = {}
+        for rank, hit in enumerate(dense_hits):
+            fused[hit["id"]] = 1 / (RRF_K + rank + 1)
+        for rank, (chunk_id, _) in enumerate(sparse_hits):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1 / (RRF_K + rank + 1)
+
+        top = sorted(fused, key=fused.get, reverse=True)[:k]
+        dense_by_id = {hit["id"]: hit for hit in dense_hits}
+        bm25_scores = dict(sparse_hits)
+        lexical_only = {hit["id"]: hit for hit in vector_store.fetch([i for i in top if i not in dense_by_id])}
+
+        best_possible = 2 / (RRF_K + 1)
+        results = []
+        for chunk_id in top:
+            hit = dict(dense_by_id.get(chunk_id) or lexical_only[chunk_id])
+            hit["dense_score"] = dense_by_id[chunk_id]["score"] if chunk_id in dense_by_id else None
+            hit["bm25_score"] = bm25_scores.get(chunk_id)
+            hit["score"] = fused[chunk_id] / best_possible
+            results.append(hit)
         return results
 
-    def generate_answer(self, query, context_chunks, chat_history=None, model_type="Groq", api_key=None):
+    def build_prompt(self, context_chunks, chat_history=None):
+        """
+        Returns (system_prompt, context_stats). The context is deduplicated, merged per
+        section and fitted to the token budget; context_stats reports the tokens saved.
+        """
         if chat_history is None:
             chat_history = []
 
-        if not context_chunks:
-            return "I don't have enough information to answer that."
-
-        context_text = "\n\n".join([f"[Source: {c['source']}]\n{c['text']}" for c in context_chunks])
+        with metrics.span("prompt"):
+            context_text, context_stats = self.context_builder.build(context_chunks)
+        metrics.incr("context_tokens_sent", context_stats["context_tokens"])
+        metrics.observe("context_tokens", context_stats["context_tokens"])
         history_text = "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in chat_history[-2:]])
 
         system_prompt = f"""You are a RAG assistant for Indecimal. Follow these rules STRICTLY:
@@ -49,59 +304,353 @@ class RAGPipeline:
         Chat History:
         {history_text}
         """
-        
-        if model_type == "Ollama":
-            return self._call_ollama(system_prompt, query)
-        elif model_type == "Groq":
-            return self._call_groq(system_prompt, query, api_key)
-        else:
-            return "Error: Invalid Model Type Selected"
+        return system_prompt, context_stats
 
-    def _call_ollama(self, system_prompt, query):
-        try:
-            import ollama
-        except ImportError:
-            return "Ollama not installed. Run: pip install ollama"
+    def generate_answer(self, query, context_chunks, chat_history=None, model_type="Groq", api_key=None):
+        if not context_chunks:
+            return NO_CONTEXT_ANSWER
+
+        system_prompt, _ = self.build_prompt(context_chunks, chat_history)
+        return self._complete(system_prompt, query, model_type, api_key)[0]
+
+    def _complete(self, system_prompt, query, model_type, api_key):
+        """(answer, failed); a failed answer is the error text and must never be cached."""
+        with metrics.span("llm", backend=model_type):
+            answer, failed = self._call_llm(system_prompt, query, model_type, api_key)
+        metrics.incr("llm_requests", backend=model_type)
+        if failed:
+            metrics.incr("llm_errors", backend=model_type)
+        return answer, failed
+
+    def generate_answer_stream(self, query, context_chunks, chat_history=None, model_type="Groq", api_key=None):
+        """
+        Streaming generate_answer(): yields answer text deltas as the back-end produces them.
+        Errors are yielded as text, matching the blocking calls.
+        """
+        if not context_chunks:
+            yield NO_CONTEXT_ANSWER
+            return
+
+        system_prompt, _ = self.build_prompt(context_chunks, chat_history)
+        yield from self._complete_stream(system_prompt, query, model_type, api_key)
+
+    def _complete_stream(self, system_prompt, query, model_type, api_key, outcome=None):
+        """
+        Yields answer deltas, then the error text if the back-end fails (possibly after
+        some tokens). A failure also sets outcome["failed"], when an outcome dict is given.
+        """
+        error = self._check_backend(model_type, api_key)
+        if error:
+            _mark_failed(outcome)
+            yield error
+            return
         try:
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': query}
-                ]
-            )
-            return response['message']['content']
-        except Exception as e:
-            return f"Ollama Error: {str(e)}. Make sure Ollama is running locally."
+            yield from llm_clients.stream(self._messages(system_prompt, query), *self._llm_routes(model_type, api_key),
+                                          mode=self.llm_fallback)
+        except LLMError as e:
+            _mark_failed(outcome)
+            yield self._failure_text(model_type, e)
 
-    def _call_groq(self, system_prompt, query, api_key):
-        if not api_key:
+    def _messages(self, system_prompt, query):
+        return [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': query}
+        ]
+
+    def _check_backend(self, model_type, api_key):
+        """Error text when model_type can't be called at all, else None."""
+        if model_type not in LLM_BACKENDS:
+            return "Error: Invalid Model Type Selected"
+        if model_type == "Groq" and not api_key:
             return "Error: Groq API Key is missing. Please enter it in the sidebar."
+        return None
+
+    def _llm_route(self, model_type, api_key):
+        """(backend, model, api_key) for llm_clients, or None when model_type isn't usable."""
+        if model_type == "Groq" and api_key:
+            return llm_clients.get_backend("Groq", self.groq_base_url), GROQ_MODEL, api_key
+        if model_type == "Ollama":
+            # Ollama ignores the key, but the OpenAI client requires one
+            return llm_clients.get_backend("Ollama", llm_clients.ollama_base_url(self.ollama_host)), \
+                self.model_name, "ollama"
+        return None
 
-        client = OpenAI(
-            base_url="https://api.groq.com/openai/v1",
-            api_key=api_key,
-        )
+    def _llm_routes(self, model_type, api_key):
+        """(primary, fallback) routes; the fallback is the other back-end, when it can be called."""
+        fallback = None
+        if self.llm_fallback != "none":
+            fallback = self._llm_route(LLM_BACKENDS[model_type], api_key)
+        return self._llm_route(model_type, api_key), fallback
+
+    def _failure_text(self, model_type, error):
+        if model_type == "Ollama":
+            return f"Ollama Error: {error}. Make sure Ollama is running locally."
+        return f"Groq Error: {error}"
+
+    def _call_llm(self, system_prompt, query, model_type, api_key):
+        """(answer, failed)."""
+        error = self._check_backend(model_type, api_key)
+        if error:
+            return error, True
         try:
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query}
-                ]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Groq Error: {str(e)}"
+            return llm_clients.complete(self._messages(system_prompt, query), *self._llm_routes(model_type, api_key),
+                                        mode=self.llm_fallback), False
+        except LLMError as e:
+            return self._failure_text(model_type, e), True
+
+    async def agenerate_answer_stream(self, query, context_chunks, chat_history=None, model_type="Groq", api_key=None):
+        """
+        Async generate_answer_stream() for the API server: awaits the back-end instead of
+        blocking a thread for the whole completion.
+        """
+        if not context_chunks:
+            yield NO_CONTEXT_ANSWER
+            return
+
+        system_prompt, _ = self.build_prompt(context_chunks, chat_history)
+        async for token in self._acomplete_stream(system_prompt, query, model_type, api_key):
+            yield token
+
+    async def _acomplete_stream(self, system_prompt, query, model_type, api_key, outcome=None):
+        """Async _complete_stream()."""
+        error = self._check_backend(model_type, api_key)
+        if error:
+            _mark_failed(outcome)
+            yield error
+            return
+        try:
+            async for token in llm_clients.astream(self._messages(system_prompt, query),
+                                                   *self._llm_routes(model_type, api_key), mode=self.llm_fallback):
+                yield token
+        except LLMError as e:
+            _mark_failed(outcome)
+            yield self._failure_text(model_type, e)
+
+    async def agenerate_answer(self, query, context_chunks, chat_history=None, model_type="Groq", api_key=None):
+        """Async generate_answer(); a blocking completion, so it can be hedged (see llm_clients)."""
+        if not context_chunks:
+            return NO_CONTEXT_ANSWER
+
+        system_prompt, _ = self.build_prompt(context_chunks, chat_history)
+        return (await self._acomplete(system_prompt, query, model_type, api_key))[0]
+
+    async def _acomplete(self, system_prompt, query, model_type, api_key):
+        """Async _complete(): (answer, failed)."""
+        error = self._check_backend(model_type, api_key)
+        if error:
+            return error, True
+        failed = False
+        with metrics.span("llm", backend=model_type):
+            try:
+                answer = await llm_clients.acomplete(self._messages(system_prompt, query),
+                                                     *self._llm_routes(model_type, api_key), mode=self.llm_fallback)
+            except LLMError as e:
+                answer, failed = self._failure_text(model_type, e), True
+        metrics.incr("llm_requests", backend=model_type)
+        if failed:
+            metrics.incr("llm_errors", backend=model_type)
+        return answer, failed
+
+    def _answer_cache_key(self, vector_store, model_type, filters=None, k=RETRIEVE_K):
+        model = GROQ_MODEL if model_type == "Groq" else self.model_name
+        filter_key = tuple(sorted((field, str(value)) for field, value in (filters or {}).items()))
+        return (vector_store.index_path, vector_store.version, model_type, model, filter_key,
+                self.reranker is not None, k)
+
+    def _use_answer_cache(self, chat_history):
+        # Follow-up questions depend on the conversation, not just the question text
+        return self.answer_cache is not None and not any(m.get("role") == "assistant" for m in chat_history)
+
+    def _lookup_answer(self, query, chat_history, model_type, filters=None, k=RETRIEVE_K):
+        """Embeds the query once and checks the answer cache. Returns (vector_store, embedding, hit)."""
+        print(f"🔍 Query: {query}")
+        vector_store = self.vector_store
+        with metrics.span("embed"):
+            query_embedding = self.embedder.embed(query)
+        cached = None
+        if self._use_answer_cache(chat_history):
+            with metrics.span("answer_cache"):
+                cached = self.answer_cache.lookup(self._answer_cache_key(vector_store, model_type, filters, k),
+                                                  query_embedding)
+            metrics.incr("answer_cache_hits" if cached else "answer_cache_misses")
+            if cached:
+                print(f"⚡ Answer cache hit (similarity {cached['similarity']:.3f})")
+        return vector_store, query_embedding, cached
+
+    def _store_answer(self, vector_store, query_embedding, chat_history, model_type, answer, sources,
+                      context_stats, filters=None, failed=False, k=RETRIEVE_K):
+        # Failed or cut-off answers (error text, possibly after partial output) are never cached
+        if not sources or failed or not self._use_answer_cache(chat_history):
+            return
+        self.answer_cache.store(self._answer_cache_key(vector_store, model_type, filters, k), query_embedding, {
+            "answer": answer,
+            "sources": sources,
+            "context_stats": context_stats
+        })
+
+    @staticmethod
+    def _cached_response(cached):
+        return {
+            "answer": cached["answer"],
+            "sources": cached["sources"],
+            "context_stats": cached["context_stats"],
+            "cached": True
+        }
+
+    def run(self, query, chat_history=None, model_type="Groq", api_key=None, filters=None, timings=False):
+        """
+        Answers query from the index. timings=True adds "timings" to the response:
+        milliseconds per stage (embed, answer_cache, search, rerank, prompt, llm) and total.
+        """
+        with metrics.trace("query", enabled=timings or metrics.enabled()) as trace:
+            response = self._run(query, chat_history, model_type, api_key, filters)
+        metrics.incr("queries", cached=str(response["cached"]).lower())
+        if timings:
+            response["timings"] = trace.timings()
+        return response
 
-    def run(self, query, chat_history=None, model_type="Groq", api_key=None):
+    def _run(self, query, chat_history, model_type, api_key, filters):
         if chat_history is None:
             chat_history = []
-            
-        retrieved_chunks = self.retrieve(query)
-        answer = self.generate_answer(query, retrieved_chunks, chat_history, model_type, api_key)
+
+        vector_store, query_embedding, cached = self._lookup_answer(query, chat_history, model_type, filters)
+        if cached:
+            return self._cached_response(cached)
+
+        retrieved_chunks = self._search(vector_store, [query], query_embedding, RETRIEVE_K, None, filters,
+                                        rerank_top_n=self.rerank_top_n)[0]
+        context_stats = None
+        failed = False
+        if retrieved_chunks:
+            system_prompt, context_stats = self.build_prompt(retrieved_chunks, chat_history)
+            answer, failed = self._complete(system_prompt, query, model_type, api_key)
+        else:
+            answer = NO_CONTEXT_ANSWER
+        self._store_answer(vector_store, query_embedding, chat_history, model_type,
+                           answer, retrieved_chunks, context_stats, filters, failed)
         
         return {
             "answer": answer,
-            "sources": retrieved_chunks
-        }
\ No newline at end of file
+            "sources": retrieved_chunks,
+            "context_stats": context_stats,
+            "cached": False
+        }
+
+    def run_stream(self, query, chat_history=None, model_type="Groq", api_key=None, filters=None):
+        """
+        Streaming run(). Yields events in order:
+            {"type": "sources", "sources": [...]}   as soon as retrieval finishes
+            {"type": "token", "content": "..."}     for every answer delta
+            {"type": "done", "answer": "...", "sources": [...], "context_stats": {...}, "cached": bool}
+        A cached answer arrives as a single token event.
+        """
+        if chat_history is None:
+            chat_history = []
+
+        vector_store, query_embedding, cached = self._lookup_answer(query, chat_history, model_type, filters)
+        if cached:
+            yield {"type": "sources", "sources": cached["sources"]}
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "done", "answer": cached["answer"], "sources": cached["sources"],
+                   "context_stats": cached["context_stats"], "cached": True}
+            return
+
+        retrieved_chunks = self._search(vector_store, [query], query_embedding, RETRIEVE_K, None, filters,
+                                        rerank_top_n=self.rerank_top_n)[0]
+        yield {"type": "sources", "sources": retrieved_chunks}
+
+        context_stats = None
+        outcome = {"failed": False}
+        if retrieved_chunks:
+            system_prompt, context_stats = self.build_prompt(retrieved_chunks, chat_history)
+            tokens = self._complete_stream(system_prompt, query, model_type, api_key, outcome)
+        else:
+            tokens = iter([NO_CONTEXT_ANSWER])
+
+        parts = []
+        for token in tokens:
+            parts.append(token)
+            yield {"type": "token", "content": token}
+
+        answer = "".join(parts)
+        self._store_answer(vector_store, query_embedding, chat_history, model_type,
+                           answer, retrieved_chunks, context_stats, filters, outcome["failed"])
+        yield {"type": "done", "answer": answer, "sources": retrieved_chunks,
+               "context_stats": context_stats, "cached": False}
+
+    async def _aprepare(self, query, chat_history, model_type, filters, k, retrieve, executor):
+        """
+        The blocking part of arun(): cache lookup, then retrieval unless the cache
+        answered. Returns (vector_store, query_embedding, cached, chunks).
+        """
+        loop = asyncio.get_running_loop()
+        vector_store, query_embedding, cached = await loop.run_in_executor(
+            executor, self._lookup_answer, query, chat_history, model_type, filters, k)
+        if cached:
+            return vector_store, query_embedding, cached, None
+        if retrieve is not None:
+            chunks = await retrieve(query, k, filters)
+        else:
+            chunks = await loop.run_in_executor(executor, lambda: self._search(
+                vector_store, [query], query_embedding, k, None, filters, rerank_top_n=self.rerank_top_n)[0])
+        return vector_store, query_embedding, None, chunks
+
+    async def arun(self, query, chat_history=None, model_type="Groq", api_key=None, filters=None, k=RETRIEVE_K,
+                   retrieve=None, executor=None):
+        """
+        Async run() for the API server, with the same answer cache and re-ranking cut-off.
+        Embedding and search run in executor (default: asyncio's) and the LLM call is
+        awaited, so it can be hedged. retrieve, if given, replaces the search: an async
+        retrieve(query, k, filters) returning the chunks for the LLM, e.g. a micro-batcher
+        over retrieve_many(..., rerank_top_n=self.rerank_top_n).
+        """
+        chat_history = chat_history or []
+        vector_store, query_embedding, cached, chunks = await self._aprepare(
+            query, chat_history, model_type, filters, k, retrieve, executor)
+        if cached:
+            response = self._cached_response(cached)
+        else:
+            context_stats = None
+            failed = False
+            if chunks:
+                system_prompt, context_stats = self.build_prompt(chunks, chat_history)
+                answer, failed = await self._acomplete(system_prompt, query, model_type, api_key)
+            else:
+                answer = NO_CONTEXT_ANSWER
+            self._store_answer(vector_store, query_embedding, chat_history, model_type,
+                               answer, chunks, context_stats, filters, failed, k)
+            response = {"answer": answer, "sources": chunks, "context_stats": context_stats, "cached": False}
+        metrics.incr("queries", cached=str(response["cached"]).lower())
+        return response
+
+    async def arun_stream(self, query, chat_history=None, model_type="Groq", api_key=None, filters=None, k=RETRIEVE_K,
+                          retrieve=None, executor=None):
+        """Async run_stream(): the same events, with retrieval as in arun()."""
+        chat_history = chat_history or []
+        vector_store, query_embedding, cached, chunks = await self._aprepare(
+            query, chat_history, model_type, filters, k, retrieve, executor)
+        if cached:
+            yield {"type": "sources", "sources": cached["sources"]}
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "done", "answer": cached["answer"], "sources": cached["sources"],
+                   "context_stats": cached["context_stats"], "cached": True}
+            return
+        yield {"type": "sources", "sources": chunks}
+
+        context_stats = None
+        outcome = {"failed": False}
+        parts = []
+        if chunks:
+            system_prompt, context_stats = self.build_prompt(chunks, chat_history)
+            async for token in self._acomplete_stream(system_prompt, query, model_type, api_key, outcome):
+                parts.append(token)
+                yield {"type": "token", "content": token}
+        else:
+            parts.append(NO_CONTEXT_ANSWER)
+            yield {"type": "token", "content": NO_CONTEXT_ANSWER}
+
+        answer = "".join(parts)
+        self._store_answer(vector_store, query_embedding, chat_history, model_type,
+                           answer, chunks, context_stats, filters, outcome["failed"], k)
+        yield {"type": "done", "answer": answer, "sources": chunks,
+               "context_stats": context_stats, "cached": False}
@@ -0,0 +1,127 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from lazy_imports import lazy_module
+import metrics
+
+torch = lazy_module("torch")
+sentence_transformers = lazy_module("sentence_transformers")
+
+RERANK_MODEL = os.environ.get("MINIRAG_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.environ.get("MINIRAG_RERANK_CANDIDATES", "50"))
+# Per-request budget for scoring (seconds); past it, the first-stage ranking is used
+RERANK_BUDGET = float(os.environ.get("MINIRAG_RERANK_BUDGET", "0.5"))
+
+
+class Reranker:
+    """
+    Second-stage re-ranking of retrieved chunks with a small local cross-encoder.
+
+    The pipeline over-fetches `candidates` chunks per query; rerank() scores each
+    (query, chunk text) pair in batches and keeps the best few. Scores are cached
+    per (query, chunk text) in an LRU, so repeated questions cost nothing. Each
+    call has a latency budget: when the estimated time for the uncached pairs
+    (from a running average of the per-pair cost, which grows under load) would
+    exceed it, or it runs out between batches, the first-stage order is returned
+    instead.
+    """
+    def __init__(self, model_name=RERANK_MODEL, candidates=RERANK_CANDIDATES, batch_size=16,
+                 budget_seconds=RERANK_BUDGET, cache_entries=20_000):
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        print(f"Loading re-ranking model: {model_name} on {device}...")
+        self.model_name = model_name
+        self.model = sentence_transformers.CrossEncoder(model_name, device=device)
+        self.candidates = candidates
+        self.batch_size = batch_size
+        self.budget_seconds = budget_seconds
+        self.cache_entries = cache_entries
+
+        self.reranked = 0
+        self.skipped = 0
+        self._pair_seconds = None   # moving average of scoring time per pair
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()  # digest -> score, least recently used first
+
+    @staticmethod
+    def _digest(query, text):
+        return hashlib.sha1(f"{query}\x00{text}".encode("utf-8")).digest()
+
+    def _cached(self, keys):
+        with self._lock:
+            scores = {}
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+            return scores
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_entries:
+                self._scores.popitem(last=False)
+
+    def _record(self, pairs, seconds):
+        per_pair = seconds / pairs
+        with self._lock:
+            self._pair_seconds = per_pair if self._pair_seconds is None else (self._pair_seconds + per_pair) / 2
+
+    def _fallback(self, hits, fallback_n):
+        with self._lock:
+            self.skipped += 1
+        metrics.incr("rerank_skipped")
+        return hits[:fallback_n]
+
+    def warm_up(self, query, texts):
+        """
+        Scores one batch of pairs without caching them or feeding the latency
+        estimate, which would otherwise start from the slow first call.
+        """
+        pairs = [(query, text) for text in texts[:self.batch_size]] or [(query, query)]
+        self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+
+    def rerank(self, query, hits, top_n, fallback_n=None):
+        """
+        Returns the top_n hits by cross-encoder score (as "rerank_score"; the
+        first-stage "score" is kept). Falls back to hits[:fallback_n] (default
+        top_n) when the latency budget does not allow scoring them.
+        """
+        fallback_n = top_n if fallback_n is None else fallback_n
+        if len(hits) <= 1:
+            return hits[:top_n]
+        started = time.perf_counter()
+        keys = [self._digest(query, hit["text"]) for hit in hits]
+        scores = self._cached(keys)
+        missing = list(dict.fromkeys(key for key in keys if key not in scores))
+        texts = {key: hit["text"] for key, hit in zip(keys, hits)}
+
+        if missing and self._pair_seconds is not None and \
+                self._pair_seconds * len(missing) > self.budget_seconds:
+            print(f" Re-ranking skipped: ~{self._pair_seconds * len(missing):.2f}s over budget")
+            with self._lock:
+                # Decay the estimate, so scoring is retried once the load has passed
+                self._pair_seconds /= 2
+            return self._fallback(hits, fallback_n)
+
+        for start in range(0, len(missing), self.batch_size):
+            if time.perf_counter() - started > self.budget_seconds:
+                print(" Re-ranking stopped: latency budget used up")
+                return self._fallback(hits, fallback_n)
+            batch = missing[start:start + self.batch_size]
+            batch_started = time.perf_counter()
+            batch_scores = self.model.predict([(query, texts[key]) for key in batch],
+                                              batch_size=self.batch_size, show_progress_bar=False)
+            self._record(len(batch), time.perf_counter() - batch_started)
+            metrics.incr("rerank_pairs_scored", len(batch))
+            batch_scores = [float(score) for score in batch_scores]
+            self._store(batch, batch_scores)
+            scores.update(zip(batch, batch_scores))
+
+        with self._lock:
+            self.reranked += 1
+        order = sorted(range(len(hits)), key=lambda i: scores[keys[i]], reverse=True)[:top_n]
+        return [dict(hits[i], rerank_score=scores[keys[i]]) for i in order]
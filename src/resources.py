@@ -0,0 +1,132 @@
+"""
+Process-wide shared resources: one Embedder and Reranker per model and one vector store
+per index path.
+
+Streamlit sessions and API handlers hold cheap RAGPipeline(shared=True) objects
+that borrow these instead of loading their own copy, so memory stays flat as
+users are added. Stores are reference counted per index path and dropped when
+the last user releases them; reload_store() hot-swaps a rebuilt index for every
+holder at once while in-flight searches finish on the old one. Each loaded store
+is pinned to one immutable snapshot, so no lock is held while an index is
+rebuilt or loaded.
+"""
+import threading
+from embedder import Embedder
+from vector_store import current_version
+from sharded_store import open_store
+from answer_cache import AnswerCache
+from reranker import Reranker
+
+_lock = threading.RLock()
+_embedders = {}
+_rerankers = {}
+_stores = {}
+_answer_cache = None
+
+
+class _StoreEntry:
+    def __init__(self, store):
+        self.store = store
+        self.refcount = 0
+        self.generation = 0
+
+
+def _load_store(index_path):
+    return open_store(index_path)
+
+
+def get_embedder(model_name='all-MiniLM-L6-v2'):
+    with _lock:
+        embedder = _embedders.get(model_name)
+        if embedder is None:
+            embedder = Embedder(model_name)
+            _embedders[model_name] = embedder
+        return embedder
+
+
+def get_reranker(model_name=None):
+    """One cross-encoder (and score cache) per model for the process."""
+    with _lock:
+        reranker = _rerankers.get(model_name)
+        if reranker is None:
+            reranker = Reranker(model_name) if model_name else Reranker()
+            _rerankers[model_name] = reranker
+        return reranker
+
+
+def get_answer_cache():
+    """One semantic answer cache for the process, so every session benefits from it."""
+    global _answer_cache
+    with _lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
+
+
+def acquire_store(index_path):
+    """Registers one more user of index_path, loading the store on first use."""
+    with _lock:
+        entry = _stores.get(index_path)
+        if entry is None:
+            entry = _StoreEntry(_load_store(index_path))
+            _stores[index_path] = entry
+        entry.refcount += 1
+        return entry.store
+
+
+def release_store(index_path):
+    with _lock:
+        entry = _stores.get(index_path)
+        if entry is None:
+            return
+        entry.refcount -= 1
+        if entry.refcount <= 0:
+            del _stores[index_path]
+
+
+def current_store(index_path):
+    """The latest store for index_path (loads it unreferenced if nobody acquired it)."""
+    entry = _stores.get(index_path)
+    if entry is None:
+        with _lock:
+            entry = _stores.get(index_path)
+            if entry is None:
+                entry = _StoreEntry(_load_store(index_path))
+                _stores[index_path] = entry
+    return entry.store
+
+
+def store_generation(index_path):
+    entry = _stores.get(index_path)
+    return entry.generation if entry else 0
+
+
+def reload_store(index_path):
+    """
+    Hot-swaps index_path after a rebuild. The new store is loaded outside the
+    lock so queries keep being served from the old one until the swap.
+    """
+    entry = _stores.get(index_path)
+    if entry is None:
+        # Nobody holds it: the next acquire_store() loads the new version anyway
+        return None
+    if entry.store.version is not None and entry.store.version == current_version(index_path):
+        return entry.store
+    store = _load_store(index_path)
+    with _lock:
+        entry = _stores.get(index_path)
+        if entry is None:
+            return None
+        entry.store = store
+        entry.generation += 1
+    return store
+
+
+def stats():
+    with _lock:
+        return {
+            "embedders": list(_embedders),
+            "stores": {path: {"refcount": e.refcount, "generation": e.generation,
+                              "chunks": e.store.live_count}
+                       for path, e in _stores.items()}
+        }
@@ -0,0 +1,360 @@
+"""
+Sharded vector store: chunks are partitioned across num_shards VectorStores by a
+hash of their source document, stored as shard-000/, shard-001/, ... inside one
+snapshot (so versioning, pinning and hot reloads work exactly as for a single
+store).
+
+Searches fan out to the shards on a shared thread pool - FAISS releases the GIL,
+so shards are scanned in parallel - and the per-shard top-k lists are merged
+with a heap. Shards are loaded on first use with their FAISS codes memory-mapped,
+and a filter on "source" only touches the shards holding those sources.
+"""
+import os
+import json
+import heapq
+import shutil
+import hashlib
+import weakref
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from vector_store import (VectorStore, DEFAULT_RERANK_FACTOR, is_lossy_spec, COMPACTION_THRESHOLD, CONFIG_FILE,
+                          publish_snapshot, read_config, version_dir, pin_version, unpin_version)
+from metadata_store import CHUNK_STORAGE
+from lazy_imports import lazy_module
+
+faiss = lazy_module("faiss")
+
+SHARD_DIR = "shard-{:03d}"
+SEARCH_THREADS = max(1, min(8, os.cpu_count() or 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _search_pool():
+    """One thread pool for every sharded store in the process (stores are hot-swapped)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="minirag-shard")
+        return _executor
+
+
+def shard_of(source, num_shards):
+    """Shard holding a source's chunks; stable across processes, unlike hash()."""
+    if num_shards <= 1:
+        return 0
+    digest = hashlib.blake2b(source.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def create_store(index_path, index_spec="Flat", num_shards=1, chunk_storage=CHUNK_STORAGE):
+    """An empty store: a plain VectorStore, or a ShardedVectorStore for num_shards > 1."""
+    if num_shards > 1:
+        return ShardedVectorStore(index_path=index_path, index_spec=index_spec, num_shards=num_shards,
+                                  chunk_storage=chunk_storage)
+    return VectorStore(index_path=index_path, index_spec=index_spec, chunk_storage=chunk_storage)
+
+
+def open_store(index_path, version=None, mmap_index=None):
+    """
+    Loads the current (or a pinned) snapshot of index_path with the right store
+    type. mmap_index defaults to True for sharded stores; pass False to modify it.
+    """
+    config = read_config(version_dir(index_path, version))
+    if config.get("num_shards"):
+        store = ShardedVectorStore(index_path=index_path, num_shards=config["num_shards"])
+        store.load(version, mmap_index=True if mmap_index is None else mmap_index)
+    else:
+        store = VectorStore(index_path=index_path)
+        store.load(version, mmap_index=bool(mmap_index))
+    return store
+
+
+def _link_tree(source_dir, target_dir):
+    """Reuses an unchanged shard's files in a new snapshot (hard links; copies across filesystems)."""
+    os.makedirs(target_dir, exist_ok=True)
+    for name in os.listdir(source_dir):
+        source, target = os.path.join(source_dir, name), os.path.join(target_dir, name)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+
+class ShardedMetadata:
+    """Read-only view over the shards' metadata, for filter pickers and stats."""
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return sum(len(shard.metadata) for shard in self._store.shards)
+
+    def __iter__(self):
+        for shard in self._store.shards:
+            yield from shard.metadata
+
+    def values(self, field):
+        seen = {}
+        for shard in self._store.shards:
+            seen.update(dict.fromkeys(shard.metadata.values(field)))
+        return list(seen)
+
+
+class ShardedVectorStore:
+    """
+    Same interface as VectorStore (add / remove / upsert / search_batch /
+    sparse_search / fetch / save / load) over num_shards partitions.
+    Stable chunk ids are assigned globally, so they stay unique across shards.
+    BM25 statistics are per shard, which slightly perturbs lexical scores.
+    """
+    def __init__(self, dimension=384, index_path="index/assignment", index_spec="Flat", num_shards=4,
+                 nprobe=16, ef_search=64, rerank_factor=DEFAULT_RERANK_FACTOR, chunk_storage=CHUNK_STORAGE):
+        if num_shards < 2:
+            raise ValueError("A sharded store needs at least 2 shards; use VectorStore otherwise.")
+        self.dimension = dimension
+        self.index_path = index_path
+        self.index_spec = index_spec
+        self.num_shards = num_shards
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rerank_factor = rerank_factor
+        self.chunk_storage = chunk_storage
+        self.next_id = 0
+        self.version = None
+        self.snapshot_dir = None
+        self.mmap_index = False
+        self.metadata = ShardedMetadata(self)
+        self._shards = [None] * num_shards
+        self._shard_locks = [threading.Lock() for _ in range(num_shards)]
+        self._unpin = None
+
+    def _pin_snapshot(self):
+        """
+        Pins snapshot_dir while some shards are not loaded yet: they are opened from
+        it on first use, so it must outlive newer snapshots being published meanwhile.
+        """
+        if self._unpin is not None:
+            self._unpin()
+            self._unpin = None
+        if self.snapshot_dir is not None and self.loaded_shards < self.num_shards:
+            # Also unpinned when the store is garbage collected
+            self._unpin = weakref.finalize(self, unpin_version, pin_version(self.snapshot_dir))
+
+    def _new_shard(self):
+        return VectorStore(dimension=self.dimension, index_path=self.index_path, index_spec=self.index_spec,
+                           nprobe=self.nprobe, ef_search=self.ef_search, rerank_factor=self.rerank_factor,
+                           chunk_storage=self.chunk_storage)
+
+    def _shard_dir(self, directory, i):
+        return os.path.join(directory, SHARD_DIR.format(i))
+
+    def shard(self, i):
+        """Shard i, loaded from the snapshot on first use."""
+        store = self._shards[i]
+        if store is None:
+            with self._shard_locks[i]:
+                store = self._shards[i]
+                if store is None:
+                    store = self._new_shard()
+                    if self.snapshot_dir is not None:
+                        store.load_directory(self._shard_dir(self.snapshot_dir, i), self.mmap_index)
+                        store.version = self.version
+                    self._shards[i] = store
+                    if self._unpin is not None and self.loaded_shards == self.num_shards:
+                        # Every shard holds its files open/mapped now
+                        self._unpin()
+        return store
+
+    @property
+    def shards(self):
+        return [self.shard(i) for i in range(self.num_shards)]
+
+    @property
+    def loaded_shards(self):
+        return sum(store is not None for store in self._shards)
+
+    def _map(self, fn, shard_ids):
+        """fn(shard_id) for each shard, in parallel on the shared pool; results in order."""
+        shard_ids = list(shard_ids)
+        if len(shard_ids) == 1:
+            return [fn(shard_ids[0])]
+        return list(_search_pool().map(fn, shard_ids))
+
+    def _target_shards(self, filters):
+        # Sources live in exactly one shard, so a source filter skips the others entirely
+        sources = (filters or {}).get("source")
+        if sources is None:
+            return range(self.num_shards)
+        sources = [sources] if isinstance(sources, str) else sources
+        return sorted({shard_of(source, self.num_shards) for source in sources})
+
+    @property
+    def is_trained(self):
+        return all(shard.is_trained for shard in self.shards)
+
+    @property
+    def keeps_full_vectors(self):
+        return is_lossy_spec(self.index_spec)
+
+    @property
+    def has_sparse_index(self):
+        return all(shard.has_sparse_index or not shard.live_count for shard in self.shards)
+
+    @property
+    def live_count(self):
+        return sum(shard.live_count for shard in self.shards)
+
+    @property
+    def dirty(self):
+        return any(store is not None and store.dirty for store in self._shards)
+
+    def train(self, force=False):
+        return all(self._map(lambda i: self.shard(i).train(force), range(self.num_shards)))
+
+    def add(self, embeddings, metadata_list, ids=None):
+        """Routes each chunk to its source's shard; returns the stable ids (see VectorStore.add)."""
+        if len(metadata_list) != len(embeddings):
+            raise ValueError("Number of embeddings must match number of metadata entries.")
+        if ids is None:
+            ids = np.arange(self.next_id, self.next_id + len(metadata_list), dtype=np.int64)
+        else:
+            ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+            if any((shard.positions_of(ids) != -1).any() for shard in self.shards):
+                raise ValueError("Some chunk ids are already in the index; use upsert() to replace them.")
+        if not len(ids):
+            return ids
+
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(metadata_list), -1)
+        rows_by_shard = defaultdict(list)
+        for row, meta in enumerate(metadata_list):
+            rows_by_shard[shard_of(meta["source"], self.num_shards)].append(row)
+        for i, rows in rows_by_shard.items():
+            self.shard(i).add(embeddings[rows], [metadata_list[row] for row in rows], ids=ids[rows])
+        self.next_id = max(self.next_id, int(ids.max()) + 1)
+        return ids
+
+    def remove(self, ids):
+        return sum(shard.remove(ids) for shard in self.shards)
+
+    def upsert(self, ids, embeddings, metadata_list):
+        self.remove(ids)
+        return self.add(embeddings, metadata_list, ids=ids)
+
+    def needs_compaction(self, threshold=COMPACTION_THRESHOLD):
+        return any(shard.needs_compaction(threshold) for shard in self.shards)
+
+    def compact(self, threshold=0.0):
+        """Compacts the shards whose tombstones reach threshold (default: any), in parallel."""
+        def compact_shard(i):
+            shard = self.shard(i)
+            return shard.compact() if shard.needs_compaction(threshold) else 0
+        return sum(self._map(compact_shard, range(self.num_shards)))
+
+    def search(self, query_vector, k=3, nprobe=None, ef_search=None, rerank_factor=None, filters=None):
+        query_vector = np.array(query_vector).reshape(1, -1)
+        return self.search_batch(query_vector, k=k, nprobe=nprobe, ef_search=ef_search,
+                                 rerank_factor=rerank_factor, filters=filters)[0]
+
+    def search_batch(self, query_matrix, k=3, nprobe=None, ef_search=None, rerank_factor=None, filters=None):
+        """Searches the shards in parallel and merges their top-k lists per query."""
+        query_matrix = np.array(query_matrix).astype('float32').reshape(-1, self.dimension)
+        faiss.normalize_L2(query_matrix)
+        targets = self._target_shards(filters)
+        if not targets:
+            return [[] for _ in range(len(query_matrix))]
+        per_shard = self._map(
+            lambda i: self.shard(i).search_batch(query_matrix, k=k, nprobe=nprobe, ef_search=ef_search,
+                                                 rerank_factor=rerank_factor, filters=filters),
+            targets)
+        # Each shard's list is already sorted by score, so a k-way heap merge suffices
+        return [list(islice(heapq.merge(*rows, key=lambda hit: -hit["score"]), k))
+                for rows in zip(*per_shard)]
+
+    def sparse_search(self, query, k=5, filters=None):
+        targets = self._target_shards(filters)
+        if not targets:
+            return []
+        per_shard = self._map(lambda i: self.shard(i).sparse_search(query, k=k, filters=filters), targets)
+        return list(islice(heapq.merge(*per_shard, key=lambda hit: -hit[1]), k))
+
+    def fetch(self, ids, scores=None):
+        if scores is None:
+            scores = [0.0] * len(ids)
+        found = {}
+        for shard in self.shards:
+            for hit in shard.fetch(ids, scores):
+                found[hit["id"]] = hit
+        return [found[int(chunk_id)] for chunk_id in ids if int(chunk_id) in found]
+
+    def memory_stats(self):
+        stats = [shard.memory_stats() for shard in self.shards]
+        total = {key: sum(s[key] for s in stats) for key in ("vectors", "tombstones", "index_bytes",
+                                                               "float32_bytes", "full_precision_file_bytes")}
+        return dict(total, index_spec=self.index_spec, shards=self.num_shards)
+
+    def save(self, extra_writers=()):
+        """
+        Writes all shards into one new snapshot, in parallel. Shards that were not
+        changed (or never loaded) since the last load/save are hard-linked from the
+        previous snapshot instead of being rewritten.
+        """
+        previous_dir = self.snapshot_dir
+
+        def write_shard(i, directory, version):
+            store = self._shards[i]
+            target = self._shard_dir(directory, i)
+            if previous_dir is not None and (store is None or not store.dirty):
+                _link_tree(self._shard_dir(previous_dir, i), target)
+            else:
+                os.makedirs(target)
+                self.shard(i).write_directory(target, version)
+
+        def write(directory, version):
+            self._map(lambda i: write_shard(i, directory, version), range(self.num_shards))
+            with open(os.path.join(directory, CONFIG_FILE), "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": version,
+                    "dimension": self.dimension,
+                    "index_spec": self.index_spec,
+                    "num_shards": self.num_shards,
+                    "nprobe": self.nprobe,
+                    "ef_search": self.ef_search,
+                    "rerank_factor": self.rerank_factor,
+                    "chunk_storage": self.chunk_storage,
+                    "next_id": self.next_id
+                }, f, indent=4)
+            for write_extra in extra_writers:
+                write_extra(directory)
+
+        self.version, self.snapshot_dir = publish_snapshot(self.index_path, write)
+        self._pin_snapshot()
+        for store in self._shards:
+            if store is not None:
+                store.version, store.dirty = self.version, False
+        print(f"Index saved to {self.index_path} as {self.num_shards} shards (version {self.version})")
+
+    def load(self, version=None, mmap_index=True):
+        """Reads the snapshot's config; shards themselves are loaded lazily (see shard())."""
+        directory = version_dir(self.index_path, version)
+        config = read_config(directory)
+        if config.get("num_shards") != self.num_shards:
+            print(" No existing sharded index found.")
+            return
+        self.dimension = config.get("dimension", self.dimension)
+        self.index_spec = config.get("index_spec", self.index_spec)
+        self.nprobe = config.get("nprobe", self.nprobe)
+        self.ef_search = config.get("ef_search", self.ef_search)
+        self.rerank_factor = config.get("rerank_factor", self.rerank_factor)
+        # Snapshots from before span storage hold chunk texts
+        self.chunk_storage = config.get("chunk_storage", "text")
+        self.next_id = config.get("next_id", 0)
+        self.version = config.get("version")
+        self.snapshot_dir = directory
+        self.mmap_index = mmap_index
+        self._shards = [None] * self.num_shards
+        self._pin_snapshot()
+        print(f" Sharded index opened ({self.num_shards} shards, version {self.version}).")
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+from collections import Counter
+import numpy as np
+
+VOCAB_FILE = "sparse_vocab.json"
+TERM_OFFSETS_FILE = "sparse_term_offsets.npy"
+DOC_IDS_FILE = "sparse_doc_ids.npy"
+IMPACTS_FILE = "sparse_impacts.npy"
+MAX_IMPACTS_FILE = "sparse_max_impacts.npy"
+TFS_FILE = "sparse_tfs.npy"
+DOC_LENGTHS_FILE = "sparse_doc_lengths.npy"
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"\w+")
+# "₹74,000" and "74000" should be the same token
+DIGIT_GROUP_RE = re.compile(r"(?<=\d),(?=\d)")
+
+def tokenize(text):
+    return TOKEN_RE.findall(DIGIT_GROUP_RE.sub("", text.lower()))
+
+class SparseIndex:
+    """
+    BM25 inverted index over chunk texts, stored as CSR postings.
+
+    Each posting holds a precomputed BM25 impact (IDF and length normalization
+    folded in), so a query is just a sum of impacts. Postings are sorted by
+    chunk id and memory-mapped on load. Doc ids are VectorStore positions.
+    """
+    def __init__(self, vocab, term_offsets, doc_ids, impacts, max_impacts, tfs=None, doc_lengths=None):
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.max_impacts = max_impacts
+        # Raw statistics behind the impacts, kept so add() and compact() can recompute them;
+        # None for indexes saved before they were stored (those can only be rebuilt)
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+
+    @classmethod
+    def build(cls, texts):
+        vocab = {}
+        term_ids, doc_ids, tfs, doc_lengths = cls._tokenize(texts, vocab, 0)
+
+        # Group postings by term; the stable sort keeps doc ids ascending within a term
+        order = np.argsort(term_ids, kind="stable")
+        doc_freq = np.bincount(term_ids, minlength=len(vocab))
+        term_offsets = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        return cls._with_impacts(vocab, term_offsets, doc_ids[order], tfs[order], doc_lengths)
+
+    @staticmethod
+    def _tokenize(texts, vocab, first_doc_id):
+        """Postings (term id, doc id, tf) of texts in doc order, growing vocab, plus doc lengths."""
+        term_ids, doc_ids, tfs = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(first_doc_id + i)
+                tfs.append(tf)
+        return (np.array(term_ids, dtype=np.int64), np.array(doc_ids, dtype=np.int32),
+                np.minimum(np.array(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16),
+                doc_lengths)
+
+    @classmethod
+    def _with_impacts(cls, vocab, term_offsets, doc_ids, tfs, doc_lengths):
+        """An index over grouped postings, with BM25 impacts computed from the raw statistics."""
+        doc_freq = np.diff(term_offsets)
+        n_docs = max(len(doc_lengths), 1)
+        avg_length = max(float(doc_lengths.mean()) if len(doc_lengths) else 0.0, 1.0)
+        idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        term_ids = np.repeat(np.arange(len(vocab)), doc_freq)
+        tf = tfs.astype(np.float32)
+        norm = K1 * (1 - B + B * doc_lengths[doc_ids].astype(np.float32) / avg_length)
+        impacts = (idf[term_ids] * tf * (K1 + 1) / (tf + norm)).astype(np.float32)
+
+        # Terms whose postings were all compacted away keep an empty segment: reduce over the others
+        max_impacts = np.zeros(len(vocab), dtype=np.float32)
+        present = doc_freq > 0
+        if len(impacts):
+            max_impacts[present] = np.maximum.reduceat(impacts, term_offsets[:-1][present])
+        return cls(vocab, term_offsets, doc_ids, impacts, max_impacts, tfs, doc_lengths)
+
+    @property
+    def updatable(self):
+        return self.doc_lengths is not None
+
+    @property
+    def num_docs(self):
+        """Number of docs indexed (ids 0..num_docs-1); None for indexes without statistics."""
+        return None if self.doc_lengths is None else len(self.doc_lengths)
+
+    def add(self, texts):
+        """
+        A new index with texts appended as doc ids num_docs, num_docs + 1, ... Only the
+        new texts are tokenized: existing postings are shifted into place per term, and
+        the new ones (higher doc ids) go after them, so each term stays sorted.
+        """
+        vocab = dict(self.vocab)
+        term_ids, doc_ids, tfs, doc_lengths = self._tokenize(texts, vocab, self.num_docs)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+
+        old_counts = np.zeros(len(vocab), dtype=np.int64)
+        old_counts[:len(self.vocab)] = np.diff(self.term_offsets)
+        new_counts = np.bincount(term_ids, minlength=len(vocab))
+        term_offsets = np.concatenate([[0], np.cumsum(old_counts + new_counts)]).astype(np.int64)
+        new_starts = np.cumsum(new_counts) - new_counts
+
+        merged_ids = np.empty(term_offsets[-1], dtype=np.int32)
+        merged_tfs = np.empty(term_offsets[-1], dtype=np.uint16)
+        old_dest = np.arange(len(self.doc_ids)) + np.repeat(
+            term_offsets[:len(self.vocab)] - self.term_offsets[:-1], old_counts[:len(self.vocab)])
+        new_dest = np.arange(len(doc_ids)) + np.repeat(term_offsets[:-1] + old_counts - new_starts, new_counts)
+        merged_ids[old_dest], merged_tfs[old_dest] = self.doc_ids, self.tfs
+        merged_ids[new_dest], merged_tfs[new_dest] = doc_ids, tfs
+        return self._with_impacts(vocab, term_offsets, merged_ids, merged_tfs,
+                                  np.concatenate([self.doc_lengths, doc_lengths]))
+
+    def compact(self, keep):
+        """A new index over only the docs in keep (sorted doc ids), renumbered 0..len(keep) - 1."""
+        new_ids = np.full(self.num_docs, -1, dtype=np.int64)
+        new_ids[keep] = np.arange(len(keep))
+        new_ids = new_ids[self.doc_ids]
+        alive = new_ids >= 0
+        term_ids = np.repeat(np.arange(len(self.vocab)), np.diff(self.term_offsets))
+        doc_freq = np.bincount(term_ids[alive], minlength=len(self.vocab))
+        term_offsets = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        return self._with_impacts(self.vocab, term_offsets, new_ids[alive].astype(np.int32),
+                                  np.asarray(self.tfs)[alive], np.asarray(self.doc_lengths)[keep])
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def _postings(self, term_id):
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.doc_ids[start:end], self.impacts[start:end]
+
+    def search(self, query, k=5, allowed=None, excluded=None):
+        """
+        Top-k chunks by BM25, as a list of (doc_id, score).
+        allowed optionally restricts the result to a sorted array of doc ids;
+        excluded (sorted, e.g. deleted chunks) is ignored when allowed is given.
+
+        MaxScore-style pruning: terms are processed by decreasing max impact, and once
+        the remaining terms' upper bounds can no longer lift an unseen chunk above the
+        current k-th score, their postings are only probed for existing candidates
+        (binary search) instead of being merged in full.
+        """
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+        terms = sorted(term_ids, key=lambda t: -self.max_impacts[t])
+        upper_bounds = np.array([self.max_impacts[t] for t in terms], dtype=np.float32)
+        remaining = np.cumsum(upper_bounds[::-1])[::-1]
+        # mask[doc_id] says whether a doc may be returned; ids past its end get `outside`
+        mask, outside = None, False
+        if allowed is not None:
+            if len(allowed) == 0:
+                return []
+            mask = np.zeros(int(allowed[-1]) + 1, dtype=bool)
+            mask[allowed] = True
+        elif excluded is not None and len(excluded):
+            mask, outside = np.ones(int(excluded[-1]) + 1, dtype=bool), True
+            mask[excluded] = False
+
+        cand_ids = np.empty(0, dtype=np.int32)
+        cand_scores = np.empty(0, dtype=np.float32)
+        for i, term_id in enumerate(terms):
+            ids, impacts = self._postings(term_id)
+            if not len(ids):
+                continue
+            threshold = np.partition(cand_scores, -k)[-k] if len(cand_scores) >= k else 0.0
+
+            if len(cand_scores) >= k and remaining[i] < threshold:
+                # Non-essential term: drop candidates that can't reach the threshold, probe the rest
+                alive = cand_scores + remaining[i] >= threshold
+                cand_ids, cand_scores = cand_ids[alive], cand_scores[alive]
+                pos = np.searchsorted(ids, cand_ids)
+                pos_clipped = np.minimum(pos, len(ids) - 1)
+                found = (pos < len(ids)) & (ids[pos_clipped] == cand_ids)
+                cand_scores[found] += impacts[pos_clipped[found]]
+                continue
+
+            # Essential term: merge its full posting list into the candidates
+            if mask is not None:
+                inside = ids < len(mask)
+                keep = np.full(len(ids), outside)
+                keep[inside] = mask[ids[inside]]
+                ids, impacts = ids[keep], impacts[keep]
+            all_ids = np.concatenate([cand_ids, ids])
+            all_scores = np.concatenate([cand_scores, impacts])
+            cand_ids, inverse = np.unique(all_ids, return_inverse=True)
+            cand_scores = np.bincount(inverse, weights=all_scores).astype(np.float32)
+
+        if len(cand_scores) > k:
+            top = np.argpartition(-cand_scores, k)[:k]
+        else:
+            top = np.arange(len(cand_scores))
+        top = top[np.argsort(-cand_scores[top], kind="stable")]
+        return list(zip(cand_ids[top].tolist(), cand_scores[top].tolist()))
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, VOCAB_FILE))
+
+    @staticmethod
+    def remove_files(directory):
+        for name in (VOCAB_FILE, TERM_OFFSETS_FILE, DOC_IDS_FILE, IMPACTS_FILE, MAX_IMPACTS_FILE,
+                     TFS_FILE, DOC_LENGTHS_FILE):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save(self, directory):
+        arrays = {
+            TERM_OFFSETS_FILE: self.term_offsets,
+            DOC_IDS_FILE: self.doc_ids,
+            IMPACTS_FILE: self.impacts,
+            MAX_IMPACTS_FILE: self.max_impacts
+        }
+        if self.updatable:
+            arrays[TFS_FILE] = self.tfs
+            arrays[DOC_LENGTHS_FILE] = self.doc_lengths
+        for name, array in arrays.items():
+            path = os.path.join(directory, name)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(path + ".tmp", path)
+
+        # Terms ordered by id; the vocabulary is written last and marks the index as present
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        path = os.path.join(directory, VOCAB_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        stats = [None, None]
+        if os.path.exists(os.path.join(directory, DOC_LENGTHS_FILE)):
+            stats = [np.load(os.path.join(directory, TFS_FILE), mmap_mode="r"),
+                     np.load(os.path.join(directory, DOC_LENGTHS_FILE), mmap_mode="r")]
+        return cls(
+            {term: i for i, term in enumerate(terms)},
+            np.load(os.path.join(directory, TERM_OFFSETS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, DOC_IDS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, IMPACTS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, MAX_IMPACTS_FILE), mmap_mode="r"),
+            *stats
+        )
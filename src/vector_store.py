@@ -1,68 +1,855 @@
-import faiss
 import numpy as np
 import json
 import os
+import time
+import uuid
+import shutil
+import threading
+from metadata_store import MetadataStore, CHUNK_STORAGE
+from sparse_index import SparseIndex
+from lazy_imports import lazy_module
+
+faiss = lazy_module("faiss")
+
+INDEX_FILE = "vector_store.index"
+CONFIG_FILE = "vector_store.config.json"
+FULL_VECTORS_FILE = "vectors_full.f32"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+TOMBSTONES_FILE = "tombstones.npy"
+LEGACY_METADATA_FILE = "vector_store.json"
+
+# Versioned layout: <index_path>/versions/<version>/... with CURRENT naming the live one
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+KEEP_VERSIONS = 3           # Recent snapshots kept for readers still pinned to them
+READERS_DIR = ".readers"    # Per-snapshot pin files of processes still reading it
+STALE_TMP_SECONDS = 3600    # Half-written snapshots left by a crashed writer
+
+# FAISS recommends ~39 training points per centroid
+TRAINING_POINTS_PER_CENTROID = 39
+# Codecs that store approximate vectors; their scores get re-ranked exactly
+LOSSY_CODECS = ("PQ", "SQ", "LSH", "RQ")
+DEFAULT_RERANK_FACTOR = 4
+COPY_BLOCK_ROWS = 65536
+# Filtered searches over at most this many chunks scan their exact vectors directly
+BRUTE_FORCE_MAX_SUBSET = 50_000
+SELECTION_CACHE_SIZE = 64
+# Deleted entries stay in the index as tombstones until they reach this share of it
+COMPACTION_THRESHOLD = 0.2
+
+def _mmap_io_flag():
+    # Memory-maps flat code arrays on read (older FAISS: the IVF lists only)
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+def is_lossy_spec(index_spec):
+    return any(codec in index_spec for codec in LOSSY_CODECS)
+
+def current_version(index_path):
+    """The version CURRENT points at, or None for a missing or pre-versioning index."""
+    try:
+        with open(os.path.join(index_path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def version_dir(index_path, version=None):
+    """Directory holding `version` (default: the current one); the index root for old layouts."""
+    version = version or current_version(index_path)
+    if version is None:
+        return index_path
+    return os.path.join(index_path, VERSIONS_DIR, version)
+
+def list_versions(index_path):
+    """Completed snapshot versions, oldest first."""
+    versions_path = os.path.join(index_path, VERSIONS_DIR)
+    if not os.path.isdir(versions_path):
+        return []
+    return sorted(name for name in os.listdir(versions_path) if not name.startswith("."))
+
+def index_exists(index_path):
+    directory = version_dir(index_path)
+    # Sharded snapshots keep their index files in per-shard subdirectories
+    return os.path.exists(os.path.join(directory, INDEX_FILE)) or "num_shards" in read_config(directory)
+
+def read_config(directory):
+    """The snapshot's config dict ({} for indexes saved before configs existed)."""
+    config_file = os.path.join(directory, CONFIG_FILE)
+    if not os.path.exists(config_file):
+        return {}
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _fsync_tree(directory):
+    for root, _, names in os.walk(directory):
+        for name in names:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+def publish_snapshot(index_path, write):
+    """
+    Writes a new immutable snapshot with write(directory, version) and makes it current.
+
+    Files go to versions/.tmp-<version>/, are fsynced, and the directory is renamed
+    to versions/<version>/ before CURRENT is atomically replaced, so a crash at any
+    point leaves the previous version intact and readers never see a partial index.
+    Returns (version, snapshot directory).
+    """
+    versions_path = os.path.join(index_path, VERSIONS_DIR)
+    os.makedirs(versions_path, exist_ok=True)
+    # Millisecond prefix keeps versions sortable by age
+    version = f"{time.time_ns() // 1_000_000:013d}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(versions_path, f".tmp-{version}")
+    final_dir = os.path.join(versions_path, version)
+    os.makedirs(tmp_dir)
+    try:
+        write(tmp_dir, version)
+        _fsync_tree(tmp_dir)
+        os.rename(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    current_file = os.path.join(index_path, CURRENT_FILE)
+    with open(current_file + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_file + ".tmp", current_file)
+
+    _remove_unversioned_files(index_path)
+    _prune_versions(index_path)
+    return version, final_dir
+
+def _remove_unversioned_files(index_path):
+    # Files of the pre-versioning layout are superseded by the first snapshot
+    for name in (INDEX_FILE, CONFIG_FILE, LEGACY_METADATA_FILE):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+    MetadataStore.remove_files(index_path)
+    SparseIndex.remove_files(index_path)
+
+def pin_version(directory):
+    """
+    Keeps the snapshot in `directory` from being pruned while this process may still
+    open files in it. Returns the pin to pass to unpin_version(), or None if the
+    snapshot is already gone. Pins of processes that exited are ignored.
+    """
+    readers = os.path.join(directory, READERS_DIR)
+    try:
+        # Not makedirs: a pruned snapshot must not be recreated
+        os.mkdir(readers)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        return None
+    pin = os.path.join(readers, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    open(pin, "w").close()
+    return pin
+
+def unpin_version(pin):
+    if pin is None:
+        return
+    try:
+        os.remove(pin)
+    except FileNotFoundError:
+        pass
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _is_pinned(directory):
+    readers = os.path.join(directory, READERS_DIR)
+    try:
+        pins = os.listdir(readers)
+    except FileNotFoundError:
+        return False
+    pinned = False
+    for pin in pins:
+        pid = pin.split("-", 1)[0]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            unpin_version(os.path.join(readers, pin))
+        else:
+            pinned = True
+    return pinned
+
+def _prune_versions(index_path):
+    """Drops all but the KEEP_VERSIONS newest snapshots and stale temp directories."""
+    versions_path = os.path.join(index_path, VERSIONS_DIR)
+    current = current_version(index_path)
+    older = [v for v in list_versions(index_path) if v != current]
+    for version in older[:max(0, len(older) - (KEEP_VERSIONS - 1))]:
+        directory = os.path.join(versions_path, version)
+        # Loaded stores hold their files open/mapped, which is safe on POSIX; stores
+        # that still open files lazily (sharded ones) pin their snapshot instead
+        if _is_pinned(directory):
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+    now = time.time()
+    for name in os.listdir(versions_path):
+        path = os.path.join(versions_path, name)
+        if name.startswith(".tmp-") and now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
 
 class VectorStore:
-    def __init__(self, dimension=384, index_path="index/assignment"):
+    """
+    FAISS index + chunk metadata for one index directory.
+
+    index_spec is a FAISS index_factory string (inner-product metric):
+        "Flat"          exact search (default, fine up to ~100k chunks)
+        "IVF1024,Flat"  inverted lists, exact vectors, tuned with nprobe
+        "IVF4096,PQ48"  inverted lists + product quantization, tuned with nprobe
+        "HNSW32"        graph index, tuned with ef_search
+        "SQ8" / "SQfp16" / "PQ48"  compressed flat storage (4x / 2x / 32x smaller)
+    Index types that need training buffer vectors in an exact flat index until
+    enough have been added, then train and switch over automatically.
+
+    Lossy codecs (SQ, PQ) also keep the float32 vectors in a memory-mapped file
+    next to the index: a search fetches k * rerank_factor candidates from the
+    compressed index and re-scores them exactly, so only the compressed codes
+    need to stay resident (rerank_factor=1 disables it).
+
+    Every chunk gets a stable id on add() (IndexIDMap-style, kept in a column next
+    to the positional metadata). remove(ids) and upsert() only tombstone the old
+    entries - searches skip them - so no index type has to be rewritten per
+    delete; compact() drops them for good once they pass COMPACTION_THRESHOLD.
+
+    chunk_storage="spans" keeps each source document once and chunks as spans
+    of it instead of full chunk texts (see MetadataStore); a loaded store uses
+    the mode it was saved with.
+    """
+    def __init__(self, dimension=384, index_path="index/assignment", index_spec="Flat",
+                 nprobe=16, ef_search=64, rerank_factor=DEFAULT_RERANK_FACTOR, chunk_storage=CHUNK_STORAGE):
         self.dimension = dimension
         self.index_path = index_path
+        self.index_spec = index_spec
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rerank_factor = rerank_factor
+        self.metadata = MetadataStore(storage=chunk_storage)
+        # Optional BM25 side index over the same positions; None whenever it would be stale
+        self.sparse_index = None
+        # Snapshot this store was loaded from / saved as. Changes on every save,
+        # which lets caches keyed on this index notice a rebuild
+        self.version = None
+        self.snapshot_dir = None
+        # True when there are changes since the last load/save
+        self.dirty = False
+        self._untrained = None
+        # Full-precision copies for re-ranking: memory-mapped on load, appended batches in memory
+        self._full_vectors = None
+        self._pending_full = []
+        self._selections = {}
+        self._direct_map_lock = threading.Lock()
+        # Stable chunk id per position: saved column plus appended batches
+        self._chunk_ids = np.empty(0, dtype=np.int64)
+        self._pending_ids = []
+        self._id_lookup = None
+        self.next_id = 0
+        # Sorted positions of deleted entries, skipped by every search
+        self.tombstones = np.empty(0, dtype=np.int64)
+        self.index = self._create_index()
+
+    def _create_index(self):
         # IndexFlatIP calculates inner product, which equals cosine similarity for normalized vectors
-        self.index = faiss.IndexFlatIP(dimension)
-        self.metadata = []
+        if self.index_spec == "Flat":
+            return faiss.IndexFlatIP(self.dimension)
+
+        index = faiss.index_factory(self.dimension, self.index_spec, faiss.METRIC_INNER_PRODUCT)
+        if index.is_trained:
+            return index
+
+        # Serve exact search from a staging flat index until there is enough data to train
+        self._untrained = index
+        return faiss.IndexFlatIP(self.dimension)
+
+    @property
+    def is_trained(self):
+        return self._untrained is None
+
+    @property
+    def keeps_full_vectors(self):
+        return is_lossy_spec(self.index_spec)
+
+    # A plain store is its own single shard (see sharded_store.ShardedVectorStore)
+    num_shards = 1
+
+    @property
+    def shards(self):
+        return [self]
 
-    def add(self, embeddings, metadata_list):
+    @property
+    def has_sparse_index(self):
+        """True when the BM25 index covers every stored chunk (see update_sparse_index)."""
+        if self.sparse_index is None:
+            return False
+        return self.sparse_index.num_docs in (None, len(self.metadata))
+
+    @property
+    def chunk_storage(self):
+        return self.metadata.storage
+
+    @property
+    def live_count(self):
+        return self.index.ntotal - len(self.tombstones)
+
+    @property
+    def tombstone_ratio(self):
+        return len(self.tombstones) / self.index.ntotal if self.index.ntotal else 0.0
+
+    def needs_compaction(self, threshold=COMPACTION_THRESHOLD):
+        return len(self.tombstones) > 0 and self.tombstone_ratio >= threshold
+
+    def min_training_vectors(self):
+        if self._untrained is None:
+            return 0
+        centroids = 1
+        try:
+            centroids = faiss.extract_index_ivf(self._untrained).nlist
+        except RuntimeError:
+            pass
+        untrained = faiss.downcast_index(self._untrained)
+        pq = getattr(untrained, "pq", None)
+        if pq is not None:
+            centroids = max(centroids, pq.ksub)
+        if isinstance(untrained, faiss.IndexScalarQuantizer):
+            # SQ8 learns per-dimension ranges; give it a sample as large as a PQ codebook's
+            centroids = max(centroids, 256)
+        return centroids * TRAINING_POINTS_PER_CENTROID
+
+    def train(self, force=False):
+        """
+        Trains the configured index on the buffered vectors and moves them into it.
+        Returns True once the store is backed by the trained index.
+        """
+        if self._untrained is None:
+            return True
+        if self.index.ntotal == 0 or (not force and self.index.ntotal < self.min_training_vectors()):
+            return False
+
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        print(f"Training {self.index_spec} index on {len(vectors)} vectors...")
+        self._untrained.train(vectors)
+        self._untrained.add(vectors)
+        self.index = self._untrained
+        self._untrained = None
+        return True
+
+    def add(self, embeddings, metadata_list, ids=None):
+        """
+        Appends chunks and returns their stable ids: `ids` if given (they must not
+        be live already, see upsert()), else newly assigned ones.
+        """
         if len(metadata_list) != len(embeddings):
             raise ValueError("Number of embeddings must match number of metadata entries.")
-        
+        if ids is None:
+            ids = np.arange(self.next_id, self.next_id + len(metadata_list), dtype=np.int64)
+        else:
+            ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+            if len(ids) != len(metadata_list) or len(np.unique(ids)) != len(ids):
+                raise ValueError("ids must be unique and match the number of metadata entries.")
+            if len(ids) and (ids < 0).any():
+                raise ValueError("Chunk ids must be non-negative.")
+            if (self.positions_of(ids) != -1).any():
+                raise ValueError("Some chunk ids are already in the index; use upsert() to replace them.")
+        if not len(ids):
+            return ids
+
         # Ensure float32 for FAISS
         embeddings_np = np.array(embeddings).astype('float32')
-        
+
         # Defensive normalization (optional but robust)
         faiss.normalize_L2(embeddings_np)
-        
+
         self.index.add(embeddings_np)
+        if self.keeps_full_vectors:
+            self._pending_full.append(embeddings_np)
         self.metadata.extend(metadata_list)
+        self._pending_ids.append(ids)
+        self._id_lookup = None
+        self.next_id = max(self.next_id, int(ids.max()) + 1)
+        self._selections.clear()
+        if self.sparse_index is not None and not self.sparse_index.updatable:
+            # Saved without BM25 statistics: update_sparse_index() rebuilds it in full
+            self.sparse_index = None
+        self.dirty = True
+        self.train()
+        return ids
+
+    def update_sparse_index(self):
+        """
+        Brings the BM25 index up to date with the chunks added since it was built, reading
+        and tokenizing only those (all chunks if there is no index yet). Removed chunks
+        stay in it as tombstones until compact().
+        """
+        if self.has_sparse_index:
+            return
+        if self.sparse_index is None:
+            self.sparse_index = SparseIndex.build([self.metadata.text(i) for i in range(len(self.metadata))])
+        else:
+            start = self.sparse_index.num_docs
+            self.sparse_index = self.sparse_index.add([self.metadata.text(i) for i in range(start, len(self.metadata))])
+        self.dirty = True
+
+    def remove(self, ids):
+        """
+        Deletes chunks by stable id and returns how many were live. The entries are
+        tombstoned rather than dropped from the index, so positions (and the BM25
+        index over them) stay valid until compact(). Unknown ids are ignored.
+        """
+        positions = self.positions_of(ids)
+        positions = positions[positions != -1]
+        if not len(positions):
+            return 0
+        self.tombstones = np.union1d(self.tombstones, positions)
+        self._selections.clear()
+        self.dirty = True
+        return len(positions)
+
+    def upsert(self, ids, embeddings, metadata_list):
+        """Replaces the chunks with these stable ids (adding the ones that don't exist yet)."""
+        self.remove(ids)
+        return self.add(embeddings, metadata_list, ids=ids)
+
+    def chunk_ids(self, positions=None):
+        """Stable ids of the given positions (default: all of them)."""
+        if self._pending_ids:
+            self._chunk_ids = np.concatenate([self._chunk_ids, *self._pending_ids])
+            self._pending_ids = []
+        if positions is None:
+            return self._chunk_ids
+        return self._chunk_ids[np.asarray(positions, dtype=np.int64)]
+
+    def positions_of(self, ids):
+        """Current positions of live chunks by stable id; -1 for unknown or removed ids."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        all_ids = self.chunk_ids()
+        if self._id_lookup is None:
+            # Stable sort: an upserted id's newest (live) entry comes last among its copies
+            order = np.argsort(all_ids, kind="stable")
+            self._id_lookup = (order, all_ids[order])
+        order, sorted_ids = self._id_lookup
+        slot = np.searchsorted(sorted_ids, ids, side="right") - 1
+        found = slot >= 0
+        found[found] = sorted_ids[slot[found]] == ids[found]
+        positions = np.full(len(ids), -1, dtype=np.int64)
+        positions[found] = order[slot[found]]
+        positions[np.isin(positions, self.tombstones)] = -1
+        return positions
+
+    def live_positions(self):
+        return np.setdiff1d(np.arange(self.index.ntotal, dtype=np.int64), self.tombstones, assume_unique=True)
+
+    def compact(self):
+        """
+        Rewrites the index with only its live entries and returns the number dropped.
+        Vectors are copied from the current index (exact ones where available), so
+        nothing is re-embedded and trained quantizers are reused; stable ids survive.
+        """
+        if not len(self.tombstones):
+            return 0
+        live = self.live_positions()
+        dropped = len(self.tombstones)
+        print(f"Compacting {self.index_spec} index: dropping {dropped} deleted chunks...")
+        rebuild_sparse = self.sparse_index is not None and not self.sparse_index.updatable
+        if self.sparse_index is not None and not rebuild_sparse:
+            self.update_sparse_index()
+            self.sparse_index = self.sparse_index.compact(live)
+
+        had_full = self._has_full_vectors()
+        index = faiss.clone_index(self.index)
+        index.reset()
+        full_blocks = []
+        for start in range(0, len(live), COPY_BLOCK_ROWS):
+            block = live[start:start + COPY_BLOCK_ROWS]
+            vectors = self._exact_vectors(block)
+            if vectors is None:
+                # Codes without exact copies: decoded vectors re-encode to (nearly) the same codes
+                vectors = self._decoded_vectors(block)
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            index.add(vectors)
+            if had_full:
+                full_blocks.append(vectors)
+
+        self.index = index
+        self._full_vectors = None
+        self._pending_full = full_blocks
+        self.metadata.delete(self.tombstones.tolist())
+        self._chunk_ids = self.chunk_ids()[live]
+        self._id_lookup = None
+        self.tombstones = np.empty(0, dtype=np.int64)
+        self._selections.clear()
+        self.dirty = True
+        if rebuild_sparse:
+            self.sparse_index = None
+            self.update_sparse_index()
+        return dropped
+
+    def _decoded_vectors(self, positions):
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIVF):
+            with self._direct_map_lock:
+                if index.direct_map.type == faiss.DirectMap.NoMap:
+                    index.make_direct_map(True)
+        return self.index.reconstruct_batch(positions)
+
+    def _search_parameters(self, nprobe=None, ef_search=None, selector=None):
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF(nprobe=nprobe or self.nprobe)
+        elif isinstance(index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=ef_search or self.ef_search)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if selector is not None:
+            params.sel = selector
+        return params
+
+    def select(self, filters):
+        """Live positions matching a metadata filter (see MetadataStore.select), cached per filter."""
+        key = tuple(sorted((field, (value,) if isinstance(value, str) else tuple(value))
+                           for field, value in filters.items()))
+        positions = self._selections.get(key)
+        if positions is None:
+            positions = self.metadata.select(filters)
+            if len(self.tombstones):
+                positions = np.setdiff1d(positions, self.tombstones, assume_unique=True)
+            if len(self._selections) >= SELECTION_CACHE_SIZE:
+                self._selections.pop(next(iter(self._selections)))
+            self._selections[key] = positions
+        return positions
+
+    def _exact_vectors(self, positions):
+        """Exact vectors for positions if they can be read without decoding, else None."""
+        if self._has_full_vectors():
+            return self.full_vectors(positions)
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        if isinstance(index, faiss.IndexFlat):
+            stored = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * self.dimension)
+            return stored.reshape(index.ntotal, self.dimension)[positions]
+        if isinstance(index, faiss.IndexIVFFlat):
+            with self._direct_map_lock:
+                if index.direct_map.type == faiss.DirectMap.NoMap:
+                    # Position -> (list, offset) table, 8 bytes per vector, built once
+                    index.make_direct_map(True)
+            return index.reconstruct_batch(positions)
+        return None
+
+    def _search_subset(self, query_matrix, k, positions, vectors):
+        """Brute-force top-k over a filtered subset; cost is proportional to its size."""
+        scores = query_matrix @ vectors.T
+        k_eff = min(k, len(positions))
+        top = np.argpartition(-scores, k_eff - 1, axis=1)[:, :k_eff]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        distances = np.full((len(query_matrix), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(query_matrix), k), -1, dtype=np.int64)
+        distances[:, :k_eff] = np.take_along_axis(top_scores, order, axis=1)
+        indices[:, :k_eff] = positions[np.take_along_axis(top, order, axis=1)]
+        return distances, indices
+
+    def search(self, query_vector, k=3, nprobe=None, ef_search=None, rerank_factor=None, filters=None):
+        # Ensure query is 2D array (1, dimension)
+        query_vector = np.array(query_vector).reshape(1, -1)
+        return self.search_batch(query_vector, k=k, nprobe=nprobe, ef_search=ef_search,
+                                 rerank_factor=rerank_factor, filters=filters)[0]
+
+    def full_vectors(self, positions):
+        """Exact float32 vectors at the given positions (lossy indexes only)."""
+        base = 0 if self._full_vectors is None else len(self._full_vectors)
+        if len(self._pending_full) > 1:
+            self._pending_full = [np.concatenate(self._pending_full)]
+        positions = np.asarray(positions, dtype=np.int64)
+        out = np.empty((len(positions), self.dimension), dtype=np.float32)
+        stored = positions < base
+        if stored.any():
+            out[stored] = self._full_vectors[positions[stored]]
+        if (~stored).any():
+            out[~stored] = self._pending_full[0][positions[~stored] - base]
+        return out
+
+    def _has_full_vectors(self):
+        count = 0 if self._full_vectors is None else len(self._full_vectors)
+        count += sum(len(v) for v in self._pending_full)
+        return self.keeps_full_vectors and count == self.index.ntotal
+
+    def _rerank(self, query_matrix, indices, k):
+        """Re-scores candidate ids with the exact vectors and keeps the top k per query."""
+        valid = indices != -1
+        rows = np.nonzero(valid)[0]
+        candidates, inverse = np.unique(indices[valid], return_inverse=True)
+        # Sorted, de-duplicated positions keep the memory-mapped reads sequential
+        vectors = self.full_vectors(candidates)[inverse]
+        scores = np.full(indices.shape, -np.inf, dtype=np.float32)
+        scores[valid] = np.einsum("ij,ij->i", vectors, query_matrix[rows])
+
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        top_scores = np.take_along_axis(scores, order, axis=1)
+        top_ids = np.take_along_axis(indices, order, axis=1)
+        top_ids[np.isneginf(top_scores)] = -1
+        return top_scores, top_ids
+
+    def _accepts_selector(self):
+        # Flat PQ / RQ / fast-scan codes reject search parameters altogether
+        index = faiss.downcast_index(self.index)
+        return isinstance(index, (faiss.IndexFlat, faiss.IndexScalarQuantizer, faiss.IndexIVF, faiss.IndexHNSW))
+
+    def _search_post_filtered(self, query_matrix, k, allowed=None):
+        """Over-fetches and drops hits outside allowed (or tombstoned), doubling until k survive."""
+        fetch_k = k
+        while True:
+            fetch_k = min(fetch_k * 2, max(self.index.ntotal, k))
+            distances, indices = self.index.search(query_matrix, fetch_k)
+            if allowed is not None:
+                ok = np.isin(indices, allowed)
+            else:
+                ok = (indices != -1) & ~np.isin(indices, self.tombstones)
+            if ok.sum(axis=1).min() >= k or fetch_k >= self.index.ntotal:
+                break
+        order = np.argsort(~ok, axis=1, kind="stable")[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        ok = np.take_along_axis(ok, order, axis=1)
+        distances[~ok] = -np.inf
+        indices[~ok] = -1
+        return distances, indices
+
+    def search_ids(self, query_matrix, k=3, nprobe=None, ef_search=None, rerank_factor=None, allowed=None):
+        """
+        Raw search: (scores, positions) arrays of shape (n_queries, k), -1 for no match.
+        query_matrix must already be normalized float32. allowed restricts the search
+        to a sorted array of positions (see select()); tombstoned entries never match.
+        """
+        selector = None
+        if allowed is None and len(self.tombstones):
+            # Keep a reference to the inner selector: IDSelectorNot doesn't own it
+            dead = faiss.IDSelectorBatch(self.tombstones)
+            selector = faiss.IDSelectorNot(dead)
+        if allowed is not None:
+            if len(allowed) == 0:
+                return (np.full((len(query_matrix), k), -np.inf, dtype=np.float32),
+                        np.full((len(query_matrix), k), -1, dtype=np.int64))
+            if len(allowed) <= BRUTE_FORCE_MAX_SUBSET:
+                vectors = self._exact_vectors(allowed)
+                if vectors is not None:
+                    return self._search_subset(query_matrix, k, allowed, vectors)
+            # Large subsets (or codes that can't be scanned directly): let FAISS skip the rest
+            selector = faiss.IDSelectorBatch(np.ascontiguousarray(allowed, dtype=np.int64))
+
+        rerank_factor = self.rerank_factor if rerank_factor is None else rerank_factor
+        rerank = rerank_factor > 1 and self._has_full_vectors()
+        fetch_k = k * rerank_factor if rerank else k
+
+        if selector is not None and not self._accepts_selector():
+            distances, indices = self._search_post_filtered(query_matrix, fetch_k, allowed)
+            return self._rerank(query_matrix, indices, k) if rerank else (distances, indices)
+
+        params = self._search_parameters(nprobe, ef_search, selector)
+        if params is not None:
+            distances, indices = self.index.search(query_matrix, fetch_k, params=params)
+        else:
+            distances, indices = self.index.search(query_matrix, fetch_k)
+        if rerank:
+            distances, indices = self._rerank(query_matrix, indices, k)
+        return distances, indices
+
+    def search_batch(self, query_matrix, k=3, nprobe=None, ef_search=None, rerank_factor=None, filters=None):
+        """
+        Searches many queries with a single FAISS call.
+        filters, e.g. {"source": "doc2.md", "section": "Pricing"}, restricts the search
+        to matching chunks before ranking (not a post-filter).
+        Returns one result list per query row.
+        """
+        query_matrix = np.array(query_matrix).astype('float32').reshape(-1, self.dimension)
 
-    def search(self, query_vector, k=3):
-        # Ensure query is 2D array (1, dimension) and float32
-        query_vector = np.array(query_vector).astype('float32').reshape(1, -1)
-        
         # Defensive normalization to match the index
-        faiss.normalize_L2(query_vector)
-        
-        distances, indices = self.index.search(query_vector, k)
-        
+        faiss.normalize_L2(query_matrix)
+
+        allowed = self.select(filters) if filters else None
+        distances, indices = self.search_ids(query_matrix, k, nprobe, ef_search, rerank_factor, allowed)
+
+        # FAISS returns -1 if no match; decode each distinct hit only once
+        valid = indices != -1
+        hit_ids, inverse = np.unique(indices[valid], return_inverse=True)
+        records = self.metadata.lookup(hit_ids)
+        hit_records = [records[i] for i in inverse.tolist()]
+        hit_scores = distances[valid].tolist()
+        hit_chunk_ids = self.chunk_ids(indices[valid]).tolist()
+        counts = valid.sum(axis=1).tolist()
+
         results = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1: # FAISS returns -1 if no match
-                results.append({
-                    "text": self.metadata[idx]["text"],
-                    "source": self.metadata[idx]["source"],
-                    "score": float(distances[0][i])
-                })
+        start = 0
+        for count in counts:
+            results.append([
+                {"id": chunk_id, "text": text, "source": source, "score": score}
+                for chunk_id, (source, text), score in zip(hit_chunk_ids[start:start + count],
+                                                           hit_records[start:start + count],
+                                                           hit_scores[start:start + count])
+            ])
+            start += count
         return results
 
-    def save(self):
-        if not os.path.exists(self.index_path):
-            os.makedirs(self.index_path)
-            
-        faiss.write_index(self.index, os.path.join(self.index_path, "vector_store.index"))
-        
-        # Save readable JSON metadata (indent=4 is great for debugging)
-        with open(os.path.join(self.index_path, "vector_store.json"), "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f, indent=4, ensure_ascii=False)
-        print(f"Index saved to {self.index_path}")
-
-    def load(self):
-        index_file = os.path.join(self.index_path, "vector_store.index")
-        metadata_file = os.path.join(self.index_path, "vector_store.json")
-        
-        if not os.path.exists(index_file) or not os.path.exists(metadata_file):
+    def fetch(self, ids, scores=None):
+        """Result dicts for explicit stable ids (e.g. hits from the sparse index); removed ids are skipped."""
+        if scores is None:
+            scores = [0.0] * len(ids)
+        positions = self.positions_of(ids)
+        found = [(int(chunk_id), int(pos), score) for chunk_id, pos, score in zip(ids, positions, scores) if pos != -1]
+        records = self.metadata.lookup(np.array([pos for _, pos, _ in found], dtype=np.int64))
+        return [
+            {"id": chunk_id, "text": text, "source": source, "score": float(score)}
+            for (chunk_id, _, score), (source, text) in zip(found, records)
+        ]
+
+    def sparse_search(self, query, k=5, filters=None):
+        """BM25 hits as (stable id, score), restricted like search_batch(); [] without an up-to-date sparse index."""
+        if not self.has_sparse_index:
+            return []
+        if filters:
+            hits = self.sparse_index.search(query, k=k, allowed=self.select(filters))
+        else:
+            hits = self.sparse_index.search(query, k=k, excluded=self.tombstones)
+        if not hits:
+            return []
+        chunk_ids = self.chunk_ids([pos for pos, _ in hits]).tolist()
+        return [(chunk_id, score) for chunk_id, (_, score) in zip(chunk_ids, hits)]
+
+    def save(self, extra_writers=()):
+        """
+        Writes a new immutable snapshot and makes it current (see publish_snapshot).
+        extra_writers are callables(directory) for companion files (e.g. the build manifest).
+        """
+        def write(directory, version):
+            self.write_directory(directory, version)
+            for write_extra in extra_writers:
+                write_extra(directory)
+
+        self.version, self.snapshot_dir = publish_snapshot(self.index_path, write)
+        self.dirty = False
+        print(f"Index saved to {self.index_path} (version {self.version})")
+
+    def write_directory(self, directory, version):
+        """Writes this store's files into an existing directory (one snapshot, or one shard of it)."""
+        faiss.write_index(self.index, os.path.join(directory, INDEX_FILE))
+        self.metadata.save(directory)
+        if self.has_sparse_index:
+            self.sparse_index.save(directory)
+        if self.keeps_full_vectors:
+            self._write_full_vectors(os.path.join(directory, FULL_VECTORS_FILE))
+        np.save(os.path.join(directory, CHUNK_IDS_FILE), self.chunk_ids())
+        np.save(os.path.join(directory, TOMBSTONES_FILE), self.tombstones)
+        with open(os.path.join(directory, CONFIG_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": version,
+                "dimension": self.dimension,
+                "index_spec": self.index_spec,
+                "trained": self.is_trained,
+                "nprobe": self.nprobe,
+                "ef_search": self.ef_search,
+                "rerank_factor": self.rerank_factor,
+                "next_id": self.next_id
+            }, f, indent=4)
+        self.version = version
+
+    def _write_full_vectors(self, path):
+        # Raw row-major float32, streamed so the mapped part never has to be materialized
+        with open(path, "wb") as f:
+            if self._full_vectors is not None:
+                for start in range(0, len(self._full_vectors), COPY_BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(self._full_vectors[start:start + COPY_BLOCK_ROWS]).tobytes())
+            for block in self._pending_full:
+                f.write(block.tobytes())
+
+    def _load_full_vectors(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        return np.memmap(path, dtype=np.float32, mode="r").reshape(-1, self.dimension)
+
+    def memory_stats(self):
+        """Bytes held by the index vs. plain float32 storage, for capacity planning."""
+        count = self.index.ntotal
+        float32_bytes = count * self.dimension * 4
+        return {
+            "vectors": count,
+            "tombstones": len(self.tombstones),
+            "index_spec": self.index_spec,
+            "index_bytes": int(faiss.serialize_index(self.index).nbytes),
+            "float32_bytes": float32_bytes,
+            # Memory-mapped: only the pages of re-ranked candidates are read
+            "full_precision_file_bytes": float32_bytes if self.keeps_full_vectors else 0
+        }
+
+    def load(self, version=None, mmap_index=False):
+        """
+        Loads the current snapshot, or pins a specific `version` (see list_versions).
+        mmap_index memory-maps the FAISS codes instead of reading them into RAM;
+        such a store is read-only.
+        """
+        self.load_directory(version_dir(self.index_path, version), mmap_index)
+
+    def load_directory(self, directory, mmap_index=False):
+        index_file = os.path.join(directory, INDEX_FILE)
+        legacy_file = os.path.join(directory, LEGACY_METADATA_FILE)
+        config_file = os.path.join(directory, CONFIG_FILE)
+        has_metadata = MetadataStore.exists(directory) or os.path.exists(legacy_file)
+
+        if not os.path.exists(index_file) or not has_metadata:
             print(" No existing index found.")
             return
 
-        self.index = faiss.read_index(index_file)
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            self.metadata = json.load(f)
-        print(f" Index loaded with {self.index.ntotal} documents.")
\ No newline at end of file
+        # Indexes saved before index specs existed are plain IndexFlatIP
+        config = read_config(directory)
+        self.dimension = config.get("dimension", self.dimension)
+        self.index_spec = config.get("index_spec", "Flat")
+        self.nprobe = config.get("nprobe", self.nprobe)
+        self.ef_search = config.get("ef_search", self.ef_search)
+        self.rerank_factor = config.get("rerank_factor", self.rerank_factor)
+        # Indexes without a recorded version are identified by their file's mtime
+        self.version = config.get("version") or str(os.stat(index_file).st_mtime_ns)
+
+        self._untrained = None
+        self.index = faiss.read_index(index_file, _mmap_io_flag() if mmap_index else 0)
+        if not config.get("trained", True):
+            # Saved while still buffering in the staging flat index
+            self._untrained = faiss.index_factory(self.dimension, self.index_spec, faiss.METRIC_INNER_PRODUCT)
+
+        if MetadataStore.exists(directory):
+            self.metadata = MetadataStore.load(directory)
+        else:
+            # Indexes built before the binary format: migrated on the next save()
+            self.metadata = MetadataStore.load_json(legacy_file)
+
+        self.sparse_index = None
+        if SparseIndex.exists(directory):
+            self.sparse_index = SparseIndex.load(directory)
+        self._full_vectors = self._load_full_vectors(os.path.join(directory, FULL_VECTORS_FILE))
+        self._pending_full = []
+        self._selections = {}
+
+        # Snapshots from before stable ids: positions become the ids
+        ids_file = os.path.join(directory, CHUNK_IDS_FILE)
+        if os.path.exists(ids_file):
+            self._chunk_ids = np.load(ids_file, mmap_mode="r")
+        else:
+            self._chunk_ids = np.arange(self.index.ntotal, dtype=np.int64)
+        self._pending_ids = []
+        self._id_lookup = None
+        self.next_id = config.get("next_id", len(self._chunk_ids))
+        tombstones_file = os.path.join(directory, TOMBSTONES_FILE)
+        self.tombstones = np.load(tombstones_file) if os.path.exists(tombstones_file) else np.empty(0, dtype=np.int64)
+        self.snapshot_dir = directory
+        self.dirty = False
+        print(f" Index loaded with {self.live_count} documents.")
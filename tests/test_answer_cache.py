@@ -0,0 +1,20 @@
+import numpy as np
+
+from answer_cache import AnswerCache
+
+KEY = ("index/test", "v1", "Groq")
+
+
+def test_entries_are_not_shared_with_callers():
+    cache = AnswerCache()
+    embedding = np.ones(4, dtype="float32") / 2
+    value = {"answer": "42", "sources": [{"source": "doc1.md", "text": "..."}]}
+    cache.store(KEY, embedding, value)
+    value["sources"][0]["score"] = 1.0
+
+    first = cache.lookup(KEY, embedding)
+    first["sources"][0]["source"] = "changed.md"
+    first["sources"].append({"source": "extra.md"})
+
+    second = cache.lookup(KEY, embedding)
+    assert second["sources"] == [{"source": "doc1.md", "text": "..."}]
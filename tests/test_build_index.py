@@ -0,0 +1,34 @@
+import os
+import shutil
+
+import pytest
+
+import build_index
+
+LEGACY_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "index", "custom")
+
+
+@pytest.fixture
+def legacy_index(tmp_path):
+    """A copy of an index saved before manifests and snapshots existed."""
+    path = str(tmp_path / "custom")
+    shutil.copytree(LEGACY_INDEX, path)
+    return path
+
+
+def _snapshot(path):
+    return {name: open(os.path.join(path, name), "rb").read() for name in sorted(os.listdir(path))}
+
+
+def test_upsert_refuses_index_without_manifest(legacy_index):
+    before = _snapshot(legacy_index)
+    with pytest.raises(ValueError, match="Cannot update"):
+        build_index.upsert_documents([{"source": "new.md", "text": "# New\nSome text."}], legacy_index)
+    assert _snapshot(legacy_index) == before
+
+
+def test_remove_refuses_index_without_manifest(legacy_index):
+    before = _snapshot(legacy_index)
+    with pytest.raises(ValueError, match="Cannot update"):
+        build_index.remove_documents(["Cover Letter  Product Designer.pdf"], legacy_index)
+    assert _snapshot(legacy_index) == before
@@ -0,0 +1,26 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def _vectors(n, dimension=4, seed=0):
+    return np.random.default_rng(seed).random((n, dimension), dtype=np.float32)
+
+
+def test_store_evicts_rows_written_by_another_instance(tmp_path):
+    # Both open the empty directory; the first then fills every row
+    first = EmbeddingCache(str(tmp_path), "model", dimension=4, max_entries=8, memory_entries=0)
+    second = EmbeddingCache(str(tmp_path), "model", dimension=4, max_entries=8)
+    first.store([f"first {i}" for i in range(8)], _vectors(8))
+
+    vectors = _vectors(3, seed=1)
+    second.store(["a", "b", "c"], vectors)
+    found, missing = second.lookup(["a", "b", "c"])
+    assert missing == []
+    assert np.allclose(found, vectors)
+
+    # The first instance (no in-memory LRU) sees its evicted rows as misses, never as the new vectors
+    found, missing = first.lookup([f"first {i}" for i in range(8)])
+    assert len(missing) == 3
+    kept = [i for i in range(8) if i not in missing]
+    assert np.allclose(found[kept], _vectors(8)[kept])
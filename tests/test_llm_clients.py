@@ -0,0 +1,33 @@
+import asyncio
+
+import llm_clients
+from llm_clients import LLMBackend
+
+
+def test_evicted_client_is_closed(monkeypatch):
+    monkeypatch.setattr(llm_clients, "MAX_CLIENTS", 2)
+    backend = LLMBackend("test", "http://127.0.0.1:9/v1")
+    first = backend.client("key-1")
+    backend.client("key-2")
+    assert not first.is_closed()
+    backend.client("key-3")
+    assert first.is_closed()
+    assert not backend.client("key-2").is_closed()
+
+
+def test_evicted_async_client_is_closed(monkeypatch):
+    monkeypatch.setattr(llm_clients, "MAX_CLIENTS", 2)
+    backend = LLMBackend("test", "http://127.0.0.1:9/v1")
+
+    async def evict():
+        first = backend.async_client("key-1")
+        backend.async_client("key-2")
+        backend.async_client("key-3")
+        # The close is scheduled on the loop
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return first, backend.async_client("key-3")
+
+    first, live = asyncio.run(evict())
+    assert first.is_closed()
+    assert not live.is_closed()